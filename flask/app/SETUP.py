@@ -1,25 +1,95 @@
-MODULES: list = []
-DEVICES: list = []
-DEPLOYMENTS: list = []
+import hashlib
+import json
+import threading
+import time
+
+
+class Snapshot:
+    """Immutable view of one registry refresh, with lookup indexes."""
+
+    def __init__(self, records):
+        self.records = tuple(records)
+        self.loaded_at = time.time()
+
+        # If a name repeats, the orchestrator's latest record (listed last)
+        # wins.
+        self.by_name = {record.get("name"): record for record in self.records}
+        self.by_id = {record.get("_id"): record for record in self.records}
+
+        body = json.dumps(self.records, sort_keys=True, default=str).encode()
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+
+
+class Registry:
+    """Devices, modules or deployments as last reported by the orchestrator.
+
+    Refreshes build a new Snapshot and swap it in with a single assignment,
+    so readers always see either the old or the new contents, never a
+    half-cleared list.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.loaded = False
+        # ETag the orchestrator sent with the current records, for
+        # conditional refreshes.
+        self.source_etag = None
+        self._snapshot = Snapshot([])
+        self._lock = threading.Lock()
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    def replace(self, records, source_etag=None):
+        """Swap in new records. Returns False if nothing changed."""
+        snapshot = Snapshot(records)
+        with self._lock:
+            self.loaded = True
+            self.source_etag = source_etag
+            if snapshot.etag == self._snapshot.etag:
+                return False
+            self._snapshot = snapshot
+            return True
+
+    def records(self):
+        return list(self._snapshot.records)
+
+    def by_name(self, name):
+        return self._snapshot.by_name.get(name)
+
+    def by_id(self, record_id):
+        return self._snapshot.by_id.get(record_id)
+
+    def id_for(self, name):
+        record = self.by_name(name)
+        return record.get("_id") if record else None
+
+    def __iter__(self):
+        return iter(self._snapshot.records)
+
+    def __len__(self):
+        return len(self._snapshot.records)
+
+
+MODULES = Registry("modules")
+DEVICES = Registry("devices")
+DEPLOYMENTS = Registry("deployments")
 
 def get_modules() -> list:
-    return MODULES
+    return MODULES.records()
 
 def get_devices() -> list:
-    return DEVICES
+    return DEVICES.records()
 
 def get_deployments() -> list:
-    return DEPLOYMENTS
-
-def update_modules(data: list):
-    MODULES.clear()
-    MODULES.extend(data)
+    return DEPLOYMENTS.records()
 
-def update_devices(data: list):
-    DEVICES.clear()
-    DEVICES.extend(data)
+def update_modules(data: list, source_etag=None) -> bool:
+    return MODULES.replace(data, source_etag)
 
-def update_deployments(data: list):
-    DEPLOYMENTS.clear()
-    DEPLOYMENTS.extend(data)
+def update_devices(data: list, source_etag=None) -> bool:
+    return DEVICES.replace(data, source_etag)
 
+def update_deployments(data: list, source_etag=None) -> bool:
+    return DEPLOYMENTS.replace(data, source_etag)
@@ -1,12 +1,9 @@
 from .app import app
-from .utils import pull_orchestrator_modules, pull_orchestrator_devices, pull_orchestrator_deployments
+from python_scripts import conversion_worker
 if __name__ == "__main__":
 
-    try:
-        pull_orchestrator_devices()
-        pull_orchestrator_modules()
-        pull_orchestrator_deployments()
-    except:
-        pass
-    
+    # Start importing TensorFlow in the conversion worker while the web
+    # server is already serving.
+    conversion_worker.start()
+
     app.run(host="0.0.0.0", port=8080)
\ No newline at end of file
@@ -1,15 +1,62 @@
 from flask import Flask, render_template, jsonify, request, stream_with_context, Response
-from python_scripts.download_model import download_model, get_class_names
-from python_scripts.convert_to_onnx import convert_model
-import requests
+from python_scripts.download_model import (
+    download_model,
+    get_class_names,
+    get_dsp_config,
+    dsp_feature_count,
+    tflite_model_path,
+    DSP_CONFIG_PATH,
+    PROJECT_ID,
+    PRECISIONS,
+)
+from python_scripts.conversion_worker import convert_model
+from python_scripts import conversion_cache
+from python_scripts.artifact_store import install, file_sha256, atomic_write
+from python_scripts import metrics
 import logging
 import subprocess
-from contextlib import contextmanager
+import time
+import json
+import queue
 import os
+import threading
+from collections import deque
 from .SETUP import MODULES, DEVICES, DEPLOYMENTS
-from .settings import WASMIOT_ORCHESTRATOR_URL
-from .utils import pull_orchestrator_modules, pull_orchestrator_devices, pull_orchestrator_deployments
-import csv
+from .settings import (
+    WASM_TARGET_DIR,
+    BUILD_PROFILE,
+    BUILD_JOBS,
+    MODEL_PRECISION,
+    OPTIMIZE_MODEL,
+    UPLOAD_DEDUP,
+    PIPELINE_WORKERS,
+    PIPELINE_JOB_WORKERS,
+    PIPELINE_JOB_HISTORY,
+    PIPELINE_JOB_TTL,
+    PIPELINE_TRACE,
+    MOUNT_FORMAT,
+    STREAM_WINDOW,
+    DEPLOYMENT_NAME,
+    DEPLOYMENT_SEQUENCE,
+    BATCH_DEPLOYMENT_NAME,
+    BATCH_DEPLOYMENT_SEQUENCE,
+    STREAM_STRIDE,
+    MODEL_RESULTS_URL,
+    BATCH_CONCURRENCY,
+    BATCH_MAX_WINDOWS,
+    BATCH_EXTRA_TARGETS,
+    FILE_INDEX_EXCLUDE,
+    FILE_INDEX_REFRESH_INTERVAL,
+    FILE_INDEX_PAGE_SIZE,
+    FILE_INDEX_MAX_PAGE_SIZE,
+    FILE_INDEX_MAX_DEPTH,
+)
+from . import orchestrator, inference
+from . import build_cache, variants, uploads
+from .file_index import FileIndex
+from .dag import Step, StepFailed, run_dag
+from .jobs import JobManager
+from .utils import pull_orchestrator_modules, pull_orchestrator_devices, pull_orchestrator_deployments, start_registry_refresher, registries_ready
 
 #app.logger.info()
 
@@ -19,18 +66,214 @@ logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-pull_orchestrator_devices()
-pull_orchestrator_modules()
-pull_orchestrator_deployments()
+# Registries are loaded in the background so importing the app never waits
+# on the orchestrator; /ready reports when they are warm.
+start_registry_refresher()
 
 LAST_DEPLOYMENT = None
+# Deployment without the save step, for /do_run_batch.
+BATCH_DEPLOYMENT = None
+# Model precision of LAST_DEPLOYMENT.
+LAST_PRECISION = None
+
+PIPELINE_JOBS = JobManager(PIPELINE_JOB_WORKERS, PIPELINE_JOB_HISTORY, PIPELINE_JOB_TTL)
+
+CONTINUOUS_INFERENCE = inference.ContinuousInference()
+
+FILE_INDEX = FileIndex(".", FILE_INDEX_EXCLUDE, FILE_INDEX_REFRESH_INTERVAL)
+
+CARGO_BUILD_ARGS = ["cargo", "build", "--target", "wasm32-wasip1", "--profile", BUILD_PROFILE, "--color", "never"]
+# Lines of cargo's output kept for the error message of a failed build.
+BUILD_OUTPUT_TAIL = 40
+
+# The spectral analysis constants and what picks them (see the build script).
+DSP_CONFIG_INPUTS = [DSP_CONFIG_PATH, "modules/dsp_config_default.rs", "modules/dsp_config_build.rs"]
+
+# Workspace packages, with their crate directories (including local path
+# dependencies) and compile-time inputs, used to key the build cache.
+WASM_MODULES = {
+    "spectral_analysis": {
+        "sources": ["modules/rust_spectral_analysis", "modules/mount_format"],
+        "embedded": DSP_CONFIG_INPUTS,
+    },
+    "wasi_edge_impulse_onnx": {
+        "sources": ["modules/wasi_edge_impulse_onnx", "modules/mount_format"],
+        "embedded": [
+            "models/classes.txt", "modules/classes_default.txt",
+            "models/quantization.txt", "modules/quantization_default.txt",
+            *DSP_CONFIG_INPUTS,
+        ],
+    },
+    "save_accelerometer_data": {
+        "sources": ["modules/save_accelerometer_data", "modules/wasm3_api", "modules/mount_format"],
+        "embedded": [],
+    },
+}
+
+# Orchestrator names of the modules, which the deployment sequences refer to.
+DEPLOYABLE_MODULES = ("save", "spec", "model")
+
+# Files passed between the modules and the function of each module that
+# uses them, per MOUNT_FORMAT. The binary variants write little-endian f32
+# (see modules/mount_format) and read either format.
+MOUNTS = {
+    "csv": {
+        "samples": "accelerometer_data.csv",
+        "features": "features.csv",
+        "probabilities": "probabilities.csv",
+        "save": "save_sensor_data",
+        "spec": "testailu",
+        "model": "infer_predefined_paths",
+    },
+    "binary": {
+        "samples": "accelerometer_data.bin",
+        "features": "features.bin",
+        "probabilities": "probabilities.bin",
+        "save": "save_sensor_data_bin",
+        "spec": "testailu_bin",
+        "model": "infer_predefined_paths_bin",
+    },
+}[MOUNT_FORMAT]
+
+# Streaming variants of the save and spectral functions, deployed with
+# STREAM_STRIDE set. Their window and stride come from a deployment mount.
+STREAM_FUNCTIONS = {
+    "save_sensor_data": "save_sensor_stream",
+    "save_sensor_data_bin": "save_sensor_stream_bin",
+    "testailu": "testailu_stream",
+    "testailu_bin": "testailu_stream_bin",
+}
+# Functions of the save module, in any format. They read the live sensor
+# and overwrite the samples file, so nothing posted with an execution gets
+# past a deployment that starts with one.
+SAVE_FUNCTIONS = {"save_sensor_data", "save_sensor_data_bin", "save_sensor_stream", "save_sensor_stream_bin"}
+if STREAM_STRIDE:
+    MOUNTS = {**MOUNTS, "save": STREAM_FUNCTIONS[MOUNTS["save"]], "spec": STREAM_FUNCTIONS[MOUNTS["spec"]]}
+STREAM_CONFIG_PATH = "models/stream.txt"
+# Samples per axis in the device's sensor buffer, and its axes (x, y, z).
+SENSOR_WINDOW = 104
+SENSOR_AXES = 3
+
+
+# Input shape, input and output types and quantization parameters of the
+# converted model; the classifier embeds the latter at compile time.
+QUANTIZATION_PATH = "models/quantization.txt"
+# The classifier's description uploads the model from the crate directory.
+MODULE_ONNX_MODEL_PATH = "modules/wasi_edge_impulse_onnx/model.onnx"
+MODULE_OPTIMIZED_MODEL_PATH = "modules/wasi_edge_impulse_onnx/model.nnef.tar"
+# Names the model mount the classifier is deployed with, so a module instance
+# kept alive across a redeploy doesn't load the other format's stale mount.
+MODEL_CHOICE_PATH = "models/model.txt"
+# Pipelines of different precisions can run at once, but from installing the
+# converted model on (the classifier's model and quantization files, the
+# cargo build, the uploads and the deployment) they share paths and the same
+# deployment. They take turns there: convert_model takes this lock and the
+# run releases it when it ends.
+MODEL_STAGING_LOCK = threading.Lock()
+
+# Host-side crate that writes the NNEF archive, with the classifier's input
+# shape (one window of spectral features) fixed into it. It runs natively, so
+# it skips the size-optimized release profile meant for the modules. It has
+# a target directory of its own: in the workspace's, it would wait for
+# cargo's lock on it while build_wasm runs.
+MODEL_OPTIMIZER_CRATE = "modules/model_optimizer"
+MODEL_OPTIMIZER_ARGS = ["cargo", "run", "--profile", "fast", "--quiet", "--"]
+MODEL_OPTIMIZER_TARGET_DIR = "modules/target/model_optimizer"
+
+# Extra keyword arguments for tf2onnx.convert.from_tflite; part of the
+# conversion cache key.
+CONVERSION_OPTIONS = {}
+
+PIPELINE_RUNS = metrics.counter("pipeline_runs_total", "Finished pipeline runs, by outcome.", ["outcome"])
+PIPELINE_SECONDS = metrics.histogram("pipeline_duration_seconds", "Whole pipeline runs, by outcome.", ["outcome"])
+STEP_SECONDS = metrics.histogram("pipeline_step_duration_seconds", "Pipeline steps, by step and outcome.", ["step", "outcome"])
+BUILD_SECONDS = metrics.histogram("cargo_build_duration_seconds", "Workspace builds of the wasm modules, by the crates built.", ["crate"])
+CONVERSION_SECONDS = metrics.histogram("model_conversion_duration_seconds", "TFLite to ONNX conversions.")
+OPTIMIZATION_SECONDS = metrics.histogram("model_optimization_duration_seconds", "ONNX to NNEF optimizations.")
+
+
+def onnx_model_path(precision):
+    # Each precision keeps its own models, like the downloads; the float32
+    # ones keep their original names.
+    return os.path.splitext(tflite_model_path(precision))[0] + ".onnx"
+
+
+def optimized_model_path(precision):
+    return os.path.splitext(tflite_model_path(precision))[0] + ".nnef.tar"
+
+
+def sse_event(event_id, event, payload):
+    # Completed steps go out as plain messages, which is what the progress
+    # page listens to; everything else is a named event.
+    data = payload if isinstance(payload, str) else json.dumps(payload)
+    if event == "step":
+        return f"id: {event_id}\ndata: {data}\n\n"
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+
+
+def pipeline_steps(staging, precision=MODEL_PRECISION):
+    """The pipeline's steps for `precision`. `staging` (a threading.Event) is
+    set once the run holds MODEL_STAGING_LOCK, which the caller releases."""
+    wasm_paths = {}
+    rollout = {}
+    batch_rollout = {}
+    dsp_config = {}
+
+    def convert_step(report):
+        MODEL_STAGING_LOCK.acquire()
+        staging.set()
+        convert_model_cached(report, precision)
+
+    def build_step(report):
+        wasm_paths.update(build_modules(report))
+
+    def upload_step(name, artifact_name):
+        return lambda report: report("upload", upload_wasm(name, wasm_paths[artifact_name]))
+
+    descriptions = ["pull_orchestrator_devices", "add_model_desc", "add_spectral_analysis_desc", "add_save_data_desc"]
+    deploys = ["deploy"]
+    batch_steps = []
+    if BATCH_DEPLOYMENT_SEQUENCE:
+        deploys.append("deploy_batch")
+        batch_steps = [
+            Step("do_batch_deployment", lambda report: do_batch_deployment(batch_rollout, report), deps=descriptions),
+            Step("deploy_batch", lambda report: deploy(batch_rollout, report), deps=["do_batch_deployment"]),
+        ]
 
-progress_log = {}
-
-def update_progress_log(step):
-    global progress_log
-    progress_log[step] = True
-    return f"data: {step}\n\n"
+    return [
+        Step("pull_orchestrator_devices", lambda report: pull_orchestrator_devices()),
+        Step("download_model", lambda report: download_model(precision)),
+        Step("get_class_names", lambda report: get_class_names()),
+        Step("get_dsp_config", lambda report: dsp_config.update(get_dsp_config())),
+        Step("convert_model", convert_step, deps=["download_model"]),
+        Step("check_features", lambda report: check_features(dsp_config), deps=["get_dsp_config", "convert_model"]),
+        Step("optimize_model", lambda report: optimize_model_cached(report, precision), deps=["check_features"]),
+
+        # One cargo invocation for all stale modules. The classifier embeds
+        # models/classes.txt and the model's quantization parameters, and
+        # both it and the spectral module the DSP constants, at compile
+        # time, so the build waits for them.
+        Step("build_wasm", build_step, deps=["get_class_names", "check_features"]),
+
+        Step("upload_wasm_model", upload_step("model", "wasi_edge_impulse_onnx"), deps=["build_wasm"]),
+        Step("upload_wasm_spec", upload_step("spec", "spectral_analysis"), deps=["build_wasm"]),
+        Step("upload_save_data", upload_step("save", "save_accelerometer_data"), deps=["build_wasm"]),
+
+        Step(
+            "pull_orchestrator_modules",
+            lambda report: pull_orchestrator_modules(),
+            deps=["upload_wasm_model", "upload_wasm_spec", "upload_save_data"],
+        ),
+        Step("add_model_desc", lambda report: report("upload", add_model_desc()), deps=["pull_orchestrator_modules", "optimize_model"]),
+        Step("add_spectral_analysis_desc", lambda report: report("upload", add_spectral_analysis_desc()), deps=["pull_orchestrator_modules"]),
+        Step("add_save_data_desc", lambda report: report("upload", add_save_data_desc()), deps=["pull_orchestrator_modules"]),
+
+        Step("do_deployment", lambda report: do_deployment(rollout, report), deps=descriptions),
+        Step("deploy", lambda report: deploy(rollout, report), deps=["do_deployment"]),
+        *batch_steps,
+        Step("pull_orchestrator_deployments", lambda report: pull_orchestrator_deployments(), deps=deploys),
+        Step("record_variant", lambda report: record_variant(precision, wasm_paths), deps=["deploy"]),
+    ]
 
 
 @app.route("/execute_deployment", methods=["GET"])
@@ -38,168 +281,179 @@ def execute_deployment():
     return render_template('index3.html')
 
 
-@app.route("/run_pipeline_progress", methods=["GET"])
-def run_pipeline_progress():
-    def generate():
-        global progress_log
-        progress_log = {
-            "download_model": False,
-            "get_class_names": False,
-            "convert_model": False,
-            "run_rust_spectral_analysis": False,
-            "run_rust_model": False,
-            "run_save_data": False,
-            "upload_wasm_model": False,
-            "upload_wasm_spec": False,
-            "upload_save_data": False,
-            "add_model_desc": False,
-            "add_spectral_analysis_desc": False,
-            "add_save_data_desc": False,
-            "do_deployment": False,
-            "deploy": False,
-        }
+def run_pipeline(job, precision=MODEL_PRECISION):
+    global LAST_PRECISION
 
-        try:
-            pull_orchestrator_devices()
-
-            download_model()
-            yield update_progress_log("download_model")
-
-            get_class_names()
-            yield update_progress_log("get_class_names")
-
-            convert_model()
-            yield update_progress_log("convert_model")
-
-            if not os.path.exists("modules/target/wasm32-wasip1/release/spectral_analysis.wasm"):
-                run_rust_code("modules/rust_spectral_analysis")
-            yield update_progress_log("run_rust_spectral_analysis")
-
-            if not os.path.exists("modules/target/wasm32-wasip1/release/wasi_edge_impulse_onnx.wasm"):
-                run_rust_code("modules/wasi_edge_impulse_onnx")
-            yield update_progress_log("run_rust_model")
-
-            if not os.path.exists("modules/target/wasm32-wasip1/release/save_accelerometer_data.wasm"):
-                run_rust_code("modules/save_accelerometer_data")
-            yield update_progress_log("run_save_data")
-
-            upload_wasm("model", "modules/target/wasm32-wasip1/release/wasi_edge_impulse_onnx.wasm")
-            yield update_progress_log("upload_wasm_model")
-
-            upload_wasm("spec", "modules/target/wasm32-wasip1/release/spectral_analysis.wasm")
-            yield update_progress_log("upload_wasm_spec")
-
-            upload_wasm("save", "modules/target/wasm32-wasip1/release/save_accelerometer_data.wasm")
-            yield update_progress_log("upload_save_data")
-
-            pull_orchestrator_modules()
-
-            add_desc(
-                "model",
-                {
-                    "model.onnx": (
-                        "model.onnx",
-                        open("modules/wasi_edge_impulse_onnx/model.onnx", "rb"),
-                        "application/octet-stream"
-                    ),
-                    "accelerometer_data.csv": (None, "undefined"),
-                    "probabilities.csv": (None, "undefined")
-                },
-                {
-                    "infer_predefined_paths[mountName]": "probabilities.csv",
-                    "infer_predefined_paths[method]": "POST",
-                    "infer_predefined_paths[stage]": "output",
-                    "infer_predefined_paths[output]": "image/jpg",
-                    "infer_predefined_paths[mounts][0][name]": "model.onnx",
-                    "infer_predefined_paths[mounts][0][stage]": "deployment",
-                    "infer_predefined_paths[mounts][1][name]": "features.csv",
-                    "infer_predefined_paths[mounts][1][stage]": "execution",
-                    "infer_predefined_paths[mounts][2][name]": "probabilities.csv",
-                    "infer_predefined_paths[mounts][2][stage]": "output",
-                }
-            )
-            yield update_progress_log("add_model_desc")
-
-            add_desc(
-                "spec",
-                {
-                    "raw_data.csv": (None, "undefined"),
-                    "accelerometer_data.csv": (None, "undefined"),
-                },
-                {
-                    "testailu[mountName]": "features.csv",
-                    "testailu[method]": "POST",
-                    "testailu[stage]": "output",
-                    "testailu[output]": "image/jpg",
-                    "testailu[mounts][0][name]": "accelerometer_data.csv",
-                    "testailu[mounts][0][stage]": "execution",
-                    "testailu[mounts][1][name]": "features.csv",
-                    "testailu[mounts][1][stage]": "output",
-                }
-            )
-            yield update_progress_log("add_spectral_analysis_desc")
-#
-            add_desc(
-                "save",
-                {
-                    "accelerometer_data.csv": (None, "undefined"),
-                },
-                {
-                    "save_sensor_data[mountName]": "accelerometer_data.csv",
-                    "save_sensor_data[method]": "GET",
-                    "save_sensor_data[stage]": "output",
-                    "save_sensor_data[output]": "image/jpg",
-                    "alloc[param0]": "integer",
-                    "alloc[output]": "integer",
-                    "alloc[mountName]": "",
-                    "alloc[method]": "GET",
-                    "save_sensor_data[mounts][0][name]": "accelerometer_data.csv",
-                    "save_sensor_data[mounts][0][stage]": "output",
-                }
-            )
-            yield update_progress_log("add_save_data_desc")
+    trace = metrics.Trace()
+    staging = threading.Event()
+    upload_totals = {"sent": 0, "skipped": 0, "bytes": 0, "wire_bytes": 0, "bytes_saved": 0, "seconds_saved": 0.0}
+    outcome = "failed"
+    try:
+        with metrics.tracing(trace):
+            for event, payload in run_dag(pipeline_steps(staging, precision), max_workers=PIPELINE_WORKERS):
+                if event == "upload":
+                    upload_totals["skipped" if payload["skipped"] else "sent"] += 1
+                    for name in ("bytes", "wire_bytes", "bytes_saved", "seconds_saved"):
+                        upload_totals[name] += payload.get(name, 0)
+                if event in ("step", "fail"):
+                    step_outcome = "succeeded" if event == "step" else "failed"
+                    duration = payload["end"] - payload["start"]
+                    STEP_SECONDS.observe(duration, step=payload["step"], outcome=step_outcome)
+                    trace.add(f"step.{payload['step']}", payload["start"], duration, payload.get("error"))
+                job.emit(event, payload)
+        outcome = "succeeded"
+        LAST_PRECISION = precision
+
+    except StepFailed as e:
+        # The failed step itself was already reported by a "fail" event.
+        job.emit("error", f"Pipeline execution failed in {e.step}: {e.error}")
+        raise
+
+    except Exception as e:
+        job.emit("error", f"Pipeline execution failed: {e}")
+        raise
+
+    finally:
+        # run_dag waits for running steps even after a failure, so a
+        # convert_model step can't still be about to take the lock.
+        if staging.is_set():
+            MODEL_STAGING_LOCK.release()
+        PIPELINE_RUNS.inc(outcome=outcome)
+        PIPELINE_SECONDS.observe(time.time() - trace.started, outcome=outcome)
+
+    job.emit("uploads", upload_totals)
+    message = (
+        f"Pipeline executed successfully! Skipped {upload_totals['skipped']} of "
+        f"{upload_totals['sent'] + upload_totals['skipped']} uploads, saving "
+        f"{upload_totals['bytes_saved'] / 1e6:.1f} MB and ~{upload_totals['seconds_saved']:.1f} s."
+    )
+    job.emit("end", {"message": message, "trace": trace.to_dict()} if PIPELINE_TRACE else message)
+
+
+def pipeline_key(precision=MODEL_PRECISION):
+    # Runs for the same model are coalesced into one job.
+    return f"project-{PROJECT_ID}-{precision}"
 
-            do_deployment()
-            yield update_progress_log("do_deployment")
 
-            deploy()
-            yield update_progress_log("deploy")
+def requested_precision():
+    """Model precision asked for in the query string or JSON body."""
+    body = request.get_json(silent=True) if request.is_json else None
+    precision = request.args.get("precision") or (body or {}).get("precision") or MODEL_PRECISION
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown model precision '{precision}', expected one of {', '.join(PRECISIONS)}")
+    return precision
 
-            pull_orchestrator_deployments()
 
-            yield "event: end\ndata: Pipeline executed successfully!\n\n"
+def pipeline_runner(precision):
+    return lambda job: run_pipeline(job, precision)
 
-        except Exception as e:
-            error_step = [step for step, completed in progress_log.items() if not completed][0]
-            yield f"event: fail\ndata: {error_step}\n\n"
-            yield f"event: error\ndata: Pipeline execution failed: {e}\n\n"
+
+def last_event_id():
+    value = request.headers.get("Last-Event-ID") or request.args.get("last_event_id") or "0"
+    return int(value) if value.isdigit() else 0
+
+
+def stream_job(job, after):
+    def generate():
+        last_id = after
+        while True:
+            events = job.events_after(last_id, timeout=15)
+            for event_id, event, payload in events:
+                last_id = event_id
+                yield sse_event(event_id, event, payload)
+
+            if job.done and not job.events_after(last_id, timeout=0):
+                return
+            if not events:
+                # Keeps proxies from closing an idle stream during long builds.
+                yield ": keep-alive\n\n"
 
     return Response(stream_with_context(generate()), content_type="text/event-stream")
 
 
-@contextmanager
-def change_directory(directory):
-    original_directory = os.getcwd()
+@app.route("/pipeline/jobs", methods=["POST"])
+def submit_pipeline_job():
     try:
-        os.chdir(directory)
-        yield
-    finally:
-        os.chdir(original_directory)
+        precision = requested_precision()
+    except ValueError as e:
+        return str(e), 400
+
+    job, created = PIPELINE_JOBS.submit(pipeline_key(precision), pipeline_runner(precision))
+    return jsonify({"job_id": job.id, "coalesced": not created, "precision": precision}), 202
+
+
+@app.route("/pipeline/jobs", methods=["GET"])
+def list_pipeline_jobs():
+    return jsonify([job.to_dict() for job in PIPELINE_JOBS.jobs()])
+
+
+@app.route("/pipeline/jobs/<job_id>", methods=["GET"])
+def get_pipeline_job(job_id):
+    job = PIPELINE_JOBS.get(job_id)
+    if job is None:
+        return "Job not found.", 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/pipeline/jobs/<job_id>/events", methods=["GET"])
+def pipeline_job_events(job_id):
+    job = PIPELINE_JOBS.get(job_id)
+    if job is None:
+        return "Job not found.", 404
+    return stream_job(job, last_event_id())
+
+
+@app.route("/run_pipeline_progress", methods=["GET"])
+def run_pipeline_progress():
+    after = last_event_id()
+    try:
+        precision = requested_precision()
+    except ValueError as e:
+        return str(e), 400
+
+    # A browser reconnecting after a dropped stream sends Last-Event-ID:
+    # resume the run it was watching rather than starting a new one.
+    job = PIPELINE_JOBS.latest(pipeline_key(precision)) if after else None
+    if job is None:
+        # The watched job may have been evicted; its event IDs mean nothing
+        # for the new one, which is streamed from the start.
+        job, _ = PIPELINE_JOBS.submit(pipeline_key(precision), pipeline_runner(precision))
+        after = 0
+
+    return stream_job(job, after)
+
+
+def registry_response(registry):
+    # Served from the current snapshot; clients that send back the ETag get
+    # a 304 until the registry actually changes.
+    response = jsonify(registry.records())
+    response.set_etag(registry.snapshot.etag)
+    return response.make_conditional(request)
 
 
 @app.route("/devices", methods=["GET"])
 def devices2():    
-    return jsonify(DEVICES)
+    return registry_response(DEVICES)
 
 
 @app.route("/modules", methods=["GET"])
 def modules2():    
-    return jsonify(MODULES)
+    return registry_response(MODULES)
 
 
 @app.route("/deployments", methods=["GET"])
 def deployments2():    
-    return jsonify(DEPLOYMENTS)
+    return registry_response(DEPLOYMENTS)
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    registries = {
+        registry.name: {"loaded": registry.loaded, "count": len(registry)}
+        for registry in (DEVICES, MODULES, DEPLOYMENTS)
+    }
+    is_ready = registries_ready()
+    return jsonify({"ready": is_ready, "registries": registries}), 200 if is_ready else 503
 
 
 @app.route('/', methods=["GET"])
@@ -207,62 +461,281 @@ def index():
     return render_template('index.html')
 
 
-def run_rust_code(rust_project_path):
-    with change_directory(rust_project_path):
-        build_result = subprocess.run(["cargo", "build", "--target", "wasm32-wasip1", "--release"], capture_output=True, text=True)
+def run_cargo_build(crates, report):
+    """Build `crates` with one cargo invocation in the workspace, so cargo
+    resolves it once and compiles independent crates in parallel. cargo's
+    output is passed on line by line as "build_output" events."""
+    args = CARGO_BUILD_ARGS + [arg for crate in crates for arg in ("-p", crate)]
+    if BUILD_JOBS:
+        args += ["-j", BUILD_JOBS]
+
+    tail = deque(maxlen=BUILD_OUTPUT_TAIL)
+    # Pipeline steps run on worker threads, so pass the directory to cargo
+    # instead of changing the process-wide working directory.
+    with metrics.span("cargo_build", BUILD_SECONDS, crate=",".join(crates)):
+        process = subprocess.Popen(
+            args, cwd=build_cache.WORKSPACE_DIR,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1,
+        )
+        with process.stdout:
+            for line in process.stdout:
+                line = line.rstrip()
+                print(line)
+                tail.append(line)
+                report("build_output", {"line": line})
+        returncode = process.wait()
+
+    if returncode != 0:
+        error_message = f"Rust build of {', '.join(crates)} failed:\n" + "\n".join(tail)
+        print(error_message)
+        raise Exception(error_message)
 
-        
-        if build_result.returncode != 0:
-            error_message = f"Rust build failed in {rust_project_path}:\n{build_result.stderr}"
+    print(f"Rust build of {', '.join(crates)} succeeded.")
+
+
+def convert_model_cached(report, precision=MODEL_PRECISION):
+    tflite_path = tflite_model_path(precision)
+    key = conversion_cache.cache_key(tflite_path, CONVERSION_OPTIONS)
+
+    cached_path = conversion_cache.lookup(key)
+    quantization_path = conversion_cache.lookup(key, conversion_cache.QUANTIZATION_SUFFIX)
+    hit = cached_path is not None and quantization_path is not None
+    if hit:
+        print(f"Conversion cache hit ({key[:12]}).")
+    else:
+        # Convert into the cache directory rather than straight to
+        # models/model.onnx: that file may be a hard link to an older entry.
+        converted_path = conversion_cache.temp_path(key)
+        converted_quantization_path = conversion_cache.temp_path(key, conversion_cache.QUANTIZATION_SUFFIX)
+        with metrics.span("tf2onnx", CONVERSION_SECONDS):
+            convert_model(
+                tflite_path, converted_path,
+                quantization_output_path=converted_quantization_path, **CONVERSION_OPTIONS
+            )
+        stored = conversion_cache.store(key, {
+            conversion_cache.ONNX_SUFFIX: converted_path,
+            conversion_cache.QUANTIZATION_SUFFIX: converted_quantization_path,
+        })
+        cached_path = stored[conversion_cache.ONNX_SUFFIX]
+        quantization_path = stored[conversion_cache.QUANTIZATION_SUFFIX]
+
+    install(cached_path, onnx_model_path(precision))
+    install(cached_path, MODULE_ONNX_MODEL_PATH)
+    install(quantization_path, QUANTIZATION_PATH)
+    metrics.record_cache("conversion", hit)
+    report("cache", {"hit": hit})
+
+
+def optimize_model_cached(report, precision=MODEL_PRECISION):
+    if not OPTIMIZE_MODEL:
+        return
+
+    onnx_path = onnx_model_path(precision)
+    input_shape = model_input_shape()
+    optimizer_digest = build_cache.module_digest([MODEL_OPTIMIZER_CRATE], build_args=MODEL_OPTIMIZER_ARGS)
+    key = conversion_cache.optimization_key(onnx_path, optimizer_digest, input_shape)
+
+    cached_path = conversion_cache.lookup(key, conversion_cache.NNEF_SUFFIX)
+    hit = cached_path is not None
+    if hit:
+        print(f"Optimization cache hit ({key[:12]}).")
+    else:
+        optimized_path = conversion_cache.temp_path(key, conversion_cache.NNEF_SUFFIX)
+        shape = ",".join(str(dim) for dim in input_shape)
+        args = MODEL_OPTIMIZER_ARGS + [os.path.abspath(onnx_path), os.path.abspath(optimized_path), shape]
+        with metrics.span("model_optimizer", OPTIMIZATION_SECONDS):
+            result = subprocess.run(
+                args, cwd=MODEL_OPTIMIZER_CRATE, capture_output=True, text=True,
+                env={**os.environ, "CARGO_TARGET_DIR": os.path.abspath(MODEL_OPTIMIZER_TARGET_DIR)},
+            )
+
+        if result.returncode != 0:
+            error_message = f"Model optimization failed:\n{result.stderr}"
             print(error_message)
             raise Exception(error_message)
 
-        print(f"Rust build succeeded in {rust_project_path}.")
-        print(build_result.stdout)
+        print(result.stdout)
+        cached_path = conversion_cache.store(key, {conversion_cache.NNEF_SUFFIX: optimized_path})[conversion_cache.NNEF_SUFFIX]
+
+    install(cached_path, optimized_model_path(precision))
+    install(cached_path, MODULE_OPTIMIZED_MODEL_PATH)
+    metrics.record_cache("optimization", hit)
+    report("cache", {"hit": hit})
+
+
+def model_input_shape():
+    """Input shape of the converted model, from QUANTIZATION_PATH."""
+    with open(QUANTIZATION_PATH, "r") as f:
+        for line in f:
+            name, _, value = line.strip().partition("=")
+            if name == "input_shape":
+                return tuple(int(dim) for dim in value.split(","))
+
+    error_message = f"No input shape in '{QUANTIZATION_PATH}'."
+    print(error_message)
+    raise Exception(error_message)
+
+
+def check_features(dsp_config):
+    """Fail before anything is built if the spectral module would produce a
+    different number of features than the model takes, or expect different
+    axes than the save module records."""
+    if len(dsp_config["axes"]) != SENSOR_AXES:
+        error_message = (
+            f"The spectral analysis block uses {len(dsp_config['axes'])} axes "
+            f"({', '.join(dsp_config['axes'])}), but the sensor module records {SENSOR_AXES}."
+        )
+        print(error_message)
+        raise Exception(error_message)
+
+    input_shape = model_input_shape()
+    feature_count = dsp_feature_count(dsp_config)
+    if input_shape[-1] != feature_count:
+        error_message = (
+            f"The spectral analysis block produces {feature_count} features, "
+            f"but the model's input shape is {input_shape}."
+        )
+        print(error_message)
+        raise Exception(error_message)
+
+    print(f"{feature_count} features per window match the model's input shape {input_shape}.")
+
+
+def record_variant(precision, wasm_paths):
+    """Record the artifact sizes of this precision's deployment."""
+    variants.record_build(
+        precision,
+        tflite_bytes=variants.file_size(tflite_model_path(precision)),
+        onnx_bytes=variants.file_size(onnx_model_path(precision)),
+        deployed_model_bytes=variants.file_size(deployed_model()[0]),
+        wasm_bytes=variants.file_size(wasm_paths["wasi_edge_impulse_onnx"]),
+    )
+
+
+def deployed_model():
+    """Path and mount name of the model the classifier is deployed with."""
+    if OPTIMIZE_MODEL:
+        return MODULE_OPTIMIZED_MODEL_PATH, "model.nnef.tar"
+    return MODULE_ONNX_MODEL_PATH, "model.onnx"
+
+
+def build_modules(report):
+    """Return the paths of up-to-date .wasm files of all modules. Only the
+    modules whose inputs changed since they were cached are built, all in
+    one cargo invocation; a new model only rebuilds the classifier."""
+    wasm_paths = {}
+    stale = {}
+    for artifact_name, module in WASM_MODULES.items():
+        digest = build_cache.module_digest(module["sources"], module["embedded"], CARGO_BUILD_ARGS)
+        cached_path = build_cache.lookup(digest, artifact_name)
+        metrics.record_cache("build", cached_path is not None)
+        report("cache", {"module": artifact_name, "hit": cached_path is not None})
+        if cached_path:
+            print(f"Build cache hit for {artifact_name} ({digest[:12]}).")
+            wasm_paths[artifact_name] = cached_path
+        else:
+            print(f"Build cache miss for {artifact_name} ({digest[:12]}).")
+            stale[artifact_name] = digest
 
+    if stale:
+        run_cargo_build(list(stale), report)
+        for artifact_name, digest in stale.items():
+            built_path = os.path.join(WASM_TARGET_DIR, f"{artifact_name}.wasm")
+            wasm_paths[artifact_name] = build_cache.store(digest, artifact_name, built_path)
 
-def upload_wasm(name, wasm_file_path):
-    try:
-        with open(wasm_file_path, "rb") as wasm_file:
-            files = {'file': (os.path.basename(wasm_file_path), wasm_file, "application/wasm")}
-            data_payload = {"name": name}
+    return wasm_paths
 
-            response = requests.post(WASMIOT_ORCHESTRATOR_URL + '/file/module', files=files, data=data_payload)
 
-            if response.status_code in (200, 201):
-                print(f"Successfully uploaded {name} to orchestrator.")
-            else:
-                error_message = f"Failed to upload {name}: Status code {response.status_code}, {response.text}"
-                print(error_message)
-                raise Exception(error_message)
+def uploaded_module_id(response, name):
+    """Id of a module the orchestrator just created."""
+    try:
+        module_id = response.json().get("id")
+    except (ValueError, AttributeError):
+        module_id = None
+    if not module_id:
+        pull_orchestrator_modules()
+        module_id = MODULES.id_for(name)
+    return module_id
 
-    except FileNotFoundError:
+
+def upload_wasm(name, wasm_file_path):
+    """Upload a module unless the orchestrator already has these exact
+    bytes under this name. Returns what was sent or saved."""
+    if not os.path.exists(wasm_file_path):
         error_message = f"WASM file not found: {wasm_file_path}"
         print(error_message)
         raise Exception(error_message)
 
+    digest = file_sha256(wasm_file_path)
+    key = f"module:{name}"
+    entry = uploads.ledger_entry(key)
+    if UPLOAD_DEDUP and entry and entry["sha256"] == digest:
+        # The orchestrator must still list that upload as the module's
+        # latest version.
+        pull_orchestrator_modules()
+        if MODULES.id_for(name) == entry["module_id"]:
+            print(f"{name} unchanged ({digest[:12]}), keeping module {entry['module_id']}.")
+            return uploads.report_skip("module", entry)
+
+    try:
+        response, sent, wire, seconds = uploads.send(
+            '/file/module', "upload_module",
+            fields=[("name", name)],
+            files=[("file", os.path.basename(wasm_file_path), wasm_file_path, "application/wasm")],
+        )
+
+        if response.status_code in (200, 201):
+            print(f"Successfully uploaded {name} to orchestrator.")
+        else:
+            error_message = f"Failed to upload {name}: Status code {response.status_code}, {response.text}"
+            print(error_message)
+            raise Exception(error_message)
+
     except Exception as e:
         error_message = f"Error uploading {name}: {e}"
         print(error_message)
         raise Exception(error_message)
 
+    uploads.record(key, {
+        "sha256": digest,
+        "module_id": uploaded_module_id(response, name),
+        "bytes": sent,
+        "seconds": seconds,
+    })
+    return uploads.report_sent("module", sent, wire, seconds)
+
 
 def add_desc(module_name, files, data):
-    module_id = None
-    for item in MODULES:
-        if item.get("name") == module_name:
-            module_id = item.get("_id")
-            break
+    """Describe a module's functions and mounts. `files` maps part names to
+    `(filename, path, content_type)` for mount files, or `(None, value)` for
+    plain values. Skipped when the module already has this description."""
+    module_id = MODULES.id_for(module_name)
 
     if not module_id:
         error_message = f"Module ID for '{module_name}' not found"
         print(error_message)
         raise Exception(error_message)
 
-    url = f"{WASMIOT_ORCHESTRATOR_URL}/file/module/{module_id}/upload"
+    fields = list(data.items()) + [(name, part[1]) for name, part in files.items() if part[0] is None]
+    file_parts = [(name, *part) for name, part in files.items() if part[0] is not None]
 
     try:
-        response = requests.post(url, files=files, data=data)
+        digest = uploads.description_digest(fields, file_parts)
+    except FileNotFoundError:
+        error_message = f"File not found: {files}"
+        print(error_message)
+        raise Exception(error_message)
+
+    key = f"description:{module_name}"
+    entry = uploads.ledger_entry(key)
+    if UPLOAD_DEDUP and entry and entry["digest"] == digest and entry["module_id"] == module_id:
+        print(f"Description of '{module_name}' unchanged, not sending it again.")
+        return uploads.report_skip("description", entry)
+
+    try:
+        response, sent, wire, seconds = uploads.send(
+            f"/file/module/{module_id}/upload", "describe_module", fields=fields, files=file_parts
+        )
 
         if response.status_code == 200:
             print(f"Module description for '{module_name}' added successfully: {response.text}")
@@ -271,91 +744,250 @@ def add_desc(module_name, files, data):
             print(error_message)
             raise Exception(error_message)
 
-    except FileNotFoundError:
-        error_message = f"File not found: {files}"
-        print(error_message)
-        raise Exception(error_message)
-
     except Exception as e:
         error_message = f"An error occurred while adding description for '{module_name}': {str(e)}"
         print(error_message)
         raise Exception(error_message)
 
+    uploads.record(key, {"digest": digest, "module_id": module_id, "bytes": sent, "seconds": seconds})
+    return uploads.report_sent("description", sent, wire, seconds)
+
+
+def add_model_desc():
+    func = MOUNTS["model"]
+    model_path, model_name = deployed_model()
+    atomic_write(MODEL_CHOICE_PATH, f"{model_name}\n".encode())
+    return add_desc(
+        "model",
+        {
+            model_name: (model_name, model_path, "application/octet-stream"),
+            "model.txt": ("model.txt", MODEL_CHOICE_PATH, "text/plain"),
+            MOUNTS["samples"]: (None, "undefined"),
+            MOUNTS["probabilities"]: (None, "undefined")
+        },
+        {
+            f"{func}[mountName]": MOUNTS["probabilities"],
+            f"{func}[method]": "POST",
+            f"{func}[stage]": "output",
+            f"{func}[output]": "image/jpg",
+            f"{func}[mounts][0][name]": model_name,
+            f"{func}[mounts][0][stage]": "deployment",
+            f"{func}[mounts][1][name]": MOUNTS["features"],
+            f"{func}[mounts][1][stage]": "execution",
+            f"{func}[mounts][2][name]": MOUNTS["probabilities"],
+            f"{func}[mounts][2][stage]": "output",
+            f"{func}[mounts][3][name]": "model.txt",
+            f"{func}[mounts][3][stage]": "deployment",
+        }
+    )
 
-def do_deployment():
-    global LAST_DEPLOYMENT
 
-    url = WASMIOT_ORCHESTRATOR_URL + "/file/manifest"
+def stream_config_mount(func, index):
+    """Files and description fields of the stream.txt deployment mount the
+    streaming functions read their window and stride from; none unless
+    STREAM_STRIDE is set."""
+    if not STREAM_STRIDE:
+        return {}, {}
 
-    device1, device2, device3 = None, None, None
+    if not 0 < STREAM_STRIDE <= STREAM_WINDOW <= SENSOR_WINDOW:
+        error_message = (
+            f"Invalid streaming window: need 0 < STREAM_STRIDE ({STREAM_STRIDE}) <= "
+            f"STREAM_WINDOW ({STREAM_WINDOW}) <= {SENSOR_WINDOW}"
+        )
+        print(error_message)
+        raise Exception(error_message)
 
-    for item in DEVICES:
-        if item.get("name") == "device1":
-            device1 = item.get("_id")
-        if item.get("name") == "device2":
-            device2 = item.get("_id")
-        if item.get("name") == "device3":
-            device3 = item.get("_id")
+    atomic_write(STREAM_CONFIG_PATH, f"window={STREAM_WINDOW}\nstride={STREAM_STRIDE}\n".encode())
+    files = {"stream.txt": ("stream.txt", STREAM_CONFIG_PATH, "text/plain")}
+    fields = {
+        f"{func}[mounts][{index}][name]": "stream.txt",
+        f"{func}[mounts][{index}][stage]": "deployment",
+    }
+    return files, fields
+
+
+def add_spectral_analysis_desc():
+    func = MOUNTS["spec"]
+    stream_files, stream_fields = stream_config_mount(func, 2)
+    return add_desc(
+        "spec",
+        {
+            "raw_data.csv": (None, "undefined"),
+            MOUNTS["samples"]: (None, "undefined"),
+            **stream_files,
+        },
+        {
+            f"{func}[mountName]": MOUNTS["features"],
+            f"{func}[method]": "POST",
+            f"{func}[stage]": "output",
+            f"{func}[output]": "image/jpg",
+            f"{func}[mounts][0][name]": MOUNTS["samples"],
+            f"{func}[mounts][0][stage]": "execution",
+            f"{func}[mounts][1][name]": MOUNTS["features"],
+            f"{func}[mounts][1][stage]": "output",
+            **stream_fields,
+        }
+    )
+
+
+def add_save_data_desc():
+    func = MOUNTS["save"]
+    stream_files, stream_fields = stream_config_mount(func, 1)
+    return add_desc(
+        "save",
+        {
+            MOUNTS["samples"]: (None, "undefined"),
+            **stream_files,
+        },
+        {
+            f"{func}[mountName]": MOUNTS["samples"],
+            f"{func}[method]": "GET",
+            f"{func}[stage]": "output",
+            f"{func}[output]": "image/jpg",
+            "alloc[param0]": "integer",
+            "alloc[output]": "integer",
+            "alloc[mountName]": "",
+            "alloc[method]": "GET",
+            f"{func}[mounts][0][name]": MOUNTS["samples"],
+            f"{func}[mounts][0][stage]": "output",
+            **stream_fields,
+        }
+    )
+
+
+def desired_deployment(name, sequence):
+    """The manifest payload for the deployment `name` of `sequence` and a
+    fingerprint of each step: its device, module, function and the digests
+    of the module's .wasm and description (which covers its mounts) last
+    uploaded."""
+    steps = []
+    for step in sequence:
+        if len(step) != 2 or step[1] not in DEPLOYABLE_MODULES:
+            error_message = f"Invalid deployment step {':'.join(step)}, expected <device>:<{'|'.join(DEPLOYABLE_MODULES)}>"
+            print(error_message)
+            raise Exception(error_message)
 
-    model_id, spec_id, save_id = None, None, None
+        device_name, module_name = step
+        device_id = DEVICES.id_for(device_name)
+        module_id = MODULES.id_for(module_name)
+        if not device_id or not module_id:
+            error_message = f"Device '{device_name}' or module '{module_name}' not found."
+            logger.error(error_message)
+            raise Exception(error_message)
 
-    for item in MODULES:
-        if item.get("name") == "spec":
-            spec_id = item.get("_id")
-        if item.get("name") == "model":
-            model_id = item.get("_id")
-        if item.get("name") == "save":
-            save_id = item.get("_id")
+        steps.append({
+            "device": device_id,
+            "module": module_id,
+            "func": MOUNTS[module_name],
+            "wasm": (uploads.ledger_entry(f"module:{module_name}") or {}).get("sha256"),
+            "description": (uploads.ledger_entry(f"description:{module_name}") or {}).get("digest"),
+        })
 
-    if not all([device1, device2, device3, model_id, spec_id, save_id]):
-        error_message = "One or more required devices or modules not found."
-        logger.error(error_message)
-        raise Exception(error_message)
+    sequence = [{"device": step["device"], "module": step["module"], "func": step["func"]} for step in steps]
+    payload = {"name": name}
+    for index, proc in enumerate(sequence):
+        payload[f"proc{index}"] = json.dumps(proc, separators=(",", ":"))
+    payload["sequence"] = sequence
+    return payload, steps
 
-    payload = {
-        "name": "asd1233",
-        "proc0": f'{{"device":"{device3}","module":"{save_id}","func":"save_sensor_data"}}',
-        "proc1": f'{{"device":"{device1}","module":"{spec_id}","func":"testailu"}}',
-        "proc2": f'{{"device":"{device2}","module":"{model_id}","func":"infer_predefined_paths"}}',
-        "sequence": [
-            {"device": device3, "module": save_id, "func": "save_sensor_data"},
-            {"device": device1, "module": spec_id, "func": "testailu"},
-            {"device": device2, "module": model_id, "func": "infer_predefined_paths"},
-        ]
-    }
 
-    try:
-        response = requests.post(url, json=payload)
+def placement(step):
+    return step.get("device"), step.get("module"), step.get("func")
 
-        if response.status_code in [200, 201]:
-            LAST_DEPLOYMENT = response.text.strip('"')
-            return f"Request succeeded: {response.text}", response.status_code
-        else:
-            error_message = f"Deployment failed: Status code {response.status_code}, {response.text}"
-            print(error_message)
-            raise Exception(error_message)
 
+def send_manifest(method, path, payload):
+    try:
+        response = orchestrator.request(method, path, "create_manifest" if method == "POST" else "update_manifest", json=payload)
     except Exception as e:
         error_message = f"Error during deployment: {e}"
         print(error_message)
         raise Exception(error_message)
 
+    if response.status_code not in [200, 201]:
+        error_message = f"Deployment failed: Status code {response.status_code}, {response.text}"
+        print(error_message)
+        raise Exception(error_message)
+    return response
+
+
+def update_deployment(name, sequence, rollout, report):
+    """Create the deployment `name`, or update the existing one in place,
+    and leave in `rollout` which devices need to be deployed to again: those
+    whose step (module, function, .wasm or mounts) changed since the last
+    deploy. Returns the deployment's ID."""
+    payload, steps = desired_deployment(name, sequence)
+
+    # The deployment recorded at the last deploy, if the orchestrator still has it.
+    pull_orchestrator_deployments()
+    key = f"deployment:{name}"
+    entry = uploads.ledger_entry(key)
+    if entry and not DEPLOYMENTS.by_id(entry["deployment_id"]):
+        entry = None
+    existing = entry["deployment_id"] if entry else DEPLOYMENTS.id_for(name)
+
+    if not existing:
+        response = send_manifest("POST", "/file/manifest", payload)
+        deployment_id = response.text.strip().strip('"')
+        action, changed = "create", list(range(len(steps)))
+    else:
+        deployment_id = existing
+        deployed_steps = entry["steps"] if entry else []
+        changed = [
+            index for index, step in enumerate(steps)
+            if index >= len(deployed_steps) or deployed_steps[index] != step
+        ]
+        # The manifest itself only changes with the placement of the steps;
+        # new mounts on the same module just need another deploy.
+        if [placement(step) for step in steps] != [placement(step) for step in deployed_steps]:
+            send_manifest("PUT", f"/file/manifest/{deployment_id}", payload)
+            action = "update"
+        else:
+            action = "redeploy" if changed else "unchanged"
+
+    rollout.update(
+        key=key,
+        deployment_id=deployment_id,
+        steps=steps,
+        changed_devices=sorted({steps[index]["device"] for index in changed}),
+    )
+    print(f"Deployment {deployment_id}: {action}, {len(changed)} of {len(steps)} steps changed.")
+    report("rollout", {"action": action, "changed_steps": len(changed), "steps": len(steps), "changed_devices": rollout["changed_devices"]})
+    return deployment_id
 
-def deploy():
-    if not LAST_DEPLOYMENT:
+
+def do_deployment(rollout, report):
+    global LAST_DEPLOYMENT
+    LAST_DEPLOYMENT = update_deployment(DEPLOYMENT_NAME, DEPLOYMENT_SEQUENCE, rollout, report)
+
+
+def do_batch_deployment(rollout, report):
+    global BATCH_DEPLOYMENT
+    BATCH_DEPLOYMENT = update_deployment(BATCH_DEPLOYMENT_NAME, BATCH_DEPLOYMENT_SEQUENCE, rollout, report)
+
+
+def deploy(rollout, report):
+    """Deploy if any step changed. The orchestrator deploys a whole
+    manifest at a time, so this is all or nothing for the deployment's
+    devices, but an unchanged deployment isn't rolled out again."""
+    deployment_id = rollout.get("deployment_id")
+    if not deployment_id:
         error_message = "No deployment ID found for deployment."
         print(error_message)
         raise Exception(error_message)
 
-    url = f"{WASMIOT_ORCHESTRATOR_URL}/file/manifest/{LAST_DEPLOYMENT}"
-    data = {"id": LAST_DEPLOYMENT}    
+    if not rollout["changed_devices"]:
+        print(f"Deployment {deployment_id} unchanged, not deploying it again.")
+        report("rollout", {"deployed": False, "devices": 0})
+        return
+
+    data = {"id": deployment_id}
 
     try:
-        response = requests.post(url, data=data)
+        start = time.perf_counter()
+        response = orchestrator.post(f"/file/manifest/{deployment_id}", "deploy", data=data)
 
         if response.status_code in [200, 201]:
             print(f"Deployment was successful: {response.text}")
-            return f"Request succeeded: {response.text}", response.status_code
         else:
             error_message = f"Deployment failed: Status code {response.status_code}, {response.text}"
             print(error_message)
@@ -366,16 +998,23 @@ def deploy():
         print(error_message)
         raise Exception(error_message)
 
+    uploads.record(rollout["key"], {"deployment_id": deployment_id, "steps": rollout["steps"]})
+    report("rollout", {
+        "deployed": True,
+        "devices": len(rollout["changed_devices"]),
+        "seconds": time.perf_counter() - start,
+    })
+
 @app.route('/do_run', methods=['POST'])
 def do_run():
     if not LAST_DEPLOYMENT:
         return 'No deployment found.', 400
 
-    url = f"{WASMIOT_ORCHESTRATOR_URL}/execute/{LAST_DEPLOYMENT}"
     data = {"id": LAST_DEPLOYMENT}
     
     try:
-        response = requests.post(url, data=data)
+        start = time.perf_counter()
+        response = orchestrator.post(f"/execute/{LAST_DEPLOYMENT}", "execute", data=data)
 
         if response.status_code in [200, 201]:
             probabilities = get_text()
@@ -383,6 +1022,8 @@ def do_run():
             if isinstance(probabilities, tuple):
                 return probabilities
 
+            if LAST_PRECISION:
+                variants.record_runs(LAST_PRECISION, [time.perf_counter() - start])
             return probabilities, 200, {'Content-Type': 'text/plain'}
         else:
             return f"Execution failed: Status code: {response.status_code}", response.status_code
@@ -392,12 +1033,201 @@ def do_run():
         return f"Server error: {e}", 500
 
 
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def batch_request(body):
+    """Windows, targets (None for the default) and concurrency of a
+    /do_run_batch body. Raises ValueError with the message for the client."""
+    if not isinstance(body, dict):
+        raise ValueError("The body must be a JSON object.")
+    windows = body.get("windows")
+    if not isinstance(windows, list) or not windows:
+        raise ValueError("'windows' must be a non-empty list of windows.")
+    if len(windows) > BATCH_MAX_WINDOWS:
+        raise ValueError(f"At most {BATCH_MAX_WINDOWS} windows per batch.")
+    for index, window in enumerate(windows):
+        if (
+            not isinstance(window, list) or not window or len(window) % SENSOR_AXES
+            or not all(is_number(value) for value in window)
+        ):
+            raise ValueError(f"Window {index} must be a list of numbers, {SENSOR_AXES} (x, y, z) per sample.")
+
+    targets = body.get("targets")
+    if targets is not None:
+        if not isinstance(targets, list) or not targets:
+            raise ValueError("'targets' must be a non-empty list.")
+        for index, target in enumerate(targets):
+            if (
+                not isinstance(target, dict)
+                or not isinstance(target.get("deployment"), str)
+                or not isinstance(target.get("results_url"), str)
+            ):
+                raise ValueError(f"Target {index} must have a 'deployment' ID and a 'results_url'.")
+
+    concurrency = body.get("concurrency", BATCH_CONCURRENCY)
+    if not isinstance(concurrency, int) or isinstance(concurrency, bool) or concurrency < 1:
+        raise ValueError("'concurrency' must be a positive integer.")
+
+    return windows, targets, concurrency
+
+
+def default_batch_targets():
+    """The batch deployment and the BATCH_EXTRA_TARGETS deployments, as
+    /do_run_batch targets. Raises ValueError if one of the latter is missing
+    or there are none."""
+    targets = []
+    deployment_id = BATCH_DEPLOYMENT or DEPLOYMENTS.id_for(BATCH_DEPLOYMENT_NAME)
+    if deployment_id:
+        targets.append({"deployment": deployment_id, "results_url": MODEL_RESULTS_URL})
+
+    if BATCH_EXTRA_TARGETS:
+        pull_orchestrator_deployments()
+    for name, results_url in BATCH_EXTRA_TARGETS:
+        deployment_id = DEPLOYMENTS.id_for(name)
+        if not deployment_id:
+            raise ValueError(f"Batch deployment '{name}' not found.")
+        targets.append({"deployment": deployment_id, "results_url": results_url})
+
+    if not targets:
+        raise ValueError("No batch deployment found.")
+    return targets
+
+
+def batch_target_error(deployment_id):
+    """Why the windows of a batch can't be run through `deployment_id`, or
+    None if they can."""
+    record = DEPLOYMENTS.by_id(deployment_id)
+    if record is None:
+        # It may have been created since the registry was last refreshed.
+        pull_orchestrator_deployments()
+        record = DEPLOYMENTS.by_id(deployment_id)
+    if record is None:
+        return f"Deployment {deployment_id} not found."
+
+    sequence = record.get("sequence") or []
+    if not sequence or not isinstance(sequence[0], dict):
+        return f"Deployment {deployment_id} has no sequence to check where it starts."
+    if sequence[0].get("func") in SAVE_FUNCTIONS:
+        return (
+            f"Deployment {deployment_id} starts with {sequence[0]['func']}, which reads the live sensor "
+            f"instead of the posted windows; use one that starts with the spectral module."
+        )
+    return None
+
+
+@app.route('/do_run_batch', methods=['POST'])
+def do_run_batch():
+    """Run many accelerometer windows through a deployment that starts with
+    the spectral module, each window posted as the samples mount.
+
+    JSON body: `windows`, a list of windows of interleaved x, y, z floats
+    (104 samples per axis for the deployed model), and optionally
+    `targets`, a list of `{"deployment": id, "results_url": url}` to spread
+    them over (default: the batch deployment and BATCH_EXTRA_TARGETS) and
+    `concurrency`. Each deployment runs one window at a time, so the
+    concurrency used is at most the number of deployments (and
+    BATCH_CONCURRENCY); the response's `concurrency` reports both.
+    """
+    try:
+        body = request.get_json(silent=True)
+        windows, targets, concurrency = batch_request({} if body is None else body)
+        default_targets = targets is None
+        if default_targets:
+            targets = default_batch_targets()
+    except ValueError as e:
+        return str(e), 400
+
+    deployment_ids = {target["deployment"] for target in targets}
+    for deployment_id in deployment_ids:
+        error = batch_target_error(deployment_id)
+        if error:
+            return error, 400
+
+    used = min(concurrency, BATCH_CONCURRENCY, len(deployment_ids), len(windows))
+    batch = inference.run_batch(windows, targets, used)
+    batch["concurrency"] = {"requested": concurrency, "used": used, "deployments": len(deployment_ids)}
+    # Only the last deployment's precision is known.
+    if default_targets and LAST_PRECISION:
+        variants.record_runs(
+            LAST_PRECISION,
+            [result["latency_seconds"] for result in batch["results"] if result["status"] == "ok"],
+        )
+    return jsonify(batch)
+
+
+@app.route('/model_variants', methods=['GET'])
+def model_variants():
+    """Model, deployed model and classifier .wasm sizes and end-to-end run
+    times per model precision, and the precision currently deployed."""
+    return jsonify({"deployed": LAST_PRECISION, "variants": variants.load()})
+
+
+@app.route('/inference/continuous', methods=['GET'])
+def continuous_inference_status():
+    return jsonify(CONTINUOUS_INFERENCE.status())
+
+
+@app.route('/inference/continuous/start', methods=['POST'])
+def start_continuous_inference():
+    """JSON body (all optional): `rate` in executions per second (one
+    higher than the devices manage runs them back to back); `deployment`
+    and `results_url`, defaulting to the last deployment."""
+    body = request.get_json(silent=True)
+    if body is None:
+        body = {}
+    if not isinstance(body, dict):
+        return "The body must be a JSON object.", 400
+
+    rate = body.get("rate", 1.0)
+    if not is_number(rate) or not rate > 0 or rate == float("inf"):
+        return "'rate' must be a positive number of executions per second.", 400
+    for name in ("deployment", "results_url"):
+        if body.get(name) is not None and not isinstance(body[name], str):
+            return f"'{name}' must be a string.", 400
+
+    deployment_id = body.get("deployment") or LAST_DEPLOYMENT
+    if not deployment_id:
+        return 'No deployment found.', 400
+
+    try:
+        CONTINUOUS_INFERENCE.start(deployment_id, body.get("results_url") or MODEL_RESULTS_URL, float(rate))
+    except Exception as e:
+        # Already running.
+        return str(e), 409
+
+    return jsonify(CONTINUOUS_INFERENCE.status()), 202
+
+
+@app.route('/inference/continuous/stop', methods=['POST'])
+def stop_continuous_inference():
+    CONTINUOUS_INFERENCE.stop()
+    return jsonify(CONTINUOUS_INFERENCE.status())
+
+
+@app.route('/inference/continuous/stream', methods=['GET'])
+def continuous_inference_stream():
+    def generate():
+        subscriber = CONTINUOUS_INFERENCE.subscribe()
+        try:
+            while True:
+                try:
+                    event, payload = subscriber.get(timeout=15)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        finally:
+            CONTINUOUS_INFERENCE.unsubscribe(subscriber)
+
+    return Response(stream_with_context(generate()), content_type="text/event-stream")
+
+
 @app.route("/manifest-request")
 def manifest_request():
-    orchestrator_url = f"{WASMIOT_ORCHESTRATOR_URL}/file/manifest"
-    
     try:
-        response = requests.get(orchestrator_url)
+        response = orchestrator.get("/file/manifest", "list_manifests")
         response.raise_for_status()
         
         try:
@@ -414,39 +1244,50 @@ def manifest_request():
         print(error_message)
         raise Exception(error_message)
 
+@app.route("/metrics")
+def prometheus_metrics():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@app.route("/orchestrator-stats")
+def orchestrator_stats():
+    return jsonify(orchestrator.latency_stats())
+
 @app.route('/file-structure')
 def file_structure():
-    structure = {}
-    for root, dirs, files in os.walk('.'):
-        structure[root] = {'dirs': dirs, 'files': files}
-    return jsonify(structure)
+    """One page of the entries below `path` (default the app directory), up
+    to `depth` levels down, optionally filtered by a `glob`."""
+    try:
+        limit = int(request.args.get("limit", FILE_INDEX_PAGE_SIZE))
+        if limit > FILE_INDEX_MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be at most {FILE_INDEX_MAX_PAGE_SIZE}")
+        depth = int(request.args.get("depth", 1))
+        if depth > FILE_INDEX_MAX_DEPTH:
+            raise ValueError(f"depth must be at most {FILE_INDEX_MAX_DEPTH}")
+        return jsonify(FILE_INDEX.query(
+            request.args.get("path", "."),
+            depth=depth,
+            pattern=request.args.get("glob"),
+            offset=int(request.args.get("offset", 0)),
+            limit=limit,
+        ))
+    except ValueError as e:
+        return str(e), 400
+    except KeyError:
+        return "Directory not found or excluded from the index.", 404
 
 @app.route('/upload', methods=['GET'])
 def upload_page():
     global LAST_DEPLOYMENT
 
-    for item in DEPLOYMENTS:
-        if item.get("name") == "asd1233":
-            LAST_DEPLOYMENT = item.get("_id")
-            break
+    LAST_DEPLOYMENT = DEPLOYMENTS.id_for(DEPLOYMENT_NAME) or LAST_DEPLOYMENT
     
     return render_template('index2.html', last_deployment=LAST_DEPLOYMENT)
 
 
 def get_text():
-    csv_url = 'http://172.15.0.22:5000/module_results/model/probabilities.csv'
+    csv_url = MODEL_RESULTS_URL
     try:
-        response = requests.get(csv_url)
-        response.raise_for_status()
-        
-        csv_content = response.text.splitlines()
-        csv_reader = csv.DictReader(csv_content)
-
-        result = []
-        for row in csv_reader:
-            class_name = row['class']
-            probability = row['probability']
-            result.append(f"{class_name}: {probability}")
+        result = [f"{class_name}: {probability}" for class_name, probability in inference.fetch_probabilities(csv_url)]
 
         return f"Probabilities:\n" + "\n".join(result)
     
@@ -0,0 +1,106 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+from functools import lru_cache
+from .settings import BUILD_CACHE_DIR
+
+WORKSPACE_DIR = "modules"
+LOCKFILE = os.path.join(WORKSPACE_DIR, "Cargo.lock")
+
+# Files outside the crate directories that change what cargo produces.
+WORKSPACE_INPUTS = [
+    os.path.join(WORKSPACE_DIR, "Cargo.toml"),
+    LOCKFILE,
+]
+
+SKIPPED_DIRS = {"target", ".git", "__pycache__"}
+
+_lockfile_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def toolchain_version():
+    # `rustc -vV` includes the commit hash and LLVM version, so any toolchain
+    # update invalidates the cache.
+    result = subprocess.run(["rustc", "-vV"], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"Failed to query rustc version: {result.stderr}")
+    return result.stdout
+
+
+def ensure_lockfile():
+    """Generate the workspace's Cargo.lock if it doesn't exist yet. It isn't
+    checked in, and cargo would otherwise only write it during the first
+    build, after that build's digest was computed without it."""
+    with _lockfile_lock:
+        if os.path.exists(LOCKFILE):
+            return
+        result = subprocess.run(["cargo", "generate-lockfile"], cwd=WORKSPACE_DIR, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise Exception(f"Failed to generate {LOCKFILE}: {result.stderr}")
+
+
+def _crate_files(crate_path):
+    for root, dirs, files in os.walk(crate_path):
+        dirs[:] = sorted(d for d in dirs if d not in SKIPPED_DIRS)
+        for name in sorted(files):
+            yield os.path.join(root, name)
+
+
+def _hash_file(digest, path):
+    digest.update(path.replace(os.sep, "/").encode())
+    digest.update(b"\0")
+    if not os.path.exists(path):
+        digest.update(b"<missing>")
+        return
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    digest.update(b"\0")
+
+
+def module_digest(crate_paths, extra_inputs=(), build_args=()):
+    """Digest of everything that goes into a module's .wasm artifact.
+
+    `crate_paths` lists the crate and its local path dependencies,
+    `extra_inputs` files embedded at compile time (e.g. via `include_str!`).
+    """
+    ensure_lockfile()
+    digest = hashlib.sha256()
+    digest.update(toolchain_version().encode())
+    digest.update(" ".join(build_args).encode())
+
+    for crate_path in crate_paths:
+        for path in _crate_files(crate_path):
+            _hash_file(digest, path)
+
+    for path in WORKSPACE_INPUTS + list(extra_inputs):
+        _hash_file(digest, path)
+
+    return digest.hexdigest()
+
+
+def artifact_path(digest, artifact_name):
+    # Keep the artifact's own file name so uploads look the same as before.
+    return os.path.join(BUILD_CACHE_DIR, digest, f"{artifact_name}.wasm")
+
+
+def lookup(digest, artifact_name):
+    path = artifact_path(digest, artifact_name)
+    if os.path.exists(path):
+        return path
+    return None
+
+
+def store(digest, artifact_name, built_path):
+    path = artifact_path(digest, artifact_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Copy next to the final name first so readers never see a partial file.
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.copyfile(built_path, tmp_path)
+    os.replace(tmp_path, path)
+
+    return path
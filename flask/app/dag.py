@@ -0,0 +1,106 @@
+import contextvars
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Step:
+    def __init__(self, name, fn, deps=()):
+        # `fn` is called with a `report(event, data)` callback that steps can
+        # use to emit extra progress events while they run.
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+
+
+class StepFailed(Exception):
+    def __init__(self, step, error):
+        super().__init__(f"{step}: {error}")
+        self.step = step
+        self.error = error
+
+
+def check_graph(steps):
+    names = {step.name for step in steps}
+    for step in steps:
+        for dep in step.deps:
+            if dep not in names:
+                raise ValueError(f"Step '{step.name}' depends on unknown step '{dep}'")
+
+    resolved = set()
+    pending = list(steps)
+    while pending:
+        ready = [step for step in pending if all(dep in resolved for dep in step.deps)]
+        if not ready:
+            raise ValueError(f"Dependency cycle between steps: {[step.name for step in pending]}")
+        resolved.update(step.name for step in ready)
+        pending = [step for step in pending if step.name not in resolved]
+
+
+def run_dag(steps, max_workers=4):
+    """Run `steps` on a thread pool, each as soon as its dependencies are done.
+
+    Yields `(event, payload)` tuples in the order they happen: a "start" and
+    a "step" event with timestamps for every step, plus anything the steps
+    report themselves. After the first failure no new steps are started; the
+    ones already running are waited for and StepFailed is raised.
+    """
+    check_graph(steps)
+
+    events = queue.Queue()
+    remaining = {step.name: step for step in steps}
+    done = set()
+    running = 0
+    failure = None
+
+    def execute(step):
+        start = time.time()
+        events.put(("start", {"step": step.name, "start": start}))
+
+        def report(event, data):
+            events.put((event, {"step": step.name, **data}))
+
+        try:
+            step.fn(report)
+        except Exception as e:
+            events.put(("_failed", (step, start, e)))
+        else:
+            events.put(("_done", (step, start, time.time())))
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline") as pool:
+
+        def schedule():
+            nonlocal running
+            for name, step in list(remaining.items()):
+                if all(dep in done for dep in step.deps):
+                    del remaining[name]
+                    running += 1
+                    # Steps run in a copy of the caller's context, so they
+                    # see its active trace.
+                    pool.submit(contextvars.copy_context().run, execute, step)
+
+        schedule()
+
+        while running:
+            event, payload = events.get()
+
+            if event == "_done":
+                step, start, end = payload
+                running -= 1
+                done.add(step.name)
+                yield "step", {"step": step.name, "start": start, "end": end, "duration": end - start}
+                if failure is None:
+                    schedule()
+
+            elif event == "_failed":
+                step, start, error = payload
+                running -= 1
+                if failure is None:
+                    failure = StepFailed(step.name, error)
+                yield "fail", {"step": step.name, "start": start, "end": time.time(), "error": str(error)}
+
+            else:
+                yield event, payload
+
+    if failure:
+        raise failure
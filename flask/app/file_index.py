@@ -0,0 +1,158 @@
+import fnmatch
+import os
+import posixpath
+import threading
+import time
+from python_scripts import metrics
+
+REFRESH_SECONDS = metrics.histogram("file_index_refresh_duration_seconds", "Refreshes of the /file-structure index.")
+RESCANNED_DIRS = metrics.counter("file_index_rescanned_dirs_total", "Directories listed again during index refreshes.")
+
+# A directory changed this close to its listing may have changed again
+# within the same mtime tick, so it is listed again on the next refresh.
+MTIME_SLACK_NS = 2_000_000_000
+
+
+class _Dir:
+    __slots__ = ("mtime_ns", "listed_ns", "dirs", "files")
+
+    def __init__(self, mtime_ns, listed_ns, dirs, files):
+        self.mtime_ns = mtime_ns
+        self.listed_ns = listed_ns
+        self.dirs = dirs
+        self.files = files
+
+
+class FileIndex:
+    """Directory listings under `root`, built on first use and refreshed by
+    listing again only the directories whose mtime changed.
+
+    Every directory is still stat()ed on a refresh, since a change deep in
+    the tree doesn't touch the mtimes of its parents, but unchanged ones
+    aren't listed again. Directories matching `exclude` (names or paths
+    relative to `root`, as globs) are left out along with everything below
+    them. Refreshes happen at most every `refresh_interval` seconds, on a
+    background thread: queries meanwhile get the previous listings, so only
+    the very first one waits for the tree to be walked.
+    """
+
+    def __init__(self, root=".", exclude=(), refresh_interval=5.0):
+        self.root = root
+        self.exclude = tuple(exclude)
+        self.refresh_interval = refresh_interval
+        self._dirs = {}
+        self._refreshed = None
+        # Held by whichever thread is refreshing; queries never wait on it
+        # once there is a listing to serve.
+        self._refresh_lock = threading.Lock()
+
+    def _excluded(self, path, name):
+        return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(path, pattern) for pattern in self.exclude)
+
+    def _list(self, path, mtime_ns):
+        dirs, files = [], []
+        with os.scandir(os.path.join(self.root, path)) as entries:
+            for entry in entries:
+                # Symlinked directories are listed but not followed, like os.walk.
+                if entry.is_dir(follow_symlinks=False):
+                    if not self._excluded(posixpath.join(path, entry.name), entry.name):
+                        dirs.append(entry.name)
+                else:
+                    files.append(entry.name)
+        RESCANNED_DIRS.inc()
+        return _Dir(mtime_ns, time.time_ns(), sorted(dirs), sorted(files))
+
+    def _refresh(self):
+        with metrics.span("file_index_refresh", REFRESH_SECONDS):
+            dirs = {}
+            pending = ["."]
+            while pending:
+                path = pending.pop()
+                try:
+                    mtime_ns = os.stat(os.path.join(self.root, path)).st_mtime_ns
+                    cached = self._dirs.get(path)
+                    if cached is None or cached.mtime_ns != mtime_ns or cached.listed_ns - mtime_ns < MTIME_SLACK_NS:
+                        cached = self._list(path, mtime_ns)
+                except (FileNotFoundError, NotADirectoryError, PermissionError):
+                    # Removed (or unreadable) since its parent was listed.
+                    continue
+                dirs[path] = cached
+                pending.extend(posixpath.normpath(posixpath.join(path, name)) for name in cached.dirs)
+
+            self._dirs = dirs
+            self._refreshed = time.monotonic()
+
+    def _refresh_in_background(self):
+        try:
+            self._refresh()
+        finally:
+            self._refresh_lock.release()
+
+    def _current(self):
+        if self._refreshed is None:
+            # Nothing to serve yet, so the first query builds the index itself.
+            with self._refresh_lock:
+                if self._refreshed is None:
+                    self._refresh()
+        elif (time.monotonic() - self._refreshed >= self.refresh_interval
+                and self._refresh_lock.acquire(blocking=False)):
+            threading.Thread(target=self._refresh_in_background, name="file-index-refresh", daemon=True).start()
+        return self._dirs
+
+    def query(self, path=".", depth=1, pattern=None, offset=0, limit=500):
+        """Entries below the directory `path` (relative to the root), up to
+        `depth` levels down, as `{"path", "type"}` dicts sorted by path.
+
+        `pattern` is a glob matched against entry names, or against paths
+        relative to `path` if it contains a "/". Directories that don't match
+        are still descended into. Returns one page of `limit` entries from
+        `offset`, with the total count and the offset of the next page.
+        """
+        if depth < 1:
+            raise ValueError("depth must be at least 1")
+        if offset < 0 or limit < 1:
+            raise ValueError("offset must be non-negative and limit positive")
+
+        path = posixpath.normpath(path.strip("/") or ".")
+        if path == ".." or path.startswith("../"):
+            raise ValueError(f"Path '{path}' is outside the indexed tree")
+
+        dirs = self._current()
+        if path not in dirs:
+            raise KeyError(path)
+
+        def matches(entry_path, name):
+            if pattern is None:
+                return True
+            if "/" in pattern:
+                return fnmatch.fnmatch(posixpath.relpath(entry_path, path), pattern)
+            return fnmatch.fnmatch(name, pattern)
+
+        entries = []
+        pending = [(path, 1)]
+        while pending:
+            current, level = pending.pop()
+            listing = dirs.get(current)
+            if listing is None:
+                continue
+            for name in listing.dirs:
+                entry_path = posixpath.normpath(posixpath.join(current, name))
+                if matches(entry_path, name):
+                    entries.append({"path": entry_path, "type": "dir"})
+                if level < depth:
+                    pending.append((entry_path, level + 1))
+            for name in listing.files:
+                entry_path = posixpath.normpath(posixpath.join(current, name))
+                if matches(entry_path, name):
+                    entries.append({"path": entry_path, "type": "file"})
+
+        entries.sort(key=lambda entry: entry["path"])
+        page = entries[offset:offset + limit]
+        return {
+            "path": path,
+            "depth": depth,
+            "total": len(entries),
+            "offset": offset,
+            "entries": page,
+            "next_offset": offset + limit if offset + limit < len(entries) else None,
+        }
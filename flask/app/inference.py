@@ -0,0 +1,255 @@
+import csv
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from python_scripts import mount_format
+from . import orchestrator
+from .settings import MOUNT_FORMAT
+
+
+def execute(deployment_id, files=None):
+    data = {"id": deployment_id}
+    response = orchestrator.post(f"/execute/{deployment_id}", "execute", data=data, files=files)
+    if response.status_code not in (200, 201):
+        raise Exception(f"Execution failed: Status code: {response.status_code}")
+    return response
+
+
+def fetch_probabilities(results_url):
+    """The classifier's latest output as a list of (class, probability)."""
+    response = orchestrator.get(results_url, "module_results")
+    response.raise_for_status()
+
+    # Either format is accepted, whatever MOUNT_FORMAT says: results_url may
+    # point at a deployment made with the other one.
+    if mount_format.is_binary(response.content):
+        _, probabilities, labels = mount_format.decode(response.content)
+        labels = labels or [str(index) for index in range(len(probabilities))]
+        return list(zip(labels, probabilities.tolist()))
+
+    csv_reader = csv.DictReader(response.text.splitlines())
+    return [(row['class'], float(row['probability'])) for row in csv_reader]
+
+
+def window_csv(window):
+    # Same layout save_sensor_data writes to accelerometer_data.csv.
+    return ", ".join(f"{float(value):.2f}" for value in window)
+
+
+def window_files(window):
+    """Execution input for one window in the configured mount format: the
+    samples mount, which the spectral module reads when it is the first
+    step."""
+    if MOUNT_FORMAT == "binary":
+        data = mount_format.encode(mount_format.SAMPLES, window)
+        return {"accelerometer_data.bin": ("accelerometer_data.bin", data, "application/octet-stream")}
+    return {"accelerometer_data.csv": ("accelerometer_data.csv", window_csv(window), "text/csv")}
+
+
+def run_batch(windows, targets, concurrency):
+    """Push every window through one of `targets` and collect the results.
+
+    Windows are spread round-robin over the targets (dicts with a
+    `deployment` id and the `results_url` of its classifier), which must
+    start with the spectral module for the windows to be used. Executions run
+    `concurrency` at a time overall, but one at a time per deployment: a
+    device keeps only the latest probabilities, so the next execution there
+    must wait until the previous result has been fetched. More concurrency
+    than there are deployments gains nothing.
+    """
+    deployment_locks = {target["deployment"]: threading.Lock() for target in targets}
+
+    def run_one(index):
+        target = targets[index % len(targets)]
+        result = {"index": index, "deployment": target["deployment"]}
+
+        with deployment_locks[target["deployment"]]:
+            start = time.perf_counter()
+            try:
+                execute(target["deployment"], files=window_files(windows[index]))
+                probabilities = fetch_probabilities(target["results_url"])
+            except Exception as e:
+                result.update(status="failed", error=str(e))
+            else:
+                result.update(status="ok", probabilities=dict(probabilities))
+                if probabilities:
+                    result["prediction"] = max(probabilities, key=lambda item: item[1])[0]
+            result["latency_seconds"] = time.perf_counter() - start
+
+        return result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(windows))), thread_name_prefix="batch") as pool:
+        results = list(pool.map(run_one, range(len(windows))))
+    elapsed = time.perf_counter() - start
+
+    return {"summary": summarize(results, elapsed), "results": results}
+
+
+def summarize(results, elapsed):
+    succeeded = [result for result in results if result["status"] == "ok"]
+    latencies = sorted(result["latency_seconds"] for result in results)
+
+    predictions = {}
+    probability_sums = {}
+    for result in succeeded:
+        if "prediction" in result:
+            predictions[result["prediction"]] = predictions.get(result["prediction"], 0) + 1
+        for class_name, probability in result["probabilities"].items():
+            probability_sums[class_name] = probability_sums.get(class_name, 0.0) + probability
+
+    return {
+        "windows": len(results),
+        "succeeded": len(succeeded),
+        "failed": len(results) - len(succeeded),
+        "elapsed_seconds": elapsed,
+        "windows_per_second": len(results) / elapsed if elapsed else None,
+        "mean_latency_seconds": sum(latencies) / len(latencies) if latencies else None,
+        "max_latency_seconds": latencies[-1] if latencies else None,
+        "predictions": predictions,
+        "mean_probabilities": {
+            class_name: total / len(succeeded) for class_name, total in probability_sums.items()
+        },
+    }
+
+
+class ContinuousInference:
+    """Runs a deployment in a loop and publishes each result to subscribers.
+
+    Executions are started at the target rate, each one after the previous
+    result has been fetched: a device keeps only the latest probabilities,
+    so an execution started while the previous result is being fetched
+    could overwrite it. Slots missed while an execution and its fetch were
+    still running are counted as dropped rather than caught up on. Each
+    subscriber has a small buffer of its own; a slow client loses its
+    oldest frames instead of holding up the loop or the other clients.
+    """
+
+    def __init__(self, subscriber_buffer=4):
+        self.subscriber_buffer = subscriber_buffer
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._stop = None
+        self.config = None
+        self.stats = {}
+
+    @property
+    def running(self):
+        return self._stop is not None and not self._stop.is_set()
+
+    def start(self, deployment_id, results_url, rate):
+        with self._lock:
+            if self.running:
+                raise Exception("Continuous inference is already running.")
+
+            self._stop = threading.Event()
+            self.config = {"deployment": deployment_id, "results_url": results_url, "target_rate": rate}
+            self.stats = {
+                "executions": 0,
+                "frames": 0,
+                "dropped": 0,
+                "errors": 0,
+                "achieved_rate": 0.0,
+                "lag_seconds": None,
+            }
+
+        # Each run's thread gets its own stop event, config and stats, so a
+        # run that is still finishing an execution can't touch the next one.
+        args = (self._stop, self.config, self.stats)
+        threading.Thread(target=self._run_loop, args=args, name="continuous-inference", daemon=True).start()
+
+    def stop(self):
+        with self._lock:
+            if self._stop is not None:
+                self._stop.set()
+
+    def status(self):
+        with self._lock:
+            return {"running": self.running, "config": self.config, "stats": dict(self.stats)}
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.subscriber_buffer)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _publish(self, stop, event, payload):
+        with self._lock:
+            # Nothing from a stopped run reaches the subscribers of the next.
+            if stop.is_set():
+                return
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait((event, payload))
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def _error(self, stop, stats, error):
+        with self._lock:
+            stats["errors"] += 1
+        self._publish(stop, "error", {"error": str(error), "time": time.time()})
+        stop.wait(1.0)
+
+    def _run_loop(self, stop, config, stats):
+        interval = 1.0 / config["target_rate"]
+        next_start = time.perf_counter()
+        last_published = None
+        sequence = 0
+
+        while not stop.is_set():
+            delay = next_start - time.perf_counter()
+            if delay > 0 and stop.wait(delay):
+                break
+            # Don't try to catch up on missed slots after a slow execution.
+            missed = int((time.perf_counter() - next_start) // interval)
+            next_start = max(next_start + interval, time.perf_counter())
+
+            started = time.time()
+            try:
+                execute(config["deployment"])
+            except Exception as e:
+                self._error(stop, stats, e)
+                continue
+
+            sequence += 1
+            with self._lock:
+                stats["executions"] += 1
+                stats["dropped"] += missed
+
+            try:
+                probabilities = fetch_probabilities(config["results_url"])
+            except Exception as e:
+                self._error(stop, stats, e)
+                continue
+
+            now = time.time()
+            with self._lock:
+                stats["frames"] += 1
+                stats["lag_seconds"] = now - started
+                if last_published is not None and now > last_published:
+                    # Exponentially weighted, so the rate follows changes
+                    # within a few frames.
+                    rate = 1.0 / (now - last_published)
+                    stats["achieved_rate"] = 0.8 * stats["achieved_rate"] + 0.2 * rate
+                last_published = now
+                frame_stats = dict(stats)
+
+            self._publish(stop, "probabilities", {
+                "sequence": sequence,
+                "started": started,
+                "probabilities": dict(probabilities),
+                "prediction": max(probabilities, key=lambda item: item[1])[0] if probabilities else None,
+                "time": now,
+                "stats": frame_stats,
+            })
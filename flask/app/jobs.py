@@ -0,0 +1,141 @@
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    """One pipeline run: its state, per-step timings and every event it has
+    emitted, numbered so streams can resume after a dropped connection."""
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.state = "queued"
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.steps = {}
+        self._events = []
+        self._event_ids = itertools.count(1)
+        self._cond = threading.Condition()
+
+    @property
+    def done(self):
+        return self.state in ("succeeded", "failed")
+
+    def emit(self, event, payload):
+        with self._cond:
+            if event in ("start", "step", "fail") and isinstance(payload, dict):
+                self.steps.setdefault(payload["step"], {}).update(payload, state=event)
+            self._events.append((next(self._event_ids), event, payload))
+            self._cond.notify_all()
+
+    def _set_state(self, state, error=None):
+        with self._cond:
+            self.state = state
+            self.error = error
+            if state == "running":
+                self.started = time.time()
+            elif state in ("succeeded", "failed"):
+                self.finished = time.time()
+            self._cond.notify_all()
+
+    def events_after(self, last_event_id, timeout=None):
+        """Events with an id above `last_event_id`, waiting up to `timeout`
+        seconds for new ones while the job is still running."""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.done or (self._events and self._events[-1][0] > last_event_id),
+                timeout=timeout,
+            )
+            # Ids are consecutive from 1, so they double as list offsets.
+            return self._events[max(last_event_id, 0):]
+
+    def to_dict(self):
+        with self._cond:
+            return {
+                "id": self.id,
+                "key": self.key,
+                "state": self.state,
+                "error": self.error,
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished,
+                "steps": {name: dict(step) for name, step in self.steps.items()},
+                "events": len(self._events),
+            }
+
+
+class JobManager:
+    """Runs jobs on a bounded thread pool, outside any request thread.
+
+    Submissions with the same key while a job for it is queued or running
+    join that job instead of starting another one. Finished jobs are kept
+    for replay until there are more than `max_jobs` of them or they are
+    older than `ttl` seconds.
+    """
+
+    def __init__(self, max_workers, max_jobs, ttl):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, run):
+        """Start `run(job)` for `key` unless a job for it is already active.
+        Returns `(job, created)`."""
+        with self._lock:
+            self._evict()
+
+            job = self._active.get(key)
+            if job is not None:
+                return job, False
+
+            job = Job(key)
+            self._jobs[job.id] = job
+            self._active[key] = job
+
+        self._pool.submit(self._execute, job, run)
+        return job, True
+
+    def _execute(self, job, run):
+        job._set_state("running")
+        try:
+            run(job)
+        except Exception as e:
+            job._set_state("failed", str(e))
+        else:
+            job._set_state("succeeded")
+        finally:
+            with self._lock:
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def latest(self, key):
+        with self._lock:
+            for job in reversed(self._jobs.values()):
+                if job.key == key:
+                    return job
+        return None
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _evict(self):
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.done]
+        expired = [job for job in finished if now - job.finished > self.ttl]
+        overflow = finished[:max(len(finished) - self.max_jobs, 0)]
+        for job in expired + overflow:
+            self._jobs.pop(job.id, None)
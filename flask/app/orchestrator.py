@@ -0,0 +1,124 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from python_scripts import metrics
+from .settings import (
+    WASMIOT_ORCHESTRATOR_URL,
+    ORCHESTRATOR_CONNECT_TIMEOUT,
+    ORCHESTRATOR_RETRIES,
+    ORCHESTRATOR_POOL_SIZE,
+)
+
+# Read timeouts per operation, in seconds. Uploads and deployments move
+# whole modules and models around, listings should be quick.
+READ_TIMEOUTS = {
+    "list_devices": 10,
+    "list_modules": 10,
+    "list_manifests": 10,
+    "upload_module": 120,
+    "describe_module": 120,
+    "create_manifest": 30,
+    "update_manifest": 30,
+    "deploy": 120,
+    "execute": 60,
+    "module_results": 10,
+}
+DEFAULT_READ_TIMEOUT = 30
+
+
+def _make_session():
+    # Connection failures are retried for every method since nothing reached
+    # the server; read errors and 50x responses only for idempotent ones.
+    retry = Retry(
+        total=ORCHESTRATOR_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=ORCHESTRATOR_POOL_SIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+session = _make_session()
+
+REQUEST_SECONDS = metrics.histogram(
+    "orchestrator_request_duration_seconds",
+    "Orchestrator and device requests, by operation.",
+    ["operation"],
+)
+REQUEST_ERRORS = metrics.counter(
+    "orchestrator_request_errors_total",
+    "Orchestrator requests that failed or got a 5xx response, by operation.",
+    ["operation"],
+)
+REQUEST_BYTES = metrics.counter(
+    "orchestrator_bytes_total",
+    "Request and response body bytes exchanged with the orchestrator, by operation and direction.",
+    ["operation", "direction"],
+)
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def _record(operation, seconds, failed):
+    with _stats_lock:
+        stats = _stats.setdefault(operation, {"count": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        stats["count"] += 1
+        stats["errors"] += int(failed)
+        stats["total_seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+    REQUEST_SECONDS.observe(seconds, operation=operation)
+    if failed:
+        REQUEST_ERRORS.inc(operation=operation)
+
+
+def latency_stats():
+    with _stats_lock:
+        return {
+            operation: dict(stats, mean_seconds=stats["total_seconds"] / stats["count"])
+            for operation, stats in _stats.items()
+        }
+
+
+def request(method, path, operation, **kwargs):
+    """Send a request to the orchestrator (or, given an absolute URL, to a
+    device) and record its latency under `operation`."""
+    url = path if path.startswith(("http://", "https://")) else WASMIOT_ORCHESTRATOR_URL + path
+    kwargs.setdefault("timeout", (ORCHESTRATOR_CONNECT_TIMEOUT, READ_TIMEOUTS.get(operation, DEFAULT_READ_TIMEOUT)))
+
+    start_time = time.time()
+    start = time.perf_counter()
+    failed = True
+    try:
+        response = session.request(method, url, **kwargs)
+        failed = response.status_code >= 500
+
+        body = response.request.body
+        if isinstance(body, str):
+            body = body.encode()
+        if isinstance(body, bytes):
+            REQUEST_BYTES.inc(len(body), operation=operation, direction="sent")
+        if not kwargs.get("stream"):
+            REQUEST_BYTES.inc(len(response.content), operation=operation, direction="received")
+        return response
+    finally:
+        seconds = time.perf_counter() - start
+        _record(operation, seconds, failed)
+        metrics.add_span(f"orchestrator.{operation}", start_time, seconds, failed=failed)
+
+
+def get(path, operation, **kwargs):
+    return request("GET", path, operation, **kwargs)
+
+
+def post(path, operation, **kwargs):
+    return request("POST", path, operation, **kwargs)
@@ -1,4 +1,121 @@
 import os
 
 WASMIOT_ORCHESTRATOR_URL = os.getenv("WASMIOT_ORCHESTRATOR_URL", "http://172.17.0.1:3000")
-#WASMIOT_ORCHESTRATOR_URL = os.getenv("WASMIOT_ORCHESTRATOR_URL", "http://127.0.0.1:3000/")
\ No newline at end of file
+#WASMIOT_ORCHESTRATOR_URL = os.getenv("WASMIOT_ORCHESTRATOR_URL", "http://127.0.0.1:3000/")
+
+# Cargo profile the wasm modules are built with: "release" (small, slow to
+# build), "fast" for quick rebuilds while working on a module or cargo's
+# unoptimized "dev", and cargo's parallel jobs (its default, one per CPU,
+# when unset). See modules/Cargo.toml.
+BUILD_PROFILE = os.getenv("BUILD_PROFILE", "release")
+BUILD_JOBS = os.getenv("BUILD_JOBS")
+# cargo puts the "dev" profile's output in debug/.
+WASM_TARGET_DIR = f"modules/target/wasm32-wasip1/{'debug' if BUILD_PROFILE == 'dev' else BUILD_PROFILE}"
+BUILD_CACHE_DIR = os.getenv("BUILD_CACHE_DIR", "build_cache")
+
+# Default model precision, "float32" or "int8" (Edge Impulse's quantized
+# model: smaller, cheaper to run, slightly less accurate). A pipeline run can
+# ask for the other one.
+MODEL_PRECISION = os.getenv("MODEL_PRECISION", "float32")
+
+# Deploy the classifier's model as an NNEF archive decluttered ahead of time
+# by modules/model_optimizer, rather than as the raw ONNX the devices would
+# have to analyse and declutter themselves.
+OPTIMIZE_MODEL = os.getenv("OPTIMIZE_MODEL", "true").lower() in ("1", "true", "yes")
+
+# Threads used to run independent pipeline steps concurrently.
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "4"))
+
+# Orchestrator client: connect timeout in seconds, retries for idempotent
+# requests and connection failures, and connections kept alive per host.
+ORCHESTRATOR_CONNECT_TIMEOUT = float(os.getenv("ORCHESTRATOR_CONNECT_TIMEOUT", "3.05"))
+ORCHESTRATOR_RETRIES = int(os.getenv("ORCHESTRATOR_RETRIES", "3"))
+ORCHESTRATOR_POOL_SIZE = int(os.getenv("ORCHESTRATOR_POOL_SIZE", "16"))
+
+# Uploads: skip modules and descriptions the orchestrator already has (as
+# recorded in the ledger), "gzip" to compress request bodies for an
+# orchestrator that accepts Content-Encoding: gzip, and the read size while
+# streaming files.
+UPLOAD_DEDUP = os.getenv("UPLOAD_DEDUP", "true").lower() in ("1", "true", "yes")
+UPLOAD_LEDGER_PATH = os.getenv("UPLOAD_LEDGER_PATH", os.path.join("models", "uploads.json"))
+UPLOAD_COMPRESSION = os.getenv("UPLOAD_COMPRESSION", "none")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+
+# Seconds between background refreshes of the device, module and deployment
+# registries.
+REGISTRY_REFRESH_INTERVAL = float(os.getenv("REGISTRY_REFRESH_INTERVAL", "30"))
+# Seconds between retries while the orchestrator hasn't answered yet at startup.
+REGISTRY_WARMUP_RETRY = float(os.getenv("REGISTRY_WARMUP_RETRY", "2"))
+
+# Pipeline jobs running at once. Runs share models/ and the crate
+# directories, so more than one only makes sense with separate checkouts.
+PIPELINE_JOB_WORKERS = int(os.getenv("PIPELINE_JOB_WORKERS", "1"))
+# Finished jobs kept for status queries and event replay, and for how long.
+PIPELINE_JOB_HISTORY = int(os.getenv("PIPELINE_JOB_HISTORY", "20"))
+PIPELINE_JOB_TTL = float(os.getenv("PIPELINE_JOB_TTL", "3600"))
+# Attach the run's trace (timed spans of steps, requests and builds) to the
+# pipeline's "end" event.
+PIPELINE_TRACE = os.getenv("PIPELINE_TRACE", "false").lower() in ("1", "true", "yes")
+
+# Format of the files the modules pass to each other: "csv", or "binary" for
+# little-endian f32 with a small header (see modules/mount_format).
+MOUNT_FORMAT = os.getenv("MOUNT_FORMAT", "csv")
+MOUNT_EXTENSION = {"csv": "csv", "binary": "bin"}[MOUNT_FORMAT]
+# The deployment the pipeline creates once and then updates in place, and its
+# steps in order as comma-separated device:module pairs (modules: save, spec,
+# model).
+def _deployment_sequence(value):
+    return [tuple(step.strip().split(":", 1)) for step in value.split(",") if step.strip()]
+
+
+DEPLOYMENT_NAME = os.getenv("DEPLOYMENT_NAME", "asd1233")
+DEPLOYMENT_SEQUENCE = _deployment_sequence(os.getenv("DEPLOYMENT_SEQUENCE", "device3:save,device1:spec,device2:model"))
+# Deployment /do_run_batch runs by default: the same chain without the save
+# step, which reads the live sensor, so the posted windows go straight to the
+# spectral module. Set the sequence empty to not create it.
+BATCH_DEPLOYMENT_NAME = os.getenv("BATCH_DEPLOYMENT_NAME", f"{DEPLOYMENT_NAME}-batch")
+BATCH_DEPLOYMENT_SEQUENCE = _deployment_sequence(os.getenv(
+    "BATCH_DEPLOYMENT_SEQUENCE",
+    ",".join(":".join(step) for step in DEPLOYMENT_SEQUENCE if step[1:] != ("save",)),
+))
+
+# Overlapping windows: with STREAM_STRIDE set, the save and spectral modules
+# are deployed with their streaming functions, and each execution classifies
+# the latest STREAM_WINDOW samples per axis (at 52 Hz, at most the sensor
+# buffer's 104), expecting STREAM_STRIDE new ones per execution. Only the
+# samples actually new since the previous execution are processed; strides
+# that are a multiple of 8, the FFT frame hop, reuse the most work.
+STREAM_WINDOW = int(os.getenv("STREAM_WINDOW", "104"))
+STREAM_STRIDE = int(os.getenv("STREAM_STRIDE", "0"))
+# Where the classifier's probabilities file of the default deployment is read.
+MODEL_RESULTS_URL = os.getenv("MODEL_RESULTS_URL", f"http://172.15.0.22:5000/module_results/model/probabilities.{MOUNT_EXTENSION}")
+# Batch inference: executions in flight at once, and windows per request.
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+# Further deployments /do_run_batch spreads windows over by default, next to
+# the batch deployment, as comma-separated name=results_url pairs (where each
+# one's classifier leaves its probabilities). A deployment runs one window at
+# a time, so these are what BATCH_CONCURRENCY fans out over.
+def _batch_targets(value):
+    targets = []
+    for target in value.split(","):
+        if target.strip():
+            name, results_url = target.split("=", 1)
+            targets.append((name.strip(), results_url.strip()))
+    return targets
+
+
+BATCH_EXTRA_TARGETS = _batch_targets(os.getenv("BATCH_EXTRA_TARGETS", ""))
+BATCH_MAX_WINDOWS = int(os.getenv("BATCH_MAX_WINDOWS", "10000"))
+
+# /file-structure index: directories left out (comma-separated globs matched
+# against names or paths relative to the app directory), seconds between
+# refreshes, the default and largest page sizes, and the deepest query.
+FILE_INDEX_EXCLUDE = [
+    pattern.strip()
+    for pattern in os.getenv("FILE_INDEX_EXCLUDE", ".git,__pycache__,target,venv,.venv,node_modules,build_cache").split(",")
+    if pattern.strip()
+]
+FILE_INDEX_REFRESH_INTERVAL = float(os.getenv("FILE_INDEX_REFRESH_INTERVAL", "5"))
+FILE_INDEX_PAGE_SIZE = int(os.getenv("FILE_INDEX_PAGE_SIZE", "500"))
+FILE_INDEX_MAX_PAGE_SIZE = int(os.getenv("FILE_INDEX_MAX_PAGE_SIZE", "5000"))
+FILE_INDEX_MAX_DEPTH = int(os.getenv("FILE_INDEX_MAX_DEPTH", "8"))
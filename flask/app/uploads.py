@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+from python_scripts import metrics
+from python_scripts.artifact_store import atomic_write, file_sha256
+from . import orchestrator
+from .settings import WASMIOT_ORCHESTRATOR_URL, UPLOAD_LEDGER_PATH, UPLOAD_COMPRESSION, UPLOAD_CHUNK_SIZE
+
+# Modules and module descriptions sent to the orchestrator, with the digest
+# of what was sent. An artifact whose digest matches the ledger, and whose
+# module the orchestrator still lists, doesn't need to be sent again.
+
+UPLOADS = metrics.counter(
+    "orchestrator_uploads_total",
+    "Module and description uploads, by kind and result (sent or skipped).",
+    ["kind", "result"],
+)
+UPLOAD_BYTES = metrics.counter(
+    "orchestrator_upload_bytes_total",
+    "Upload payload bytes, by kind and result: sent (before compression), wire (after) or skipped.",
+    ["kind", "result"],
+)
+UPLOAD_SAVED_SECONDS = metrics.counter(
+    "orchestrator_upload_saved_seconds_total",
+    "Upload time saved by skipped uploads, estimated from how long their last upload took.",
+    ["kind"],
+)
+
+_ledger_lock = threading.Lock()
+
+
+class MultipartStream:
+    """A multipart/form-data body that is read from disk while it is sent
+    instead of being built in memory.
+
+    `fields` are `(name, value)` pairs, `files` are `(name, filename, path,
+    content_type)`. The length is known up front, so requests sends it with a
+    Content-Length. Iterating again starts over, so a retried request sends
+    the whole body again.
+    """
+
+    def __init__(self, fields=(), files=()):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self._parts = []
+
+        for name, value in fields:
+            self._parts.append(self._part_header(name) + str(value).encode() + b"\r\n")
+        for name, filename, path, content_type in files:
+            self._parts.append(self._part_header(name, filename, content_type))
+            self._parts.append((path, os.path.getsize(path)))
+            self._parts.append(b"\r\n")
+        self._parts.append(f"--{self.boundary}--\r\n".encode())
+
+        self.length = sum(len(part) if isinstance(part, bytes) else part[1] for part in self._parts)
+
+    def _part_header(self, name, filename=None, content_type=None):
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        header = f"--{self.boundary}\r\nContent-Disposition: {disposition}\r\n"
+        if content_type:
+            header += f"Content-Type: {content_type}\r\n"
+        return (header + "\r\n").encode()
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for part in self._parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            with open(part[0], "rb") as f:
+                for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                    yield chunk
+
+
+class GzipStream:
+    """Gzip-compresses another body while it is sent. The compressed length
+    isn't known in advance, so this goes out with chunked encoding."""
+
+    def __init__(self, body):
+        self.body = body
+        self.sent = 0
+
+    def __iter__(self):
+        self.sent = 0
+        compressor = zlib.compressobj(wbits=31)
+        for chunk in self.body:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                self.sent += len(compressed)
+                yield compressed
+        tail = compressor.flush()
+        self.sent += len(tail)
+        yield tail
+
+
+def send(path, operation, fields=(), files=()):
+    """POST a multipart body to the orchestrator, streamed and compressed
+    as configured by UPLOAD_COMPRESSION. Returns the response, the bytes
+    before and after compression and the seconds the request took."""
+    start = time.perf_counter()
+    body = MultipartStream(fields, files)
+    headers = {"Content-Type": body.content_type}
+    data = body
+    if UPLOAD_COMPRESSION == "gzip":
+        data = GzipStream(body)
+        headers["Content-Encoding"] = "gzip"
+
+    response = orchestrator.post(path, operation, data=data, headers=headers)
+
+    wire = data.sent if isinstance(data, GzipStream) else body.length
+    orchestrator.REQUEST_BYTES.inc(wire, operation=operation, direction="sent")
+    return response, body.length, wire, time.perf_counter() - start
+
+
+def _load_ledger():
+    try:
+        with open(UPLOAD_LEDGER_PATH, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def ledger_entry(key):
+    # Entries are kept per orchestrator.
+    return _load_ledger().get(WASMIOT_ORCHESTRATOR_URL, {}).get(key)
+
+
+def record(key, entry):
+    with _ledger_lock:
+        ledger = _load_ledger()
+        ledger.setdefault(WASMIOT_ORCHESTRATOR_URL, {})[key] = entry
+        atomic_write(UPLOAD_LEDGER_PATH, json.dumps(ledger, indent=2).encode())
+
+
+def description_digest(fields, files):
+    """Digest of a module description: its fields and the content of its
+    mount files."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(sorted((name, str(value)) for name, value in fields)).encode())
+    for name, filename, path, _ in sorted(files):
+        digest.update(f"{name}\0{filename}\0{file_sha256(path)}\0".encode())
+    return digest.hexdigest()
+
+
+def report_skip(kind, entry):
+    """Count a skipped upload. Returns the bytes and seconds it saved."""
+    saved_bytes = entry.get("bytes", 0)
+    saved_seconds = entry.get("seconds", 0.0)
+    UPLOADS.inc(kind=kind, result="skipped")
+    UPLOAD_BYTES.inc(saved_bytes, kind=kind, result="skipped")
+    UPLOAD_SAVED_SECONDS.inc(saved_seconds, kind=kind)
+    return {"skipped": True, "bytes_saved": saved_bytes, "seconds_saved": saved_seconds}
+
+
+def report_sent(kind, sent, wire, seconds):
+    UPLOADS.inc(kind=kind, result="sent")
+    UPLOAD_BYTES.inc(sent, kind=kind, result="sent")
+    UPLOAD_BYTES.inc(wire, kind=kind, result="wire")
+    return {"skipped": False, "bytes": sent, "wire_bytes": wire, "seconds": seconds}
+
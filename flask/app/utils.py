@@ -1,35 +1,71 @@
-from .settings import WASMIOT_ORCHESTRATOR_URL
-import requests
-from .SETUP import update_modules, update_devices, update_deployments
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .settings import WASMIOT_ORCHESTRATOR_URL, REGISTRY_REFRESH_INTERVAL, REGISTRY_WARMUP_RETRY
+from . import orchestrator
+from .SETUP import MODULES, DEVICES, DEPLOYMENTS, update_modules, update_devices, update_deployments
 
-def pull_orchestrator_modules():
-    url = f"{WASMIOT_ORCHESTRATOR_URL}/file/module"
-    res = requests.get(url)
+def _pull(path, operation, registry, update):
+    # Conditional request: the orchestrator answers 304 when the listing
+    # hasn't changed since the last pull, and nothing is re-parsed.
+    headers = {"If-None-Match": registry.source_etag} if registry.loaded and registry.source_etag else {}
+
+    res = orchestrator.get(path, operation, headers=headers)
+    if res.status_code == 304:
+        return False
     res.raise_for_status()
 
-    if data := res.json():
-        update_modules(data)
-    else:
-        print(f"No modules found at {url}")
+    data = res.json()
+    if not data:
+        print(f"No {registry.name} found at {WASMIOT_ORCHESTRATOR_URL}{path}")
 
-def pull_orchestrator_devices():
+    return update(data or [], res.headers.get("ETag"))
 
-    url = f"{WASMIOT_ORCHESTRATOR_URL}/file/device"
-    res = requests.get(url)
-    res.raise_for_status()
+def pull_orchestrator_modules():
+    return _pull("/file/module", "list_modules", MODULES, update_modules)
+
+def pull_orchestrator_devices():
+    return _pull("/file/device", "list_devices", DEVICES, update_devices)
 
-    if data := res.json():
-        update_devices(data)
-    else:
-        print(f"No devices found at {url}")
-    
 def pull_orchestrator_deployments():
+    return _pull("/file/manifest", "list_manifests", DEPLOYMENTS, update_deployments)
 
-    url = f"{WASMIOT_ORCHESTRATOR_URL}/file/manifest"
-    res = requests.get(url)
-    res.raise_for_status()
 
-    if data := res.json():
-        update_deployments(data)
-    else:
-        print(f"No deployments found at {url}")
\ No newline at end of file
+REGISTRIES = (DEVICES, MODULES, DEPLOYMENTS)
+PULLS = (pull_orchestrator_devices, pull_orchestrator_modules, pull_orchestrator_deployments)
+
+_refresher = None
+
+def registries_ready():
+    return all(registry.loaded for registry in REGISTRIES)
+
+def _pull_all(pool):
+    # The three listings are independent, so fetch them concurrently.
+    futures = {pool.submit(pull): pull for pull in PULLS}
+    for future, pull in futures.items():
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Refresh with {pull.__name__} failed: {e}")
+
+def _refresh_loop(stop_event):
+    with ThreadPoolExecutor(max_workers=len(PULLS), thread_name_prefix="registry") as pool:
+        # Warm up right away, retrying quickly until every registry has been
+        # loaded once, then settle into the regular refresh interval.
+        _pull_all(pool)
+        while not registries_ready() and not stop_event.wait(REGISTRY_WARMUP_RETRY):
+            _pull_all(pool)
+
+        while not stop_event.wait(REGISTRY_REFRESH_INTERVAL):
+            _pull_all(pool)
+
+def start_registry_refresher():
+    """Load and then keep refreshing the registries from a background thread,
+    without blocking the caller. Safe to call more than once; only one
+    refresher runs."""
+    global _refresher
+    if _refresher is not None:
+        return _refresher
+
+    _refresher = threading.Event()
+    threading.Thread(target=_refresh_loop, args=(_refresher,), name="registry-refresher", daemon=True).start()
+    return _refresher
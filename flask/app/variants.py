@@ -0,0 +1,58 @@
+import json
+import os
+import statistics
+import threading
+import time
+from python_scripts.artifact_store import atomic_write
+
+# Sizes and timings of each model precision, so one can be chosen per
+# deployment. Kept across restarts in models/variants.json:
+#
+#   {"int8": {"tflite_bytes": ..., "onnx_bytes": ..., "deployed_model_bytes": ...,
+#             "wasm_bytes": ..., "run_seconds": {"median": ..., "samples": [...]}}}
+VARIANTS_PATH = os.path.join("models", "variants.json")
+
+# Latest end-to-end run times kept per precision.
+RUN_SAMPLES = 50
+
+_lock = threading.Lock()
+
+
+def load():
+    try:
+        with open(VARIANTS_PATH, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _update(precision, update):
+    with _lock:
+        variants = load()
+        variant = variants.setdefault(precision, {})
+        update(variant)
+        variant["updated"] = time.time()
+        atomic_write(VARIANTS_PATH, json.dumps(variants, indent=2).encode())
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return None
+
+
+def record_build(precision, **sizes):
+    """Record artifact sizes (in bytes) of a pipeline run."""
+    _update(precision, lambda variant: variant.update(sizes))
+
+
+def record_runs(precision, seconds):
+    """Record end-to-end execution times (execute plus fetching the
+    probabilities) of a deployment using this precision."""
+    def update(variant):
+        samples = (variant.get("run_seconds", {}).get("samples", []) + list(seconds))[-RUN_SAMPLES:]
+        variant["run_seconds"] = {"median": statistics.median(samples), "samples": samples}
+
+    if seconds:
+        _update(precision, update)
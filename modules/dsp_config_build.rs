@@ -0,0 +1,35 @@
+//! Build script of the modules that embed files generated for the downloaded
+//! model: copies each from models/ to OUT_DIR, or its checked-in default
+//! from modules/ while it hasn't been generated (a fresh checkout).
+
+use std::path::{Path, PathBuf};
+use std::{env, fs};
+
+/// The generated files a package embeds. Each has a default next to this
+/// script named `<stem>_default.<extension>`.
+fn generated_files(package: &str) -> &'static [&'static str] {
+    match package {
+        "wasi_edge_impulse_onnx" => &["dsp_config.rs", "quantization.txt", "classes.txt"],
+        _ => &["dsp_config.rs"],
+    }
+}
+
+fn main() {
+    let package = env::var("CARGO_PKG_NAME").expect("CARGO_PKG_NAME is set by cargo");
+    let out_dir = PathBuf::from(env::var("OUT_DIR").expect("OUT_DIR is set by cargo"));
+
+    for name in generated_files(&package) {
+        let (stem, extension) = name.split_once('.').expect("generated files have an extension");
+        let generated = Path::new("../../models").join(name);
+        let default = PathBuf::from(format!("../{}_default.{}", stem, extension));
+
+        // While the generated file is missing this reruns on every build, so
+        // it is picked up as soon as it appears.
+        println!("cargo:rerun-if-changed={}", generated.display());
+        println!("cargo:rerun-if-changed={}", default.display());
+
+        let source = if generated.exists() { generated } else { default };
+        fs::copy(&source, out_dir.join(name))
+            .unwrap_or_else(|e| panic!("Failed to copy {}: {}", source.display(), e));
+    }
+}
@@ -0,0 +1,8 @@
+// Spectral analysis parameters the modules are built with until a model is
+// downloaded, which generates models/dsp_config.rs from the project's block
+// (see python_scripts/download_model.py). Keep the same constants.
+pub const AXES: [&str; 3] = ["accX", "accY", "accZ"];
+pub const FFT_LENGTH: usize = 16;
+pub const DO_LOG: bool = true;
+pub const DO_FFT_OVERLAP: bool = true;
+pub const FEATURE_COUNT: usize = 39;
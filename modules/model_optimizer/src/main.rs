@@ -0,0 +1,90 @@
+//! Turns the converted ONNX model into a tract NNEF archive with a fixed
+//! input shape, decluttered ahead of time, so the classifier module only
+//! has to load it and generate its execution plan. Quantized (int8) models
+//! keep their input and output types.
+//!
+//!     model_optimizer <model.onnx> <model.nnef.tar> [input shape, default 1,39]
+//!
+//! The archive is loaded back and checked against the ONNX model on a
+//! sample input before the command succeeds.
+
+use anyhow::{bail, format_err};
+use std::fs::File;
+use std::time::Instant;
+use tract_onnx::prelude::*;
+use tract_onnx::WithOnnx;
+
+/// Largest difference allowed between the ONNX and NNEF outputs, for float
+/// and for quantized (integer) outputs.
+const TOLERANCE: f32 = 1e-4;
+const QUANTIZED_TOLERANCE: f32 = 1.0;
+
+fn parse_shape(shape: &str) -> TractResult<Vec<usize>> {
+    shape
+        .split(',')
+        .map(|dim| dim.trim().parse::<usize>().map_err(|_| format_err!("Invalid input shape: {}", shape)))
+        .collect()
+}
+
+/// Run `values`, cast to the model's input type, and return the output as f32.
+fn run(model: &TypedRunnableModel<TypedModel>, shape: &[usize], values: &[f32], input_type: DatumType) -> TractResult<Vec<f32>> {
+    let input = Tensor::from_shape(shape, values)?.cast_to_dt(input_type)?.into_owned();
+    let result = model.run(tvec!(input.into()))?;
+    Ok(result[0].cast_to::<f32>()?.as_slice::<f32>()?.to_vec())
+}
+
+fn main() -> TractResult<()> {
+    let args: Vec<String> = std::env::args().collect();
+    if args.len() < 3 {
+        bail!("Usage: {} <model.onnx> <model.nnef.tar> [input shape]", args[0]);
+    }
+    let (onnx_path, nnef_path) = (&args[1], &args[2]);
+    let shape = parse_shape(args.get(3).map(String::as_str).unwrap_or("1,39"))?;
+
+    let start = Instant::now();
+    let onnx = tract_onnx::onnx().model_for_path(onnx_path)?;
+    // Keep the declared input type: int8 for quantized models.
+    let input_fact = onnx.input_fact(0)?.clone().with_shape(shape.clone());
+    let onnx = onnx.with_input_fact(0, input_fact)?;
+    let decluttered = onnx.clone().into_typed()?.into_decluttered()?;
+    let input_type = decluttered.input_fact(0)?.datum_type;
+    let output_type = decluttered.output_fact(0)?.datum_type;
+    println!(
+        "Decluttered {} to {} nodes in {:.0} ms",
+        onnx_path,
+        decluttered.nodes().len(),
+        start.elapsed().as_secs_f64() * 1e3
+    );
+
+    let nnef = tract_nnef::nnef().with_tract_core().with_onnx();
+    nnef.write_to_tar(&decluttered, File::create(nnef_path)?)?;
+
+    // Same input through both models; deterministic so reruns agree.
+    let values: Vec<f32> = (0..shape.iter().product::<usize>()).map(|i| ((i % 7) as f32 - 3.0) * 0.5).collect();
+    let expected = run(&onnx.into_optimized()?.into_runnable()?, &shape, &values, input_type)?;
+
+    let start = Instant::now();
+    let reloaded = nnef.model_for_path(nnef_path)?.into_optimized()?.into_runnable()?;
+    let load_ms = start.elapsed().as_secs_f64() * 1e3;
+    let actual = run(&reloaded, &shape, &values, input_type)?;
+    let tolerance = if output_type.is_float() { TOLERANCE } else { QUANTIZED_TOLERANCE };
+
+    let max_difference = expected
+        .iter()
+        .zip(&actual)
+        .map(|(a, b)| (a - b).abs())
+        .fold(0.0f32, f32::max);
+    if expected.len() != actual.len() || max_difference > tolerance {
+        std::fs::remove_file(nnef_path)?;
+        bail!("Optimized model differs from {} (max difference {})", onnx_path, max_difference);
+    }
+
+    println!(
+        "Wrote {} ({} bytes), loads in {:.0} ms, max difference {:e}",
+        nnef_path,
+        std::fs::metadata(nnef_path)?.len(),
+        load_ms,
+        max_difference
+    );
+    Ok(())
+}
@@ -0,0 +1,128 @@
+//! Binary mount files shared by the modules: a 16-byte little-endian header
+//! followed by the values as little-endian f32 and optional UTF-8 labels.
+//!
+//! | offset | size | field                                      |
+//! |--------|------|--------------------------------------------|
+//! | 0      | 4    | magic `WMF1`                               |
+//! | 4      | 1    | version (1)                                |
+//! | 5      | 1    | kind (1 samples, 2 features, 3 probabilities) |
+//! | 6      | 2    | reserved (0)                               |
+//! | 8      | 4    | value count                                |
+//! | 12     | 4    | label bytes (newline-separated names)      |
+//! | 16     | 4 * count | values                                |
+//! | ...    | label bytes | labels                              |
+//!
+//! Keep in sync with python_scripts/mount_format.py.
+
+use std::fs::File;
+use std::io::{self, Write};
+
+pub const MAGIC: &[u8; 4] = b"WMF1";
+pub const VERSION: u8 = 1;
+pub const HEADER_LEN: usize = 16;
+
+#[derive(Clone, Copy, Debug, PartialEq, Eq)]
+pub enum Kind {
+    Samples = 1,
+    Features = 2,
+    Probabilities = 3,
+}
+
+/// The data isn't a binary mount file this version understands.
+#[derive(Debug)]
+pub struct FormatError;
+
+/// Whether `data` starts like a binary mount file (as opposed to CSV).
+pub fn is_binary(data: &[u8]) -> bool {
+    data.len() >= HEADER_LEN && &data[..4] == MAGIC
+}
+
+pub fn encode(kind: Kind, values: &[f32], labels: Option<&str>) -> Vec<u8> {
+    let labels = labels.unwrap_or("").as_bytes();
+    let mut data = Vec::with_capacity(HEADER_LEN + values.len() * 4 + labels.len());
+
+    data.extend_from_slice(MAGIC);
+    data.push(VERSION);
+    data.push(kind as u8);
+    data.extend_from_slice(&[0, 0]);
+    data.extend_from_slice(&(values.len() as u32).to_le_bytes());
+    data.extend_from_slice(&(labels.len() as u32).to_le_bytes());
+    for value in values {
+        data.extend_from_slice(&value.to_le_bytes());
+    }
+    data.extend_from_slice(labels);
+
+    data
+}
+
+pub fn write_file(path: &str, kind: Kind, values: &[f32], labels: Option<&str>) -> io::Result<()> {
+    File::create(path)?.write_all(&encode(kind, values, labels))
+}
+
+/// Decoded values and labels (empty when there are none).
+pub struct Decoded<'a> {
+    pub kind: u8,
+    pub values: Vec<f32>,
+    pub labels: &'a str,
+}
+
+pub fn decode(data: &[u8]) -> Result<Decoded<'_>, FormatError> {
+    if !is_binary(data) || data[4] != VERSION {
+        return Err(FormatError);
+    }
+
+    let count = u32::from_le_bytes([data[8], data[9], data[10], data[11]]) as usize;
+    let label_len = u32::from_le_bytes([data[12], data[13], data[14], data[15]]) as usize;
+    let values_end = count.checked_mul(4).and_then(|len| len.checked_add(HEADER_LEN)).ok_or(FormatError)?;
+    if data.len() < values_end || data.len() - values_end < label_len {
+        return Err(FormatError);
+    }
+
+    let values = data[HEADER_LEN..values_end]
+        .chunks_exact(4)
+        .map(|bytes| f32::from_le_bytes([bytes[0], bytes[1], bytes[2], bytes[3]]))
+        .collect();
+    let labels = std::str::from_utf8(&data[values_end..values_end + label_len]).map_err(|_| FormatError)?;
+
+    Ok(Decoded { kind: data[5], values, labels })
+}
+
+/// Where the streaming functions find their `StreamConfig`: a deployment
+/// mount uploaded with the module descriptions.
+pub const STREAM_CONFIG_PATH: &str = "stream.txt";
+
+/// Window and stride of the streaming functions, in samples per axis, given
+/// as `window=<n>` and `stride=<n>` lines.
+#[derive(Clone, Copy, Debug, PartialEq, Eq)]
+pub struct StreamConfig {
+    pub window: usize,
+    pub stride: usize,
+}
+
+impl StreamConfig {
+    pub fn parse(text: &str) -> Result<Self, FormatError> {
+        let mut window = None;
+        let mut stride = None;
+        for line in text.lines() {
+            let Some((key, value)) = line.split_once('=') else { continue };
+            let value = value.trim().parse::<usize>().map_err(|_| FormatError)?;
+            match key.trim() {
+                "window" => window = Some(value),
+                "stride" => stride = Some(value),
+                _ => {}
+            }
+        }
+
+        match (window, stride) {
+            (Some(window), Some(stride)) if window > 0 && stride > 0 && stride <= window => {
+                Ok(StreamConfig { window, stride })
+            }
+            _ => Err(FormatError),
+        }
+    }
+
+    pub fn read() -> Result<Self, FormatError> {
+        let text = std::fs::read_to_string(STREAM_CONFIG_PATH).map_err(|_| FormatError)?;
+        Self::parse(&text)
+    }
+}
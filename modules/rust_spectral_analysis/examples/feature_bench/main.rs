@@ -0,0 +1,237 @@
+//! Allocations and time per window of the spectral feature path, before and
+//! after reusing the FFT plan and scratch buffers, and per step of a sliding
+//! window recomputed from scratch or updated incrementally.
+//!
+//!     cargo run --release --example feature_bench              # all variants
+//!     cargo run --release --example feature_bench -- legacy 100000
+//!
+//! Given a variant name, only that one runs, so instruction counts can be
+//! compared with e.g. `perf stat -e instructions` (divide by the window
+//! count; the ~1 ms of setup is negligible at 100000 windows).
+
+mod legacy;
+
+use spectral_analysis::{feature_count, generate_features, generate_features_into, SlidingFeatures, SpectralScratch};
+use std::alloc::{GlobalAlloc, Layout, System};
+use std::hint::black_box;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::time::Instant;
+
+struct CountingAllocator;
+
+static ALLOCATIONS: AtomicUsize = AtomicUsize::new(0);
+static ALLOCATED_BYTES: AtomicUsize = AtomicUsize::new(0);
+
+unsafe impl GlobalAlloc for CountingAllocator {
+    unsafe fn alloc(&self, layout: Layout) -> *mut u8 {
+        ALLOCATIONS.fetch_add(1, Ordering::Relaxed);
+        ALLOCATED_BYTES.fetch_add(layout.size(), Ordering::Relaxed);
+        System.alloc(layout)
+    }
+
+    unsafe fn dealloc(&self, ptr: *mut u8, layout: Layout) {
+        System.dealloc(ptr, layout)
+    }
+
+    unsafe fn realloc(&self, ptr: *mut u8, layout: Layout, new_size: usize) -> *mut u8 {
+        ALLOCATIONS.fetch_add(1, Ordering::Relaxed);
+        ALLOCATED_BYTES.fetch_add(new_size, Ordering::Relaxed);
+        System.realloc(ptr, layout, new_size)
+    }
+}
+
+#[global_allocator]
+static GLOBAL: CountingAllocator = CountingAllocator;
+
+const WINDOW_LENGTH: usize = 312;
+const AXES: usize = 3;
+const FFT_LENGTH: i32 = 16;
+/// Sliding windows: 2 s of samples per axis at 52 Hz, moved by ~0.5 s (a
+/// multiple of the 8-sample frame hop).
+const SLIDING_WINDOW: usize = 104;
+const SLIDING_STRIDE: usize = 24;
+
+/// Deterministic accelerometer-like windows (gravity on z plus noise).
+fn make_windows(count: usize) -> Vec<Vec<f64>> {
+    let mut state: u64 = 0x2545_f491_4f6c_dd1d;
+    let mut next = move || {
+        state ^= state << 13;
+        state ^= state >> 7;
+        state ^= state << 17;
+        (state >> 11) as f64 / (1u64 << 53) as f64 * 4.0 - 2.0
+    };
+
+    (0..count)
+        .map(|_| {
+            (0..WINDOW_LENGTH)
+                .map(|i| {
+                    let value = next() + if i % 3 == 2 { 9.81 } else { 0.0 };
+                    (value * 100.0).round() / 100.0
+                })
+                .collect()
+        })
+        .collect()
+}
+
+fn axes() -> Vec<String> {
+    vec!["x".to_string(), "y".to_string(), "z".to_string()]
+}
+
+fn run_legacy(window: &[f64]) -> Vec<f64> {
+    legacy::generate_features(
+        4, false, window.to_vec(), axes(), 52, 1, 1, "none".to_string(), 0.0, 0,
+        "fft".to_string(), FFT_LENGTH, 0, 0, "0".to_string(), true, true, 3, "haar".to_string(), false,
+    )
+}
+
+fn run_current(window: &[f64]) -> Vec<f64> {
+    generate_features(
+        4, false, window.to_vec(), axes(), 52, 1, 1, "none".to_string(), 0.0, 0,
+        "fft".to_string(), FFT_LENGTH, 0, 0, "0".to_string(), true, true, 3, "haar".to_string(), false,
+    )
+}
+
+struct Measurement {
+    allocations: usize,
+    bytes: usize,
+    seconds: f64,
+}
+
+fn measure(windows: &[Vec<f64>], mut run: impl FnMut(&[f64])) -> Measurement {
+    let allocations = ALLOCATIONS.load(Ordering::Relaxed);
+    let bytes = ALLOCATED_BYTES.load(Ordering::Relaxed);
+    let start = Instant::now();
+
+    for window in windows {
+        run(black_box(window));
+    }
+
+    Measurement {
+        allocations: ALLOCATIONS.load(Ordering::Relaxed) - allocations,
+        bytes: ALLOCATED_BYTES.load(Ordering::Relaxed) - bytes,
+        seconds: start.elapsed().as_secs_f64(),
+    }
+}
+
+fn measure_steps(steps: usize, mut run: impl FnMut(usize)) -> Measurement {
+    let allocations = ALLOCATIONS.load(Ordering::Relaxed);
+    let bytes = ALLOCATED_BYTES.load(Ordering::Relaxed);
+    let start = Instant::now();
+
+    for step in 0..steps {
+        run(black_box(step));
+    }
+
+    Measurement {
+        allocations: ALLOCATIONS.load(Ordering::Relaxed) - allocations,
+        bytes: ALLOCATED_BYTES.load(Ordering::Relaxed) - bytes,
+        seconds: start.elapsed().as_secs_f64(),
+    }
+}
+
+fn report(name: &str, windows: usize, measurement: &Measurement) {
+    let per_window = windows as f64;
+    println!(
+        "{:<8} {:>10.1} allocs/window {:>10.0} bytes/window {:>10.2} us/window",
+        name,
+        measurement.allocations as f64 / per_window,
+        measurement.bytes as f64 / per_window,
+        measurement.seconds * 1e6 / per_window,
+    );
+}
+
+fn main() {
+    let args: Vec<String> = std::env::args().collect();
+    let variant = args.get(1).map(String::as_str).unwrap_or("all");
+    let count: usize = args.get(2).and_then(|count| count.parse().ok()).unwrap_or(10_000);
+
+    let windows = make_windows(count);
+
+    // Both paths must produce the same features.
+    let max_difference = windows
+        .iter()
+        .take(100)
+        .flat_map(|window| run_legacy(window).into_iter().zip(run_current(window)))
+        .map(|(old, new)| if old.is_nan() && new.is_nan() { 0.0 } else { (old - new).abs() })
+        .fold(0.0, f64::max);
+    assert!(max_difference < 1e-9, "features differ by {}", max_difference);
+
+    // The window copy and axis names that the generate_features signature
+    // takes by value are part of both legacy and current.
+    if variant == "all" || variant == "legacy" {
+        let measurement = measure(&windows, |window| {
+            black_box(run_legacy(window));
+        });
+        report("legacy", count, &measurement);
+    }
+
+    if variant == "all" || variant == "current" {
+        let measurement = measure(&windows, |window| {
+            black_box(run_current(window));
+        });
+        report("current", count, &measurement);
+    }
+
+    // Steady state: one scratch and one output buffer for every window.
+    if variant == "all" || variant == "reused" {
+        let mut scratch = SpectralScratch::new(FFT_LENGTH as usize);
+        let mut features = Vec::with_capacity(feature_count(AXES, FFT_LENGTH as usize));
+        let measurement = measure(&windows, |window| {
+            features.clear();
+            generate_features_into(window, AXES, &mut scratch, true, true, &mut features);
+            black_box(&features);
+        });
+        report("reused", count, &measurement);
+    }
+
+    // One long trace, stepped by SLIDING_STRIDE samples per axis.
+    let trace: Vec<f64> = windows.iter().flatten().copied().collect();
+    let steps = (trace.len() / 3 - SLIDING_WINDOW) / SLIDING_STRIDE;
+    let step_window = |step: usize| &trace[step * SLIDING_STRIDE * 3..(step * SLIDING_STRIDE + SLIDING_WINDOW) * 3];
+
+    // The incremental features must match the ones of each whole window.
+    let mut sliding = SlidingFeatures::new(SLIDING_WINDOW, AXES, FFT_LENGTH as usize, true, true);
+    let mut scratch = SpectralScratch::new(FFT_LENGTH as usize);
+    let (mut expected, mut actual) = (Vec::new(), Vec::new());
+    sliding.push(step_window(0));
+    for step in 0..steps.min(1000) {
+        if step > 0 {
+            let window = step_window(step);
+            sliding.push(&window[window.len() - SLIDING_STRIDE * 3..]);
+        }
+        expected.clear();
+        actual.clear();
+        generate_features_into(step_window(step), AXES, &mut scratch, true, true, &mut expected);
+        assert!(sliding.features_into(&mut actual));
+        for (old, new) in expected.iter().zip(&actual) {
+            let difference = if old.is_nan() && new.is_nan() { 0.0 } else { (old - new).abs() };
+            assert!(difference <= 1e-6 * old.abs().max(1.0), "step {}: {} vs {}", step, old, new);
+        }
+    }
+
+    // Every window from scratch, as testailu does.
+    if variant == "all" || variant == "window" {
+        let mut features = Vec::with_capacity(feature_count(AXES, FFT_LENGTH as usize));
+        let measurement = measure_steps(steps, |step| {
+            features.clear();
+            generate_features_into(step_window(step), AXES, &mut scratch, true, true, &mut features);
+            black_box(&features);
+        });
+        report("window", steps, &measurement);
+    }
+
+    // Only the new samples of each step, as testailu_stream does.
+    if variant == "all" || variant == "sliding" {
+        let mut sliding = SlidingFeatures::new(SLIDING_WINDOW, AXES, FFT_LENGTH as usize, true, true);
+        let mut features = Vec::with_capacity(feature_count(AXES, FFT_LENGTH as usize));
+        sliding.push(step_window(0));
+        let measurement = measure_steps(steps, |step| {
+            let window = step_window(step);
+            sliding.push(&window[window.len() - SLIDING_STRIDE * 3..]);
+            features.clear();
+            sliding.features_into(&mut features);
+            black_box(&features);
+        });
+        report("sliding", steps, &measurement);
+    }
+}
@@ -1,7 +1,53 @@
-use rustfft::{FftPlanner, num_complex::Complex};
+use rustfft::{Fft, FftPlanner, num_complex::Complex};
+use std::fmt::Write as _;
 use std::io::Write;
+use std::sync::{Arc, Mutex};
 //use wasm3_api::*;
 
+mod stream;
+
+pub use stream::SlidingFeatures;
+
+/// Parameters of the Edge Impulse project's spectral analysis block,
+/// generated into models/dsp_config.rs when the model is downloaded (or
+/// the defaults in modules/dsp_config_default.rs before that).
+#[allow(dead_code)]
+mod dsp_config {
+    include!(concat!(env!("OUT_DIR"), "/dsp_config.rs"));
+}
+
+/// FFT plan and buffers for one FFT length, reused for every axis, frame
+/// and window so the feature path doesn't allocate once it's set up.
+pub struct SpectralScratch {
+    nfft: usize,
+    fft: Arc<dyn Fft<f64>>,
+    frame: Vec<Complex<f64>>,
+    fft_scratch: Vec<Complex<f64>>,
+    spec_powers: Vec<f64>,
+    axis_data: Vec<f64>,
+}
+
+impl SpectralScratch {
+    pub fn new(nfft: usize) -> Self {
+        let fft = FftPlanner::<f64>::new().plan_fft_forward(nfft);
+        let fft_scratch = vec![Complex::new(0.0, 0.0); fft.get_inplace_scratch_len()];
+        SpectralScratch {
+            nfft,
+            fft,
+            frame: vec![Complex::new(0.0, 0.0); nfft],
+            fft_scratch,
+            spec_powers: vec![0.0; nfft / 2 + 1],
+            axis_data: Vec::new(),
+        }
+    }
+}
+
+/// Number of features generate_features produces for `axes` axes and
+/// `fft_length`.
+pub fn feature_count(axes: usize, fft_length: usize) -> usize {
+    axes * (5 + fft_length / 2)
+}
+
 pub fn generate_features(
     implementation_version: i32,
     draw_graphs: bool,
@@ -24,114 +70,80 @@ pub fn generate_features(
     wavelet: String,
     extra_low_freq: bool,
 ) -> Vec<f64> {
-    let mut fx: Vec<Vec<f64>> = vec![vec![], vec![], vec![]];
-
-    // Split the data into three separate vectors
-    for (i, value) in raw_data.iter().enumerate() {
-        match i % 3 {
-            0 => fx[0].push(*value),
-            1 => fx[1].push(*value),
-            2 => fx[2].push(*value),
-            _ => unreachable!(),
-        }
-    }
+    let mut scratch = SpectralScratch::new(fft_length as usize);
+    let mut all_features = Vec::with_capacity(feature_count(axes.len(), fft_length as usize));
+
+    generate_features_into(&raw_data, axes.len(), &mut scratch, do_log, do_fft_overlap, &mut all_features);
+
+    all_features
+}
+
+/// Appends the features of `raw_data` (samples of `axes` axes, interleaved)
+/// to `features`, using `scratch` for all intermediate data.
+pub fn generate_features_into(
+    raw_data: &[f64],
+    axes: usize,
+    scratch: &mut SpectralScratch,
+    do_log: bool,
+    do_fft_overlap: bool,
+    features: &mut Vec<f64>,
+) {
+    let mut axis_data = std::mem::take(&mut scratch.axis_data);
+
+    for axis in 0..axes {
+        // Take this axis' values and center them
+        axis_data.clear();
+        axis_data.extend(raw_data.iter().skip(axis).step_by(axes));
 
-    // Center each data axis
-    for axis_data in &mut fx {
         let mean: f64 = axis_data.iter().sum::<f64>() / axis_data.len() as f64;
         for value in axis_data.iter_mut() {
             *value -= mean;
         }
-    }
 
-    // Round values ​​to 8 decimal places
-    let fx_formatted: Vec<Vec<String>> = fx.iter()
-        .map(|axis_data| axis_data.iter()
-            .map(|&val| format!("{:.8}", val))
-            .collect()
-        ).collect();
-
-        let mut all_features: Vec<f64> = Vec::new();
-
-        for (i, axis_data) in fx.iter().enumerate() {
-            let (features, _, _, _) = extract_spec_features(
-                axis_data,
-                sampling_freq,
-                fft_length as i32,
-                &filter_type,
-                filter_cutoff,
-                do_log,
-                do_fft_overlap,
-                true,
-                &axes[i],
-            );
-            all_features.extend(features);
-        }
-    
-        all_features
+        extract_spec_features(&axis_data, scratch, do_log, do_fft_overlap, features);
     }
 
+    scratch.axis_data = axis_data;
+}
+
 fn extract_spec_features(
-    fx: &Vec<f64>,
-    sampling_freq: i32,
-    fft_length: i32,
-    filter_type: &str,
-    filter_cutoff: f64,
+    fx: &[f64],
+    scratch: &mut SpectralScratch,
     do_log: bool,
     do_fft_overlap: bool,
-    spec_stats: bool,
-    suffix: &str,
-) -> (Vec<f64>, Vec<String>, Vec<f64>, Vec<f64>) {
-    let mut features: Vec<f64> = Vec::new();
-
+    features: &mut Vec<f64>,
+) {
     let mean_square: f64 = fx.iter().map(|&x| x * x).sum::<f64>() / fx.len() as f64;
     let rms = mean_square.sqrt();
 
     features.push(rms);
+    features.push(skew(fx));
+    features.push(calculate_kurtosis(fx));
 
-    let skewness = skew(fx);
-    features.push(skewness);
+    let n_overlap = if do_fft_overlap { scratch.nfft / 2 } else { 0 };
+    welch_max_hold(fx, n_overlap, scratch);
 
-    let kurtosis = calculate_kurtosis(fx);
-    features.push(kurtosis);
-
-    let (freqs, mut spec_powers) = welch_max_hold(
-        fx,
-        sampling_freq as f64,
-        fft_length as usize,
-        if do_fft_overlap { (fft_length / 2) as usize } else { 0 },
-    );
-
-    if spec_stats {
-        let spec_skewness = skew(&spec_powers);
-        features.push(spec_skewness);
-
-        let spec_kurtosis = calculate_kurtosis(&spec_powers);
-        features.push(spec_kurtosis);
-    }
+    push_spectrum_features(&mut scratch.spec_powers, do_log, features);
+}
 
-    // Frequency spacing (Rust equivalent of freq_spacing = freqs[1])
-    let freq_spacing = if freqs.len() > 1 { freqs[1] - freqs[0] } else { 0.0 };
+/// Appends the skewness and kurtosis of the max-hold spectrum and its
+/// (log) powers without the DC bin.
+fn push_spectrum_features(spec_powers: &mut [f64], do_log: bool, features: &mut Vec<f64>) {
+    features.push(skew(spec_powers));
+    features.push(calculate_kurtosis(spec_powers));
 
     if do_log {
-        zero_handling(&mut spec_powers); // Replace zeros with epsilon
+        zero_handling(spec_powers); // Replace zeros with epsilon
         for val in spec_powers.iter_mut() {
             *val = val.log10();
         }
     }
 
     // Append spectral powers (excluding the first element)
-    for i in 1..spec_powers.len() {
-        features.push(spec_powers[i]);
-    }
-
-    // TODO: Implement labels if needed
-    let labels = vec![format!("Dummy Label{}", suffix)];
-
-    (features, labels, spec_powers, freqs)
+    features.extend_from_slice(&spec_powers[1..]);
 }
 
-fn skew(data: &Vec<f64>) -> f64 {
+fn skew(data: &[f64]) -> f64 {
     if data.len() < 2 {
         return 0.0;
     }
@@ -156,7 +168,7 @@ fn skew(data: &Vec<f64>) -> f64 {
     skewness
 }
 
-fn calculate_kurtosis(fx: &Vec<f64>) -> f64 {
+fn calculate_kurtosis(fx: &[f64]) -> f64 {
     let n = fx.len() as f64;
     let mean = fx.iter().sum::<f64>() / n;
     let variance = fx.iter().map(|&x| (x - mean).powi(2)).sum::<f64>() / n;
@@ -166,55 +178,34 @@ fn calculate_kurtosis(fx: &Vec<f64>) -> f64 {
     fourth_moment / variance.powi(2) - 3.0
 }
 
-fn welch_max_hold(
-    fx: &Vec<f64>,
-    sampling_freq: f64,
-    nfft: usize,
-    n_overlap: usize,
-) -> (Vec<f64>, Vec<f64>) {
-    let mut spec_powers = vec![0.0_f64; nfft / 2 + 1];
-    let mut freqs = vec![0.0_f64; nfft / 2 + 1];
-
-    // Precompute the frequencies
-    for i in 0..freqs.len() {
-        freqs[i] = i as f64 * sampling_freq / nfft as f64;
-    }
-
-    // Prepare FFT planner
-    let mut fft_planner = FftPlanner::new();
-    let fft = fft_planner.plan_fft_forward(nfft);
+/// Max-hold of the frame power spectra of `fx`, left in
+/// `scratch.spec_powers`. Frames are zero-padded and transformed in place
+/// in the scratch buffer.
+fn welch_max_hold(fx: &[f64], n_overlap: usize, scratch: &mut SpectralScratch) {
+    let nfft = scratch.nfft;
+    let spec_powers = &mut scratch.spec_powers;
+    spec_powers.iter_mut().for_each(|power| *power = 0.0);
 
     let mut ix = 0;
     while ix < fx.len() {
-        // Slice the data and zero-pad if necessary
+        // Copy the slice and zero-pad if necessary
         let end_idx = usize::min(ix + nfft, fx.len());
-        let mut input = vec![Complex::new(0.0, 0.0); nfft];
-        for j in 0..(end_idx - ix) {
-            input[j].re = fx[ix + j];
+        for (j, value) in scratch.frame.iter_mut().enumerate() {
+            *value = Complex::new(if ix + j < end_idx { fx[ix + j] } else { 0.0 }, 0.0);
         }
 
-        // Perform FFT
-        let mut spectrum = input.clone();
-        fft.process(&mut spectrum);
-
-        // Compute power spectrum
-        let power_spectrum: Vec<f64> = spectrum.iter()
-            .take(nfft / 2 + 1)
-            .map(|x| x.norm_sqr() as f64 / nfft as f64)
-            .collect();
+        scratch.fft.process_with_scratch(&mut scratch.frame, &mut scratch.fft_scratch);
 
         // Update the maximum spectral powers
-        for (i, &power) in power_spectrum.iter().enumerate() {
-            spec_powers[i] = spec_powers[i].max(power);
+        for (max_power, x) in spec_powers.iter_mut().zip(scratch.frame.iter()) {
+            *max_power = max_power.max(x.norm_sqr() / nfft as f64);
         }
 
         ix += nfft - n_overlap;
     }
-
-    (freqs, spec_powers)
 }
 
-fn zero_handling(x: &mut Vec<f64>) {
+fn zero_handling(x: &mut [f64]) {
     let epsilon = 1e-10;
     for val in x.iter_mut() {
         if *val == 0.0 {
@@ -223,38 +214,106 @@ fn zero_handling(x: &mut Vec<f64>) {
     }
 }
 
+/// Raw samples from a mount file, binary or CSV; either is accepted so this
+/// works with whichever format the previous stage wrote.
+fn read_raw_data(path: &str) -> Option<Vec<f64>> {
+    let Ok(data) = std::fs::read(path) else {
+        eprintln!("Failed to open file: {}", path);
+        return None;
+    };
+
+    if mount_format::is_binary(&data) {
+        let Ok(decoded) = mount_format::decode(&data) else {
+            eprintln!("Invalid mount file: {}", path);
+            return None;
+        };
+        return Some(decoded.values.iter().map(|&value| value as f64).collect());
+    }
+
+    let mut raw_data: Vec<f64> = Vec::new();
+    for line in String::from_utf8_lossy(&data).lines() {
+        // Parse straight from the line, without an owned String per value
+        raw_data.extend(line.split(',').filter_map(|value| value.trim().parse::<f64>().ok()));
+    }
+    Some(raw_data)
+}
+
 #[no_mangle]
 pub fn testailu() -> i32 {
-    use std::fs::File;
-    use std::io::{self, BufRead, BufReader};
+    extract_features_to("accelerometer_data.csv", "features.csv", false)
+}
+
+/// Binary mount format variant of testailu: features go to features.bin as
+/// f32 instead of being rounded to 4 decimals.
+#[no_mangle]
+pub fn testailu_bin() -> i32 {
+    extract_features_to("accelerometer_data.bin", "features.bin", true)
+}
+
+/// Streaming variant of testailu for overlapping windows. Each call adds the
+/// samples in accelerometer_data.csv (the samples save_sensor_stream hasn't
+/// written before) to the window kept between calls and writes the features
+/// of the latest `window` samples, with `window` from the stream.txt
+/// deployment mount. Only the FFT frames the new samples complete are
+/// computed. Until the window has been filled it writes an empty features
+/// file, which the classifier rejects, and returns 1.
+#[no_mangle]
+pub fn testailu_stream() -> i32 {
+    stream_features_to("accelerometer_data.csv", "features.csv", false)
+}
 
+#[no_mangle]
+pub fn testailu_stream_bin() -> i32 {
+    stream_features_to("accelerometer_data.bin", "features.bin", true)
+}
+
+const WINDOW_NOT_FULL: i32 = 1;
+
+static STREAM: Mutex<Option<SlidingFeatures>> = Mutex::new(None);
+
+fn stream_features_to(raw_data_path: &str, file_path: &str, binary: bool) -> i32 {
+    let Ok(config) = mount_format::StreamConfig::read()
+        else { return SaveFeaturesError::InvalidStreamConfig as i32 };
+    let Some(raw_data) = read_raw_data(raw_data_path) else {
+        return 9;
+    };
+
+    let mut stream = STREAM.lock().unwrap_or_else(|poisoned| poisoned.into_inner());
+    if stream.as_ref().map_or(true, |stream| stream.window() != config.window) {
+        *stream = Some(SlidingFeatures::new(
+            config.window,
+            dsp_config::AXES.len(),
+            dsp_config::FFT_LENGTH,
+            dsp_config::DO_FFT_OVERLAP,
+            dsp_config::DO_LOG,
+        ));
+    }
+    let stream = stream.as_mut().unwrap();
+
+    stream.push(&raw_data);
+    let mut features = Vec::with_capacity(dsp_config::FEATURE_COUNT);
+    if !stream.features_into(&mut features) {
+        // Replace the previous call's features so the classifier can't pick
+        // them up again; it rejects an empty file.
+        let status = write_features(file_path, &[], binary);
+        return if status != 0 { status } else { WINDOW_NOT_FULL };
+    }
+
+    write_features(file_path, &features, binary)
+}
+
+fn extract_features_to(raw_data_path: &str, file_path: &str, binary: bool) -> i32 {
     let implementation_version = 4;
     let draw_graphs = false;
 
-    // Read raw data from raw_data.csv
-    let raw_data_path = "accelerometer_data.csv";
-    let file = File::open(raw_data_path);
-    let Ok(file) = file else {
-        eprintln!("Failed to open file: {}", raw_data_path);
+    let Some(raw_data) = read_raw_data(raw_data_path) else {
         return 9;
     };
 
-    let reader = BufReader::new(file);
-
-    let raw_data: Vec<f64> = reader
-    .lines()
-    .filter_map(|line| line.ok()) // Skip lines that fail to read
-    .flat_map(|line| {
-        line.split(',')
-            .map(|value| value.trim().to_owned()) // Convert each slice into an owned String
-            .collect::<Vec<String>>() // Collect into a Vec<String> to ensure ownership
-            .into_iter() // Convert back into an iterator
-            .filter_map(|value| value.parse::<f64>().ok()) // Parse each String into f64
-    })
-    .collect();
-
-    let axes = vec!["x".to_string(), "y".to_string(), "z".to_string()];
-    let sampling_freq = 52;
+    let axes = dsp_config::AXES.iter().map(|axis| axis.to_string()).collect();
+    // Only labels the spectrum's bins in Edge Impulse; none of the features
+    // computed here depend on it.
+    let sampling_freq = 0;
     let scale_axes = 1;
     let input_decimation_ratio = 1;
     let filter_type = "none".to_string();
@@ -262,13 +321,13 @@ pub fn testailu() -> i32 {
     let filter_order = 0;
     let analysis_type = "fft".to_string();
 
-    let fft_length = 16;
+    let fft_length = dsp_config::FFT_LENGTH as i32;
     let spectral_peaks_count = 0;
     let spectral_peaks_threshold = 0;
     let spectral_power_edges = "0".to_string();
 
-    let do_log = true;
-    let do_fft_overlap = true;
+    let do_log = dsp_config::DO_LOG;
+    let do_fft_overlap = dsp_config::DO_FFT_OVERLAP;
     let extra_low_freq = false;
 
     let wavelet_level = 3;
@@ -298,18 +357,29 @@ pub fn testailu() -> i32 {
         extra_low_freq,
     );
 
-    // Save features to a file in a single line with comma-separated values
-    let file_path = "features.csv";
+    write_features(file_path, &features, binary)
+}
+
+fn write_features(file_path: &str, features: &[f64], binary: bool) -> i32 {
     let Ok(mut output) = std::fs::File::create(file_path)
         else { return SaveFeaturesError::FileCreationFailed as i32 };
 
-    let data: String = features
-        .iter()
-        .map(|f| format!("{:.4}", f))
-        .collect::<Vec<String>>()
-        .join(", ");
+    let data = if binary {
+        let values: Vec<f32> = features.iter().map(|&feature| feature as f32).collect();
+        mount_format::encode(mount_format::Kind::Features, &values, None)
+    } else {
+        // Save features to a file in a single line with comma-separated values
+        let mut data = String::with_capacity(features.len() * 10);
+        for (i, feature) in features.iter().enumerate() {
+            if i > 0 {
+                data.push_str(", ");
+            }
+            let _ = write!(data, "{:.4}", feature);
+        }
+        data.into_bytes()
+    };
 
-    let Ok(_) = output.write_all(data.as_bytes())
+    let Ok(_) = output.write_all(&data)
         else { return SaveFeaturesError::FileWriteFailed as i32 };
 
     // Return 0 to indicate success
@@ -319,4 +389,5 @@ pub fn testailu() -> i32 {
 enum SaveFeaturesError {
     FileCreationFailed = -1,
     FileWriteFailed = -2,
-}
\ No newline at end of file
+    InvalidStreamConfig = -3,
+}
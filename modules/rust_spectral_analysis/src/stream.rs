@@ -0,0 +1,299 @@
+//! Features of a sliding window, updated as samples arrive instead of being
+//! recomputed for every window.
+//!
+//! Per axis the window's samples are kept in a ring buffer with running sums
+//! of their first four powers, so the mean, RMS, skewness and kurtosis cost
+//! O(1) per new sample. Welch frames that lie fully inside the window don't
+//! change when it slides (as long as it slides by a multiple of the frame
+//! hop, nfft / 2 with overlap), so each frame is transformed once. Their
+//! powers go into sliding maxima per bin. Only the zero-padded frames at the
+//! end of the window are transformed again for every window. Centering
+//! doesn't change the powers of a full frame except at DC, which is derived
+//! from the frame's sum and the current mean. (Full frames are still
+//! transformed around a recent mean, so a large offset like gravity doesn't
+//! leak rounding errors into nearly empty bins, which the log would blow up.)
+
+use super::{feature_count, push_spectrum_features, SpectralScratch};
+use rustfft::num_complex::Complex;
+use std::collections::VecDeque;
+
+/// Maximum over a sliding range of frames. Values that can't be the maximum
+/// again are dropped when a larger one is pushed, so every frame is pushed
+/// and popped once.
+struct SlidingMax {
+    values: VecDeque<(u64, f64)>,
+}
+
+impl SlidingMax {
+    fn new() -> Self {
+        SlidingMax { values: VecDeque::new() }
+    }
+
+    fn push(&mut self, frame: u64, value: f64) {
+        while matches!(self.values.back(), Some(&(_, last)) if last <= value) {
+            self.values.pop_back();
+        }
+        self.values.push_back((frame, value));
+    }
+
+    /// Drops the frames starting before `start`.
+    fn expire(&mut self, start: u64) {
+        while matches!(self.values.front(), Some(&(frame, _)) if frame < start) {
+            self.values.pop_front();
+        }
+    }
+
+    fn max(&self) -> Option<f64> {
+        self.values.front().map(|&(_, value)| value)
+    }
+
+    fn clear(&mut self) {
+        self.values.clear();
+    }
+}
+
+struct AxisWindow {
+    samples: VecDeque<f64>,
+    /// Sums of (x - shift)^1..4 over `samples`. Shifting by a recent mean
+    /// keeps the moments accurate when the signal sits far from zero (like
+    /// gravity on z).
+    shift: f64,
+    sums: [f64; 4],
+    /// Samples removed from the sums since they were last recomputed.
+    evicted: usize,
+    /// Sliding maxima of the full frames' powers per bin (DC unused) and of
+    /// their sums and negated sums, for the DC power after centering.
+    bin_max: Vec<SlidingMax>,
+    sum_max: SlidingMax,
+    sum_min: SlidingMax,
+}
+
+impl AxisWindow {
+    fn new(window: usize, bins: usize) -> Self {
+        AxisWindow {
+            samples: VecDeque::with_capacity(window + 1),
+            shift: 0.0,
+            sums: [0.0; 4],
+            evicted: 0,
+            bin_max: (0..bins).map(|_| SlidingMax::new()).collect(),
+            sum_max: SlidingMax::new(),
+            sum_min: SlidingMax::new(),
+        }
+    }
+
+    fn add(&mut self, x: f64, sign: f64) {
+        let d = x - self.shift;
+        let d2 = d * d;
+        self.sums[0] += sign * d;
+        self.sums[1] += sign * d2;
+        self.sums[2] += sign * d2 * d;
+        self.sums[3] += sign * d2 * d2;
+    }
+
+    fn push(&mut self, x: f64, window: usize) {
+        if self.samples.is_empty() {
+            self.shift = x;
+        }
+        self.samples.push_back(x);
+        self.add(x, 1.0);
+        if self.samples.len() > window {
+            let old = self.samples.pop_front().unwrap();
+            self.add(old, -1.0);
+            self.evicted += 1;
+        }
+
+        // Recompute the sums once per window's worth of evictions, so
+        // rounding errors don't build up; O(1) per sample amortized.
+        if self.evicted >= window {
+            self.shift = self.samples.iter().sum::<f64>() / self.samples.len() as f64;
+            self.sums = [0.0; 4];
+            for i in 0..self.samples.len() {
+                self.add(self.samples[i], 1.0);
+            }
+            self.evicted = 0;
+        }
+    }
+
+    fn clear_frames(&mut self) {
+        self.bin_max.iter_mut().for_each(SlidingMax::clear);
+        self.sum_max.clear();
+        self.sum_min.clear();
+    }
+
+    fn expire_frames(&mut self, start: u64) {
+        self.bin_max.iter_mut().for_each(|bin| bin.expire(start));
+        self.sum_max.expire(start);
+        self.sum_min.expire(start);
+    }
+
+    /// Mean, RMS of the centered signal, skewness and kurtosis, like
+    /// extract_spec_features computes them from the whole window.
+    fn moments(&self) -> (f64, f64, f64, f64) {
+        let n = self.samples.len() as f64;
+        let a = self.sums[0] / n;
+        let m2 = self.sums[1] / n;
+        let m3 = self.sums[2] / n;
+        let m4 = self.sums[3] / n;
+
+        let variance = (m2 - a * a).max(0.0);
+        let third = m3 - 3.0 * a * m2 + 2.0 * a * a * a;
+        let fourth = m4 - 4.0 * a * m3 + 6.0 * a * a * m2 - 3.0 * a * a * a * a;
+
+        let std_dev = variance.sqrt();
+        let skewness = if self.samples.len() < 2 || std_dev == 0.0 { 0.0 } else { third / (variance * std_dev) };
+        (self.shift + a, std_dev, skewness, fourth / (variance * variance) - 3.0)
+    }
+}
+
+/// Sliding-window version of generate_features_into for one configuration.
+pub struct SlidingFeatures {
+    window: usize,
+    hop: usize,
+    do_log: bool,
+    /// Samples per axis pushed so far.
+    total: u64,
+    /// Start of the next full frame to transform, and the frame grid it
+    /// belongs to (the window start modulo the hop).
+    next_frame: u64,
+    grid: Option<u64>,
+    axes: Vec<AxisWindow>,
+    scratch: SpectralScratch,
+}
+
+impl SlidingFeatures {
+    /// `window` is in samples per axis.
+    pub fn new(window: usize, axes: usize, fft_length: usize, do_fft_overlap: bool, do_log: bool) -> Self {
+        let hop = fft_length - if do_fft_overlap { fft_length / 2 } else { 0 };
+        let bins = fft_length / 2 + 1;
+        SlidingFeatures {
+            window,
+            hop,
+            do_log,
+            total: 0,
+            next_frame: 0,
+            grid: None,
+            axes: (0..axes).map(|_| AxisWindow::new(window, bins)).collect(),
+            scratch: SpectralScratch::new(fft_length),
+        }
+    }
+
+    pub fn window(&self) -> usize {
+        self.window
+    }
+
+    pub fn is_full(&self) -> bool {
+        self.axes[0].samples.len() == self.window
+    }
+
+    /// Adds interleaved samples of all axes; an incomplete last sample is
+    /// ignored.
+    pub fn push(&mut self, raw_data: &[f64]) {
+        for sample in raw_data.chunks_exact(self.axes.len()) {
+            for (axis, &value) in self.axes.iter_mut().zip(sample) {
+                axis.push(value, self.window);
+            }
+            self.total += 1;
+        }
+    }
+
+    /// Appends the features of the latest `window` samples per axis to
+    /// `features`, or returns false while fewer have been pushed.
+    pub fn features_into(&mut self, features: &mut Vec<f64>) -> bool {
+        if !self.is_full() {
+            return false;
+        }
+        features.reserve(feature_count(self.axes.len(), self.scratch.nfft));
+
+        let start = self.total - self.window as u64;
+        let hop = self.hop as u64;
+        let nfft = self.scratch.nfft as u64;
+
+        // The window moved by something other than a multiple of the hop, so
+        // the frames fall on a different grid: start over.
+        if self.grid != Some(start % hop) {
+            self.grid = Some(start % hop);
+            self.next_frame = start;
+            self.axes.iter_mut().for_each(AxisWindow::clear_frames);
+        }
+        while self.next_frame < start {
+            self.next_frame += hop;
+        }
+
+        for axis in 0..self.axes.len() {
+            self.axes[axis].expire_frames(start);
+
+            // Frames the new samples completed.
+            let mut frame = self.next_frame;
+            while frame + nfft <= self.total {
+                let offset = (frame - start) as usize;
+                self.transform_frame(axis, offset, self.axes[axis].shift);
+                let frame_sum: f64 = self.axes[axis].samples.range(offset..offset + nfft as usize).sum();
+                let axis_window = &mut self.axes[axis];
+                for (bin, max) in axis_window.bin_max.iter_mut().enumerate().skip(1) {
+                    max.push(frame, self.scratch.spec_powers[bin]);
+                }
+                axis_window.sum_max.push(frame, frame_sum);
+                axis_window.sum_min.push(frame, -frame_sum);
+                frame += hop;
+            }
+            let tail = frame;
+
+            let (mean, rms, skewness, kurtosis) = self.axes[axis].moments();
+            features.push(rms);
+            features.push(skewness);
+            features.push(kurtosis);
+
+            // Max-hold over the full frames...
+            let mut max_hold = std::mem::take(&mut self.scratch.axis_data);
+            max_hold.clear();
+            let axis_window = &self.axes[axis];
+            let dc = match (axis_window.sum_max.max(), axis_window.sum_min.max()) {
+                (Some(high), Some(low)) => {
+                    let center = nfft as f64 * mean;
+                    f64::max((high - center).powi(2), (-low - center).powi(2)) / nfft as f64
+                }
+                _ => 0.0,
+            };
+            max_hold.push(dc);
+            max_hold.extend(axis_window.bin_max.iter().skip(1).map(|max| max.max().unwrap_or(0.0)));
+
+            // ...and the zero-padded ones at the end, centered.
+            let mut frame = tail;
+            while frame < self.total {
+                self.transform_frame(axis, (frame - start) as usize, mean);
+                for (max, &power) in max_hold.iter_mut().zip(self.scratch.spec_powers.iter()) {
+                    *max = max.max(power);
+                }
+                frame += hop;
+            }
+
+            push_spectrum_features(&mut max_hold, self.do_log, features);
+            self.scratch.axis_data = max_hold;
+        }
+
+        // The full frames are kept; the padded ones change with every window.
+        while self.next_frame + nfft <= self.total {
+            self.next_frame += hop;
+        }
+        true
+    }
+
+    /// Power spectrum of the frame at `offset` in the axis' window, centered
+    /// on `center` and zero-padded past the window's end, into
+    /// `scratch.spec_powers`.
+    fn transform_frame(&mut self, axis: usize, offset: usize, center: f64) {
+        let scratch = &mut self.scratch;
+        let samples = &self.axes[axis].samples;
+        for (j, value) in scratch.frame.iter_mut().enumerate() {
+            let x = samples.get(offset + j).map_or(0.0, |&x| x - center);
+            *value = Complex::new(x, 0.0);
+        }
+
+        scratch.fft.process_with_scratch(&mut scratch.frame, &mut scratch.fft_scratch);
+
+        let nfft = scratch.nfft as f64;
+        for (power, x) in scratch.spec_powers.iter_mut().zip(scratch.frame.iter()) {
+            *power = x.norm_sqr() / nfft;
+        }
+    }
+}
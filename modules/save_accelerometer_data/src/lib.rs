@@ -1,19 +1,30 @@
 use wasm3_api::*;
 use std::fs::File;
 use std::io::Write;
+use std::sync::Mutex;
 
 enum TestiFunctionPredefinedPathError {
     FileCreationFailed = -1,
     FileWriteFailed = -2,
+    InvalidStreamConfig = -3,
 }
 
-#[no_mangle]
-pub fn save_sensor_data() -> i32 {
+/// Interleaved x, y, z samples in the sensor buffer, oldest first.
+const SENSOR_BUFFER_LEN: usize = 312;
+
+fn sensor_data() -> &'static [f32] {
     let ptr = testiFunction(0);
 
-    let list_size = 312;
-    let numbers: &[f32] = unsafe { std::slice::from_raw_parts(ptr as *const f32, list_size) };
+    let list_size = SENSOR_BUFFER_LEN;
+    unsafe { std::slice::from_raw_parts(ptr as *const f32, list_size) }
+}
 
+#[no_mangle]
+pub fn save_sensor_data() -> i32 {
+    write_csv(sensor_data())
+}
+
+fn write_csv(numbers: &[f32]) -> i32 {
     // Format numbers to two decimal places and join them with commas
     let list_str = numbers
         .iter()
@@ -30,3 +41,80 @@ pub fn save_sensor_data() -> i32 {
 
     0
 }
+
+/// Same as save_sensor_data, but writes the samples unformatted and at full
+/// precision to accelerometer_data.bin (see the mount_format crate).
+#[no_mangle]
+pub fn save_sensor_data_bin() -> i32 {
+    write_bin(sensor_data())
+}
+
+fn write_bin(numbers: &[f32]) -> i32 {
+    let data = mount_format::encode(mount_format::Kind::Samples, numbers, None);
+
+    let Ok(mut output) = File::create("accelerometer_data.bin")
+        else { return TestiFunctionPredefinedPathError::FileCreationFailed as i32 };
+
+    let Ok(_) = output.write_all(&data)
+        else { return TestiFunctionPredefinedPathError::FileWriteFailed as i32 };
+
+    0
+}
+
+/// The sensor buffer as of the previous streaming call.
+static STREAM_PREVIOUS: Mutex<Vec<f32>> = Mutex::new(Vec::new());
+
+/// How many samples per axis `numbers` gained since `previous`, the sensor
+/// buffer at the previous call: the shift that lines the two buffers up,
+/// trying `stride` first and then the smallest. A buffer that doesn't change
+/// in between could line up at any shift, so the configured one wins. None
+/// if they don't line up at all, on the first call or after a gap as long as
+/// the buffer.
+fn new_sample_count(previous: &[f32], numbers: &[f32], stride: usize) -> Option<usize> {
+    if previous.len() != numbers.len() {
+        return None;
+    }
+    let samples = numbers.len() / 3;
+    let lines_up = |shift: usize| previous[shift * 3..] == numbers[..numbers.len() - shift * 3];
+
+    if stride < samples && lines_up(stride) {
+        return Some(stride);
+    }
+    (0..samples).find(|&shift| lines_up(shift))
+}
+
+/// The samples of the sensor buffer not written on the previous call, or a
+/// whole `window` when there is nothing to line up with, so the spectral
+/// module can (re)start right away. The host's buffer needn't advance by
+/// exactly `stride` samples between calls. `window` and `stride` come from
+/// the stream.txt deployment mount (see mount_format).
+fn stream_samples() -> Option<&'static [f32]> {
+    let config = mount_format::StreamConfig::read().ok()?;
+    let numbers = sensor_data();
+
+    let mut previous = STREAM_PREVIOUS.lock().unwrap_or_else(|poisoned| poisoned.into_inner());
+    let count = new_sample_count(&previous, numbers, config.stride).unwrap_or(config.window);
+    previous.clear();
+    previous.extend_from_slice(numbers);
+
+    let values = usize::min(count * 3, numbers.len());
+    Some(&numbers[numbers.len() - values..])
+}
+
+/// Streaming variant of save_sensor_data for overlapping windows: writes
+/// only the samples testailu_stream hasn't seen yet, however many that is.
+#[no_mangle]
+pub fn save_sensor_stream() -> i32 {
+    match stream_samples() {
+        Some(numbers) => write_csv(numbers),
+        None => TestiFunctionPredefinedPathError::InvalidStreamConfig as i32,
+    }
+}
+
+#[no_mangle]
+pub fn save_sensor_stream_bin() -> i32 {
+    match stream_samples() {
+        Some(numbers) => write_bin(numbers),
+        None => TestiFunctionPredefinedPathError::InvalidStreamConfig as i32,
+    }
+}
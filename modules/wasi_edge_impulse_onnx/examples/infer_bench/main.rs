@@ -0,0 +1,86 @@
+//! Time and heap per inference, loading the model on every call (as the
+//! module did before) versus once.
+//!
+//!     cargo run --release --example infer_bench -- model.onnx model.nnef.tar features.csv [calls]
+//!
+//! The same numbers on a device are in the module's log: every call prints
+//! its duration and the instance's linear memory, and the first call also
+//! the model load time.
+
+use std::alloc::{GlobalAlloc, Layout, System};
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::time::Instant;
+use wasi_edge_impulse_onnx::{infer, load_model, run};
+
+struct CountingAllocator;
+
+static IN_USE: AtomicUsize = AtomicUsize::new(0);
+static PEAK: AtomicUsize = AtomicUsize::new(0);
+
+unsafe impl GlobalAlloc for CountingAllocator {
+    unsafe fn alloc(&self, layout: Layout) -> *mut u8 {
+        let in_use = IN_USE.fetch_add(layout.size(), Ordering::Relaxed) + layout.size();
+        PEAK.fetch_max(in_use, Ordering::Relaxed);
+        System.alloc(layout)
+    }
+
+    unsafe fn dealloc(&self, ptr: *mut u8, layout: Layout) {
+        IN_USE.fetch_sub(layout.size(), Ordering::Relaxed);
+        System.dealloc(ptr, layout)
+    }
+
+    unsafe fn realloc(&self, ptr: *mut u8, layout: Layout, new_size: usize) -> *mut u8 {
+        let in_use = IN_USE.fetch_add(new_size, Ordering::Relaxed) + new_size - layout.size();
+        IN_USE.fetch_sub(layout.size(), Ordering::Relaxed);
+        PEAK.fetch_max(in_use, Ordering::Relaxed);
+        System.realloc(ptr, layout, new_size)
+    }
+}
+
+#[global_allocator]
+static GLOBAL: CountingAllocator = CountingAllocator;
+
+/// Mean milliseconds per call and peak heap above the starting point.
+fn measure(calls: usize, mut call: impl FnMut()) -> (f64, usize) {
+    let baseline = IN_USE.load(Ordering::Relaxed);
+    PEAK.store(baseline, Ordering::Relaxed);
+    let start = Instant::now();
+
+    for _ in 0..calls {
+        call();
+    }
+
+    (start.elapsed().as_secs_f64() * 1e3 / calls as f64, PEAK.load(Ordering::Relaxed) - baseline)
+}
+
+fn report(name: &str, (ms, peak): (f64, usize)) {
+    println!("{:<16} {:>10.3} ms/call {:>10} KiB peak heap", name, ms, peak / 1024);
+}
+
+fn main() {
+    let args: Vec<String> = std::env::args().collect();
+    if args.len() < 4 {
+        eprintln!("Usage: {} <model.onnx> <model.nnef.tar> <features.csv> [calls]", args[0]);
+        std::process::exit(2);
+    }
+    let (onnx_path, nnef_path, features_path) = (&args[1], &args[2], &args[3]);
+    let calls: usize = args.get(4).and_then(|calls| calls.parse().ok()).unwrap_or(100);
+
+    let expected = infer(onnx_path.clone(), features_path.clone()).expect("ONNX inference failed");
+    let actual = infer(nnef_path.clone(), features_path.clone()).expect("NNEF inference failed");
+    let max_difference = expected.iter().zip(&actual).map(|(a, b)| (a - b).abs()).fold(0.0f32, f32::max);
+    // Allows one quantization step of an int8 output (1/256).
+    assert!(max_difference < 1e-2, "probabilities differ by {}", max_difference);
+
+    report("onnx per call", measure(calls, || {
+        infer(onnx_path.clone(), features_path.clone()).unwrap();
+    }));
+    report("nnef per call", measure(calls, || {
+        infer(nnef_path.clone(), features_path.clone()).unwrap();
+    }));
+
+    let model = load_model(nnef_path).unwrap();
+    report("nnef loaded once", measure(calls, || {
+        run(&model, features_path.clone()).unwrap();
+    }));
+}
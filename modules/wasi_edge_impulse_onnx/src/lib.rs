@@ -1,6 +1,28 @@
-use tract_onnx::{self as tonnx, prelude::{self as tp, Framework, InferenceModelExt, Tensor, tvec}};
+use tract_onnx::{self as tonnx, WithOnnx, prelude::{self as tp, Framework, InferenceModelExt, Tensor, tvec}};
 use std::fs::File;
 use std::io::{self, BufRead, Write, BufReader};
+use std::sync::{Arc, Mutex};
+use std::time::{Instant, SystemTime};
+
+/// Model mounts: the NNEF archive written by modules/model_optimizer or the
+/// ONNX model, whichever the deployment mount MODEL_CHOICE_PATH names.
+const NNEF_MODEL_PATH: &str = "model.nnef.tar";
+const ONNX_MODEL_PATH: &str = "model.onnx";
+const MODEL_CHOICE_PATH: &str = "model.txt";
+
+pub type Model = tp::TypedRunnableModel<tp::TypedModel>;
+
+/// A loaded model and the mount file it was loaded from, identified by its
+/// path, size and modification time.
+struct LoadedModel {
+    path: &'static str,
+    version: (u64, Option<SystemTime>),
+    model: Arc<Model>,
+}
+
+/// Loaded on the first inference and reused for as long as the runtime
+/// keeps this module instance alive, unless the model mount changes.
+static MODEL: Mutex<Option<LoadedModel>> = Mutex::new(None);
 
 #[derive(Debug)]
 pub enum E {
@@ -10,12 +32,19 @@ pub enum E {
     DataLoad,
     Run,
     Conversion,
+    /// An empty features file: testailu_stream hasn't filled its window yet.
+    NoFeatures,
 }
 
-/// Load accelerometer data from a CSV file.
+/// Load accelerometer data from a CSV or binary mount file.
 fn load_accelerometer_data(file_path: String) -> Result<Vec<f32>, E> {
-    let file = File::open(file_path).map_err(|_| E::DataLoad)?;
-    let reader = io::BufReader::new(file);
+    let bytes = std::fs::read(file_path).map_err(|_| E::DataLoad)?;
+
+    if mount_format::is_binary(&bytes) {
+        return mount_format::decode(&bytes).map(|decoded| decoded.values).map_err(|_| E::DataLoad);
+    }
+
+    let reader = io::BufReader::new(bytes.as_slice());
 
     let mut data = Vec::new();
     for line in reader.lines() {
@@ -29,10 +58,27 @@ fn load_accelerometer_data(file_path: String) -> Result<Vec<f32>, E> {
     Ok(data)
 }
 
-/// Infer the label index based on accelerometer data using the given model.
-pub fn infer(model_path: String, data_path: String) -> Result<Vec<f32>, E> {
-    // Load model from file.
-    let model = tonnx::onnx()
+/// Load an ONNX model, typing and optimizing it for its input.
+pub fn load_onnx(model_path: &str) -> Result<Model, E> {
+    tonnx::onnx()
+        .model_for_path(model_path)
+        .map_err(|e| {
+            eprintln!("{:?}", e);
+            E::ModelLoad
+        })?
+        .into_optimized()
+        .map_err(|_| E::Optimization)?
+        .into_runnable()
+        .map_err(|_| E::Runnable)
+}
+
+/// Load an NNEF archive from modules/model_optimizer. It is already typed
+/// and decluttered with a fixed input shape; only the execution plan is
+/// generated here.
+pub fn load_nnef(model_path: &str) -> Result<Model, E> {
+    tract_nnef::nnef()
+        .with_tract_core()
+        .with_onnx()
         .model_for_path(model_path)
         .map_err(|e| {
             eprintln!("{:?}", e);
@@ -41,31 +87,178 @@ pub fn infer(model_path: String, data_path: String) -> Result<Vec<f32>, E> {
         .into_optimized()
         .map_err(|_| E::Optimization)?
         .into_runnable()
-        .map_err(|_| E::Runnable)?;
+        .map_err(|_| E::Runnable)
+}
 
+pub fn load_model(model_path: &str) -> Result<Model, E> {
+    if model_path.ends_with(".tar") {
+        load_nnef(model_path)
+    } else {
+        load_onnx(model_path)
+    }
+}
+
+/// The model mount the module was deployed with, as named in model.txt. A
+/// redeploy can leave the other mount behind, so without a model.txt (an
+/// older deployment) the newer of the two is taken.
+fn model_path() -> &'static str {
+    if let Ok(text) = std::fs::read_to_string(MODEL_CHOICE_PATH) {
+        match text.trim() {
+            NNEF_MODEL_PATH => return NNEF_MODEL_PATH,
+            ONNX_MODEL_PATH => return ONNX_MODEL_PATH,
+            other => eprintln!("Unknown model mount '{}' in {}", other, MODEL_CHOICE_PATH),
+        }
+    }
+
+    let modified = |path| std::fs::metadata(path).and_then(|metadata| metadata.modified()).ok();
+    match (modified(NNEF_MODEL_PATH), modified(ONNX_MODEL_PATH)) {
+        (Some(nnef), Some(onnx)) if onnx > nnef => ONNX_MODEL_PATH,
+        (Some(_), _) => NNEF_MODEL_PATH,
+        _ => ONNX_MODEL_PATH,
+    }
+}
+
+/// The deployed model, loaded on first use and again whenever the model
+/// mount is replaced (e.g. by a redeploy while the instance stays alive).
+fn model() -> Result<Arc<Model>, E> {
+    let path = model_path();
+    let metadata = std::fs::metadata(path).map_err(|_| E::ModelLoad)?;
+    let version = (metadata.len(), metadata.modified().ok());
+
+    let mut loaded = MODEL.lock().unwrap_or_else(|poisoned| poisoned.into_inner());
+    if let Some(loaded) = loaded.as_ref().filter(|loaded| loaded.path == path && loaded.version == version) {
+        return Ok(Arc::clone(&loaded.model));
+    }
+
+    let start = Instant::now();
+    let model = Arc::new(load_model(path)?);
+    eprintln!("Loaded {} in {:.1} ms", path, start.elapsed().as_secs_f64() * 1e3);
+
+    *loaded = Some(LoadedModel { path, version, model: Arc::clone(&model) });
+    Ok(model)
+}
+
+/// Parameters of the spectral analysis block that computes the model's
+/// input, generated into models/dsp_config.rs when the model is downloaded
+/// (or the defaults in modules/dsp_config_default.rs before that).
+#[allow(dead_code)]
+mod dsp_config {
+    include!(concat!(env!("OUT_DIR"), "/dsp_config.rs"));
+}
+
+/// Input and output types of the model and their quantization parameters,
+/// written to models/quantization.txt when the model was converted (or the
+/// float32 defaults in modules/quantization_default.txt before that).
+const QUANTIZATION: &str = include_str!(concat!(env!("OUT_DIR"), "/quantization.txt"));
+
+/// Type of the model's input or output. Quantized values map to real ones
+/// as `(q - zero_point) * scale`.
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub enum Quantization {
+    Float,
+    Int8 { scale: f32, zero_point: i32 },
+    UInt8 { scale: f32, zero_point: i32 },
+}
+
+impl Quantization {
+    /// Parse the `<prefix>_dtype`, `<prefix>_scale` and `<prefix>_zero_point`
+    /// lines for `prefix` "input" or "output".
+    pub fn parse(text: &str, prefix: &str) -> Result<Quantization, E> {
+        let value = |key: &str| {
+            let name = format!("{}_{}=", prefix, key);
+            text.lines().find_map(|line| line.trim().strip_prefix(name.as_str()).map(str::to_owned))
+        };
+        let scale = || value("scale").and_then(|scale| scale.parse::<f32>().ok()).ok_or(E::Conversion);
+        let zero_point = || value("zero_point").and_then(|zero_point| zero_point.parse::<i32>().ok()).ok_or(E::Conversion);
+
+        match value("dtype").as_deref() {
+            None | Some("float32") => Ok(Quantization::Float),
+            Some("int8") => Ok(Quantization::Int8 { scale: scale()?, zero_point: zero_point()? }),
+            Some("uint8") => Ok(Quantization::UInt8 { scale: scale()?, zero_point: zero_point()? }),
+            Some(_) => Err(E::Conversion),
+        }
+    }
+
+    /// A (1, n) input tensor of this type holding `values`.
+    fn quantize(self, values: Vec<f32>) -> Result<Tensor, E> {
+        let shape = (1, values.len());
+        let (scale, zero_point, min, max) = match self {
+            Quantization::Float => {
+                return tp::tract_ndarray::Array2::from_shape_vec(shape, values)
+                    .map(Tensor::from)
+                    .map_err(|_| E::Conversion)
+            }
+            Quantization::Int8 { scale, zero_point } => (scale, zero_point, i8::MIN as i32, i8::MAX as i32),
+            Quantization::UInt8 { scale, zero_point } => (scale, zero_point, u8::MIN as i32, u8::MAX as i32),
+        };
+
+        let quantized = values.iter().map(|value| ((value / scale).round() as i32 + zero_point).clamp(min, max));
+        let tensor = if let Quantization::Int8 { .. } = self {
+            tp::tract_ndarray::Array2::from_shape_vec(shape, quantized.map(|q| q as i8).collect()).map(Tensor::from)
+        } else {
+            tp::tract_ndarray::Array2::from_shape_vec(shape, quantized.map(|q| q as u8).collect()).map(Tensor::from)
+        };
+        tensor.map_err(|_| E::Conversion)
+    }
+
+    /// Real values of an output tensor of this type.
+    fn dequantize(self, tensor: &Tensor) -> Result<Vec<f32>, E> {
+        match self {
+            Quantization::Float => Ok(tensor.to_array_view::<f32>().map_err(|_| E::Conversion)?.iter().cloned().collect()),
+            Quantization::Int8 { scale, zero_point } => Ok(tensor
+                .to_array_view::<i8>()
+                .map_err(|_| E::Conversion)?
+                .iter()
+                .map(|&q| (q as i32 - zero_point) as f32 * scale)
+                .collect()),
+            Quantization::UInt8 { scale, zero_point } => Ok(tensor
+                .to_array_view::<u8>()
+                .map_err(|_| E::Conversion)?
+                .iter()
+                .map(|&q| (q as i32 - zero_point) as f32 * scale)
+                .collect()),
+        }
+    }
+}
+
+/// Class probabilities for the features in `data_path`.
+pub fn run(model: &Model, data_path: String) -> Result<Vec<f32>, E> {
     let data = load_accelerometer_data(data_path)?;
+    if data.is_empty() {
+        return Err(E::NoFeatures);
+    }
+    if data.len() != dsp_config::FEATURE_COUNT {
+        return Err(E::Conversion);
+    }
 
-    // Create the tensor with shape as required by the model
-    let tensor: Tensor = tp::tract_ndarray::Array2::from_shape_vec((1, 39), data)
-        .map_err(|_| E::Conversion)?
-        .into();
+    // Create the tensor with the shape and type required by the model
+    let tensor = Quantization::parse(QUANTIZATION, "input")?.quantize(data)?;
 
     let result = model.run(tvec!(tensor.into())).map_err(|_| E::Run)?;
 
     // Get the probabilities for all classes.
-    let probabilities = result[0]
-        .to_array_view::<f32>()
-        .map_err(|_| E::Conversion)?
-        .iter()
-        .cloned()
-        .collect::<Vec<f32>>();
+    Quantization::parse(QUANTIZATION, "output")?.dequantize(&result[0])
+}
+
+/// Infer the label index based on accelerometer data using the given model,
+/// loading the model for this call only.
+pub fn infer(model_path: String, data_path: String) -> Result<Vec<f32>, E> {
+    let model = load_model(&model_path)?;
+    run(&model, data_path)
+}
 
-    Ok(probabilities)
+/// Linear memory of this instance in bytes, as reported after each call.
+fn memory_bytes() -> usize {
+    #[cfg(target_arch = "wasm32")]
+    return core::arch::wasm32::memory_size(0) * 65536;
+    #[cfg(not(target_arch = "wasm32"))]
+    return 0;
 }
 
-/// Load class names from a file (classes.txt) embedded into the binary.
+/// Load class names from a file (classes.txt) embedded into the binary. Until
+/// the model is downloaded it is modules/classes_default.txt, with none.
 fn load_classes() -> Result<Vec<String>, E> {
-    const CLASSES: &str = include_str!("../../../models/classes.txt");
+    const CLASSES: &str = include_str!(concat!(env!("OUT_DIR"), "/classes.txt"));
     let classes: Vec<String> = CLASSES
         .lines()
         .map(|line| line.trim().to_string())
@@ -75,6 +268,57 @@ fn load_classes() -> Result<Vec<String>, E> {
 
 #[no_mangle]
 pub fn infer_predefined_paths() -> i32 {
+    infer_to("features.csv", "probabilities.csv", false)
+}
+
+/// Binary mount format variant of infer_predefined_paths: probabilities go
+/// to probabilities.bin as f32, labelled with the class names.
+#[no_mangle]
+pub fn infer_predefined_paths_bin() -> i32 {
+    infer_to("features.bin", "probabilities.bin", true)
+}
+
+fn write_probabilities_csv(file_path: &str, classes: &[String], probabilities: &[f32]) -> i32 {
+    let Ok(mut output) = File::create(file_path) else {
+        eprintln!("Failed to create file: {}", file_path);
+        return -8; // Return error code if file creation fails
+    };
+
+    // Write CSV header
+    if writeln!(output, "class,probability").is_err() {
+        eprintln!("Failed to write header to file: {}", file_path);
+        return -9;
+    }
+
+    // Write class names and probabilities
+    for (class, probability) in classes.iter().zip(probabilities.iter()) {
+        if writeln!(output, "{},{}", class, probability).is_err() {
+            eprintln!("Failed to write data to file: {}", file_path);
+            return -9; // Return error code if file write fails
+        }
+    }
+
+    0
+}
+
+fn write_probabilities_bin(file_path: &str, classes: &[String], probabilities: &[f32]) -> i32 {
+    let labels = classes.join("\n");
+    let data = mount_format::encode(mount_format::Kind::Probabilities, probabilities, Some(&labels));
+
+    let Ok(mut output) = File::create(file_path) else {
+        eprintln!("Failed to create file: {}", file_path);
+        return -8;
+    };
+
+    if output.write_all(&data).is_err() {
+        eprintln!("Failed to write data to file: {}", file_path);
+        return -9;
+    }
+
+    0
+}
+
+fn infer_to(features_path: &str, file_path: &str, binary: bool) -> i32 {
     // Load class names from the embedded string
     let classes = match load_classes() {
         Ok(cls) => cls,
@@ -84,33 +328,30 @@ pub fn infer_predefined_paths() -> i32 {
         }
     };
 
-    // Call infer and handle results
-    match infer("model.onnx".to_owned(), "features.csv".to_owned()) {
+    // Run the cached model and handle results
+    let start = Instant::now();
+    let result = model().and_then(|model| run(&model, features_path.to_owned()));
+    eprintln!(
+        "Inference took {:.1} ms, linear memory {} KiB",
+        start.elapsed().as_secs_f64() * 1e3,
+        memory_bytes() / 1024
+    );
+
+    match result {
         Ok(probabilities) => {
             if probabilities.len() != classes.len() {
                 eprintln!("Mismatch between number of classes and probabilities.");
                 return -11;
             }
 
-            // Save probabilities to CSV file
-            let file_path = "probabilities.csv";
-            let Ok(mut output) = File::create(file_path) else {
-                eprintln!("Failed to create file: {}", file_path);
-                return -8; // Return error code if file creation fails
+            // Save probabilities to the output file
+            let status = if binary {
+                write_probabilities_bin(file_path, &classes, &probabilities)
+            } else {
+                write_probabilities_csv(file_path, &classes, &probabilities)
             };
-
-            // Write CSV header
-            if writeln!(output, "class,probability").is_err() {
-                eprintln!("Failed to write header to file: {}", file_path);
-                return -9;
-            }
-
-            // Write class names and probabilities
-            for (class, probability) in classes.iter().zip(probabilities.iter()) {
-                if writeln!(output, "{},{}", class, probability).is_err() {
-                    eprintln!("Failed to write data to file: {}", file_path);
-                    return -9; // Return error code if file write fails
-                }
+            if status != 0 {
+                return status;
             }
 
             // Find the index of the maximum probability
@@ -134,6 +375,7 @@ pub fn infer_predefined_paths() -> i32 {
                 E::DataLoad => -4,
                 E::Run => -5,
                 E::Conversion => -6,
+                E::NoFeatures => -12,
             }
         }
     }
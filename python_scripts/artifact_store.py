@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from python_scripts import metrics
+
+STORE_DIR = os.path.join("models", "store")
+
+CHUNK_SIZE = 1024 * 1024
+
+DOWNLOAD_BYTES = metrics.counter("artifact_download_bytes_total", "Artifact bytes downloaded into the store.")
+
+_index_lock = threading.Lock()
+
+
+def project_dir(project_id):
+    return os.path.join(STORE_DIR, str(project_id))
+
+
+def blob_path(project_id, sha256, suffix):
+    return os.path.join(project_dir(project_id), f"{sha256}{suffix}")
+
+
+def _index_path(project_id):
+    return os.path.join(project_dir(project_id), "index.json")
+
+
+def load_index(project_id):
+    try:
+        with open(_index_path(project_id), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def get_entry(project_id, key):
+    return load_index(project_id).get(key)
+
+
+def put_entry(project_id, key, entry):
+    # Entries for different artifacts are written from different pipeline
+    # threads, so the read-modify-write has to be serialized.
+    with _index_lock:
+        index = load_index(project_id)
+        index[key] = entry
+        atomic_write(_index_path(project_id), json.dumps(index, indent=2).encode())
+
+
+def atomic_write(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_intact(path, sha256):
+    return bool(sha256) and os.path.exists(path) and file_sha256(path) == sha256
+
+
+def install(src, dest):
+    """Atomically put `src` at `dest`, hard-linking when possible."""
+    os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        # rename() between two links to the same file is a no-op that would
+        # leave the temporary link behind.
+        return
+    tmp_path = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dest)
+
+
+def validator_headers(entry):
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def _md5_etag(etag):
+    # Object stores use the plain MD5 of the body as ETag for single-part
+    # uploads; that gives a checksum to verify against for free.
+    etag = (etag or "").strip('"')
+    if etag.startswith("W/") or len(etag) != 32:
+        return None
+    try:
+        int(etag, 16)
+    except ValueError:
+        return None
+    return etag.lower()
+
+
+def download(session, url, headers, project_id, suffix, entry=None):
+    """Fetch `url` into the store, reusing what is already there.
+
+    `entry` is the stored metadata of the previous download of this artifact.
+    If the server answers 304 to a conditional request and the stored blob is
+    intact, nothing is transferred. Interrupted transfers are resumed from the
+    partial file with a Range request. Returns `(entry, changed)`.
+    """
+    os.makedirs(project_dir(project_id), exist_ok=True)
+
+    request_headers = dict(headers)
+    if entry and is_intact(entry.get("path", ""), entry.get("sha256")):
+        request_headers.update(validator_headers(entry))
+
+    part_path = os.path.join(project_dir(project_id), hashlib.sha256(url.encode()).hexdigest()[:16] + ".part")
+    part_meta_path = part_path + ".json"
+
+    resume_from = 0
+    if "If-None-Match" not in request_headers and os.path.exists(part_path):
+        try:
+            with open(part_meta_path, "r") as f:
+                part_meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            part_meta = {}
+        validator = part_meta.get("etag") or part_meta.get("last_modified")
+        if validator:
+            resume_from = os.path.getsize(part_path)
+            request_headers["Range"] = f"bytes={resume_from}-"
+            request_headers["If-Range"] = validator
+
+    response = session.get(url, headers=request_headers, stream=True)
+
+    if response.status_code == 304:
+        response.close()
+        return entry, False
+
+    if response.status_code not in (200, 206):
+        raise Exception(f"Error downloading {url}: {response.status_code}, {response.text}")
+
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+
+    if response.status_code == 200:
+        # Full body: either a fresh download or the server ignored If-Range
+        # because the artifact changed.
+        resume_from = 0
+        atomic_write(part_meta_path, json.dumps({"etag": etag, "last_modified": last_modified}).encode())
+
+    sha256 = hashlib.sha256()
+    md5 = hashlib.md5()
+    if resume_from:
+        with open(part_path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                sha256.update(chunk)
+                md5.update(chunk)
+
+    with open(part_path, "ab" if resume_from else "wb") as f:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            f.write(chunk)
+            sha256.update(chunk)
+            md5.update(chunk)
+            DOWNLOAD_BYTES.inc(len(chunk))
+
+    size = os.path.getsize(part_path)
+    expected_size = None
+    if response.status_code == 206 and "/" in response.headers.get("Content-Range", ""):
+        total = response.headers["Content-Range"].rsplit("/", 1)[1]
+        expected_size = int(total) if total.isdigit() else None
+    elif response.headers.get("Content-Length") and "Content-Encoding" not in response.headers:
+        expected_size = int(response.headers["Content-Length"])
+
+    if expected_size is not None and size != expected_size:
+        raise Exception(f"Incomplete download of {url}: got {size} of {expected_size} bytes")
+
+    expected_md5 = None if "Content-Encoding" in response.headers else _md5_etag(etag)
+    if expected_md5 and md5.hexdigest() != expected_md5:
+        os.remove(part_path)
+        raise Exception(f"Checksum mismatch downloading {url}")
+
+    digest = sha256.hexdigest()
+    path = blob_path(project_id, digest, suffix)
+    os.replace(part_path, path)
+    if os.path.exists(part_meta_path):
+        os.remove(part_meta_path)
+
+    new_entry = {
+        "url": url,
+        "etag": etag,
+        "last_modified": last_modified,
+        "sha256": digest,
+        "size": size,
+        "path": path,
+    }
+    return new_entry, not entry or entry.get("sha256") != digest
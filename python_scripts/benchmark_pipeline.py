@@ -0,0 +1,312 @@
+"""Benchmark the pipeline and /do_run against local stand-ins.
+
+Starts python_scripts.fake_services in place of the orchestrator and the
+Edge Impulse API, points the app at it and times complete pipeline runs
+followed by a few /do_run calls. Reports per-step and end-to-end times,
+the requests each run made and memory use, and writes everything to a
+JSON file. Pass --compare with an earlier results file to flag steps that
+got slower.
+
+By default the cargo builds and the ONNX conversion are replaced with
+prebuilt stand-in artifacts, so the benchmark needs neither a Rust
+toolchain nor TensorFlow and measures the pipeline's own overhead. With
+--full the real steps run from the repository root; that needs the full
+build environment, api_key.txt and a real model given with --model.
+
+    python -m python_scripts.benchmark_pipeline --runs 5 --latency 0.02
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="pipeline runs; the first one starts cold")
+    parser.add_argument("--inferences", type=int, default=5, help="/do_run calls after each pipeline run")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every fake response")
+    parser.add_argument(
+        "--endpoint-latency", action="append", default=[], metavar="ENDPOINT=SECONDS",
+        help="latency for one fake endpoint, e.g. upload_module=0.2; can be repeated",
+    )
+    parser.add_argument("--model", help="model file served by the fake Edge Impulse API")
+    parser.add_argument("--full", action="store_true", help="run the real builds and conversion")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown ratio reported as a regression")
+    parser.add_argument("--verbose", action="store_true", help="show the app's own output")
+    return parser.parse_args()
+
+
+def endpoint_latencies(values):
+    latencies = {}
+    for value in values:
+        endpoint, _, seconds = value.partition("=")
+        latencies[endpoint] = float(seconds)
+    return latencies
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def stats(values):
+    if not values:
+        return None
+    return {
+        "min": min(values),
+        "median": statistics.median(values),
+        "mean": statistics.fmean(values),
+        "max": max(values),
+    }
+
+
+def prepare_workdir():
+    # A throwaway copy of the layout the app expects under its cwd, so the
+    # artifact store and build cache start empty and the repo is untouched.
+    workdir = tempfile.mkdtemp(prefix="pipeline-benchmark-")
+    os.makedirs(os.path.join(workdir, "models"))
+    os.makedirs(os.path.join(workdir, "modules", "wasi_edge_impulse_onnx"))
+    with open(os.path.join(workdir, "api_key.txt"), "w") as key_file:
+        key_file.write("benchmark")
+    return workdir
+
+
+def use_prebuilt_artifacts(pipeline, workdir):
+    """Replace the cargo builds, the ONNX conversion and its optimization
+    with fixed files."""
+    artifact_dir = os.path.join(workdir, "prebuilt")
+    os.makedirs(artifact_dir)
+
+    def build_modules(report):
+        wasm_paths = {}
+        for artifact_name in pipeline.WASM_MODULES:
+            path = os.path.join(artifact_dir, f"{artifact_name}.wasm")
+            if not os.path.exists(path):
+                with open(path, "wb") as wasm_file:
+                    wasm_file.write(b"\0asm\x01\0\0\0" + os.urandom(256 * 1024))
+            report("cache", {"module": artifact_name, "hit": True})
+            wasm_paths[artifact_name] = path
+        return wasm_paths
+
+    def convert_model_cached(report, precision="float32"):
+        for path in (pipeline.onnx_model_path(precision), pipeline.MODULE_ONNX_MODEL_PATH):
+            with open(path, "wb") as model_file:
+                model_file.write(os.urandom(64 * 1024))
+        with open(pipeline.QUANTIZATION_PATH, "w") as quantization_file:
+            quantization_file.write("input_shape=1,39\ninput_dtype=float32\noutput_dtype=float32\n")
+        report("cache", {"hit": True})
+
+    def optimize_model_cached(report, precision="float32"):
+        for path in (pipeline.optimized_model_path(precision), pipeline.MODULE_OPTIMIZED_MODEL_PATH):
+            with open(path, "wb") as model_file:
+                model_file.write(os.urandom(64 * 1024))
+        report("cache", {"hit": True})
+
+    pipeline.build_modules = build_modules
+    pipeline.convert_model_cached = convert_model_cached
+    pipeline.optimize_model_cached = optimize_model_cached
+
+
+def run_once(pipeline, services, client, run, inferences):
+    from app.jobs import Job
+
+    services.reset_counters()
+    tracemalloc.reset_peak()
+
+    job = Job(pipeline.pipeline_key())
+    start = time.perf_counter()
+    pipeline.run_pipeline(job)
+    end_to_end = time.perf_counter() - start
+
+    pipeline_requests = dict(services.requests)
+
+    do_run_seconds = []
+    for _ in range(inferences):
+        start = time.perf_counter()
+        response = client.post("/do_run")
+        do_run_seconds.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise Exception(f"/do_run failed: {response.status_code}, {response.get_data(as_text=True)}")
+
+    _, peak = tracemalloc.get_traced_memory()
+
+    return {
+        "run": run,
+        "cold": run == 0,
+        "end_to_end_seconds": end_to_end,
+        "steps": {name: step.get("duration") for name, step in job.steps.items()},
+        "cache_hits": {
+            payload["step"]: payload["hit"] for _, event, payload in job.events_after(0) if event == "cache"
+        },
+        "requests": pipeline_requests,
+        "requests_total": sum(pipeline_requests.values()),
+        "do_run_requests": sum(services.requests.values()) - sum(pipeline_requests.values()),
+        "bytes_to_services": services.bytes_received,
+        "bytes_from_services": services.bytes_sent,
+        "do_run_seconds": do_run_seconds,
+        "python_peak_bytes": peak,
+    }
+
+
+def summarize(runs):
+    step_names = sorted({name for run in runs for name in run["steps"]})
+    warm = [run for run in runs if not run["cold"]] or runs
+    return {
+        "end_to_end_seconds": stats([run["end_to_end_seconds"] for run in runs]),
+        "warm_end_to_end_seconds": stats([run["end_to_end_seconds"] for run in warm]),
+        "steps": {
+            name: stats([run["steps"][name] for run in warm if run["steps"].get(name) is not None])
+            for name in step_names
+        },
+        "requests_per_run": stats([run["requests_total"] for run in runs]),
+        "do_run_seconds": stats([seconds for run in runs for seconds in run["do_run_seconds"]]),
+        "python_peak_bytes": max(run["python_peak_bytes"] for run in runs),
+        # ru_maxrss is in KiB on Linux.
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def compare(summary, baseline, threshold):
+    """Medians that grew by more than `threshold` compared to `baseline`."""
+    pairs = [("end_to_end", summary["warm_end_to_end_seconds"], baseline["warm_end_to_end_seconds"])]
+    pairs += [
+        (f"step {name}", current, baseline["steps"].get(name))
+        for name, current in summary["steps"].items()
+    ]
+    pairs.append(("do_run", summary["do_run_seconds"], baseline["do_run_seconds"]))
+
+    regressions = []
+    for name, current, previous in pairs:
+        if not current or not previous or not previous["median"]:
+            continue
+        ratio = current["median"] / previous["median"]
+        if ratio > 1 + threshold:
+            regressions.append({"name": name, "baseline": previous["median"], "current": current["median"], "ratio": ratio})
+    return regressions
+
+
+def print_report(results):
+    summary = results["summary"]
+    print(f"End to end (warm median): {summary['warm_end_to_end_seconds']['median'] * 1000:.1f} ms")
+    for name, step in sorted(summary["steps"].items(), key=lambda item: -(item[1] or {}).get("median", 0)):
+        if step:
+            print(f"  {name:32} {step['median'] * 1000:9.1f} ms")
+    print(f"/do_run (median): {summary['do_run_seconds']['median'] * 1000:.1f} ms" if summary["do_run_seconds"] else "")
+    print(f"Requests per pipeline run: {[run['requests_total'] for run in results['runs']]}")
+    print(f"Python peak: {summary['python_peak_bytes'] / 2**20:.1f} MiB, max RSS: {summary['max_rss_bytes'] / 2**20:.1f} MiB")
+    for regression in results.get("regressions", []):
+        print(
+            f"REGRESSION {regression['name']}: {regression['baseline'] * 1000:.1f} ms -> "
+            f"{regression['current'] * 1000:.1f} ms (x{regression['ratio']:.2f})"
+        )
+
+
+def main():
+    args = parse_args()
+    output_path = os.path.abspath(args.output)
+    sys.path[:0] = [REPO_ROOT, os.path.join(REPO_ROOT, "flask")]
+
+    from python_scripts.fake_services import FakeServices
+
+    model_bytes = None
+    if args.model:
+        with open(args.model, "rb") as model_file:
+            model_bytes = model_file.read()
+
+    services = FakeServices(latency=args.latency, latencies=endpoint_latencies(args.endpoint_latency), model_bytes=model_bytes)
+    base_url = services.serve()
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    if not args.verbose:
+        logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+    # The app reads these at import time.
+    os.environ["WASMIOT_ORCHESTRATOR_URL"] = base_url
+    os.environ["EDGE_IMPULSE_URL"] = base_url
+    extension = "bin" if os.getenv("MOUNT_FORMAT") == "binary" else "csv"
+    os.environ["MODEL_RESULTS_URL"] = f"{base_url}/module_results/model/probabilities.{extension}"
+
+    workdir = None
+    if args.full:
+        os.chdir(REPO_ROOT)
+    else:
+        workdir = prepare_workdir()
+        os.chdir(workdir)
+
+    output = open(os.devnull, "w") if not args.verbose else sys.stdout
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(output):
+            import app.app as pipeline
+            from app.utils import registries_ready
+
+            if args.full:
+                from python_scripts import conversion_worker
+                conversion_worker.start()
+            else:
+                use_prebuilt_artifacts(pipeline, workdir)
+
+            # Let the background refresher finish its first pull so it
+            # doesn't overlap with the first measured run.
+            deadline = time.time() + 10
+            while not registries_ready() and time.time() < deadline:
+                time.sleep(0.05)
+
+            client = pipeline.app.test_client()
+            runs = [run_once(pipeline, services, client, run, args.inferences) for run in range(args.runs)]
+    finally:
+        tracemalloc.stop()
+        services.shutdown()
+        if workdir:
+            os.chdir(REPO_ROOT)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "created": time.time(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {
+            "runs": args.runs,
+            "inferences": args.inferences,
+            "latency": args.latency,
+            "endpoint_latency": endpoint_latencies(args.endpoint_latency),
+            "full": args.full,
+        },
+        "runs": runs,
+        "summary": summarize(runs),
+    }
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        results["baseline"] = {"file": args.compare, "git_commit": baseline.get("git_commit")}
+        results["regressions"] = compare(results["summary"], baseline["summary"], args.threshold)
+
+    with open(output_path, "w") as results_file:
+        json.dump(results, results_file, indent=2)
+
+    print_report(results)
+    print(f"Results written to {output_path}")
+    return 1 if results.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import threading
+from importlib import metadata
+from python_scripts.artifact_store import file_sha256
+
+CACHE_DIR = os.getenv("CONVERSION_CACHE_DIR", os.path.join("models", "onnx_cache"))
+
+# Least recently used entries are evicted once the cache grows past this.
+CACHE_BUDGET_BYTES = int(os.getenv("CONVERSION_CACHE_BYTES", str(512 * 1024 * 1024)))
+
+# Converted ONNX models with their input/output quantization parameters,
+# and the NNEF archives optimized from them.
+ONNX_SUFFIX = ".onnx"
+QUANTIZATION_SUFFIX = ".quantization.txt"
+NNEF_SUFFIX = ".nnef.tar"
+SUFFIXES = (ONNX_SUFFIX, QUANTIZATION_SUFFIX, NNEF_SUFFIX)
+
+_lock = threading.Lock()
+
+
+def _package_version(name):
+    # Read from the installed metadata so computing a key never imports
+    # tf2onnx (and TensorFlow with it) into the calling process.
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "missing"
+
+
+# Bumped when what is stored for a conversion changes (version 2 added the
+# input shape to the quantization file).
+CACHE_FORMAT = 2
+
+
+def cache_key(tflite_model_path, options=None):
+    key = {
+        "format": CACHE_FORMAT,
+        "tflite": file_sha256(tflite_model_path),
+        "tf2onnx": _package_version("tf2onnx"),
+        "onnx": _package_version("onnx"),
+        "options": options or {},
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def optimization_key(onnx_model_path, optimizer_digest, input_shape):
+    """Key of the NNEF archive optimized from an ONNX model. `optimizer_digest`
+    covers the optimizer's sources and toolchain."""
+    key = {
+        "onnx": file_sha256(onnx_model_path),
+        "optimizer": optimizer_digest,
+        "input_shape": list(input_shape),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def entry_path(key, suffix=ONNX_SUFFIX):
+    return os.path.join(CACHE_DIR, f"{key}{suffix}")
+
+
+def temp_path(key, suffix=ONNX_SUFFIX):
+    """Where a conversion for `key` should write before `store` is called."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, f"{key}.{os.getpid()}.{threading.get_ident()}{suffix}.tmp")
+
+
+def lookup(key, suffix=ONNX_SUFFIX):
+    path = entry_path(key, suffix)
+    try:
+        # The modification time doubles as the last-used time for eviction.
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def store(key, converted_paths):
+    """Move the files of one conversion (`{suffix: path}`, written to their
+    `temp_path`s) into the cache as the entry for `key`, then evict other
+    entries if the cache is over budget. Returns the stored paths by suffix."""
+    paths = {}
+    for suffix, converted_path in converted_paths.items():
+        paths[suffix] = entry_path(key, suffix)
+        os.replace(converted_path, paths[suffix])
+    evict(keep=key)
+    return paths
+
+
+def _entry_key(name):
+    for suffix in SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return None
+
+
+def evict(keep=None):
+    """Remove whole entries, all files of a key at once, least recently used
+    first (by the newest of their files), until the cache fits its budget."""
+    with _lock:
+        entries = {}
+        for name in os.listdir(CACHE_DIR):
+            key = _entry_key(name)
+            if key is None:
+                continue
+            path = os.path.join(CACHE_DIR, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            used, size, paths = entries.get(key, (0.0, 0, []))
+            entries[key] = (max(used, stat.st_mtime), size + stat.st_size, paths + [path])
+
+        total = sum(size for _, size, _ in entries.values())
+        for key, (_, size, paths) in sorted(entries.items(), key=lambda entry: entry[1][0]):
+            if total <= CACHE_BUDGET_BYTES:
+                break
+            if key == keep:
+                continue
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            print(f"Evicted {key[:12]} from the conversion cache")
@@ -0,0 +1,142 @@
+import atexit
+import itertools
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+
+# Importing tf2onnx pulls in TensorFlow, which costs seconds and hundreds of
+# MB. Nothing in this module imports it: conversions run in a separate
+# process that imports it once and then serves jobs from a queue.
+#
+# The worker is a plain `python -m python_scripts.conversion_worker`
+# subprocess rather than a multiprocessing child, because spawned children
+# re-import the parent's __main__, which here is the whole web app. Jobs and
+# results are JSON lines over the worker's stdin/stdout.
+
+CONVERSION_TIMEOUT = float(os.getenv("CONVERSION_TIMEOUT", "600"))
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_lock = threading.Lock()
+_job_ids = itertools.count()
+_process = None
+_results = None
+
+
+def _worker_main():
+    # Keep the real stdout for results and send everything printed while
+    # converting (including TensorFlow's own logging) to stderr.
+    results = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    from python_scripts.convert_to_onnx import convert_model as convert
+
+    for line in sys.stdin:
+        job = json.loads(line)
+        try:
+            convert(**job["kwargs"])
+            result = {"id": job["id"]}
+        except Exception as e:
+            result = {"id": job["id"], "error": str(e)}
+        sys.stdout.flush()
+        results.write(json.dumps(result) + "\n")
+        results.flush()
+
+
+def _read_results(process, results):
+    for line in process.stdout:
+        results.put(json.loads(line))
+    results.put(None)
+
+
+def start():
+    """Start the worker if it isn't running. Returns immediately; TensorFlow
+    is imported in the background by the worker itself."""
+    global _process, _results
+
+    with _lock:
+        if _process is not None and _process.poll() is None:
+            return
+
+        # Make python_scripts importable regardless of the working directory.
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+
+        _results = queue.Queue()
+        _process = subprocess.Popen(
+            [sys.executable, "-m", "python_scripts.conversion_worker"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            env=env,
+        )
+        threading.Thread(target=_read_results, args=(_process, _results), daemon=True).start()
+        print(f"Started model conversion worker (pid {_process.pid})")
+
+
+def stop():
+    global _process
+
+    with _lock:
+        if _process is None:
+            return
+        if _process.poll() is None:
+            _process.stdin.close()
+            try:
+                _process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                _process.kill()
+        _process = None
+
+
+def _kill_locked():
+    global _process
+    if _process is not None and _process.poll() is None:
+        _process.kill()
+        _process.wait()
+    _process = None
+
+
+def convert_model(tflite_model_path=None, onnx_output_path=None, **options):
+    """Convert a TFLite model to ONNX in the worker process, starting the
+    worker on first use."""
+    start()
+
+    # One job at a time: the worker is single-threaded anyway, and it keeps
+    # matching results to callers trivial.
+    with _lock:
+        job_id = next(_job_ids)
+        kwargs = dict(options, tflite_model_path=tflite_model_path, onnx_output_path=onnx_output_path)
+        try:
+            _process.stdin.write(json.dumps({"id": job_id, "kwargs": kwargs}) + "\n")
+            _process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            _kill_locked()
+            raise Exception("Model conversion worker exited unexpectedly")
+
+        while True:
+            try:
+                result = _results.get(timeout=CONVERSION_TIMEOUT)
+            except queue.Empty:
+                _kill_locked()
+                raise Exception(f"Model conversion timed out after {CONVERSION_TIMEOUT:.0f} s")
+
+            if result is None:
+                _kill_locked()
+                raise Exception("Model conversion worker exited unexpectedly")
+            # Results of jobs whose caller already gave up are dropped.
+            if result["id"] != job_id:
+                continue
+            if "error" in result:
+                raise Exception(result["error"])
+            return
+
+
+atexit.register(stop)
+
+
+if __name__ == "__main__":
+    _worker_main()
@@ -1,17 +1,38 @@
 import tf2onnx
+import tensorflow as tf
+import numpy as np
 import os
 
-def convert_model(tflite_model_path=None, onnx_output_path=None):
+def write_quantization(tflite_model_path, output_path):
+    """Write the model's input shape, its input and output types and their
+    quantization parameters, which the classifier module embeds at compile
+    time."""
+    interpreter = tf.lite.Interpreter(model_path=tflite_model_path)
+    input_shape = interpreter.get_input_details()[0]["shape"]
+    lines = [f"input_shape={','.join(str(int(dim)) for dim in input_shape)}"]
+    for prefix, details in (("input", interpreter.get_input_details()[0]), ("output", interpreter.get_output_details()[0])):
+        scale, zero_point = details["quantization"]
+        lines.append(f"{prefix}_dtype={np.dtype(details['dtype']).name}")
+        lines.append(f"{prefix}_scale={float(scale)!r}")
+        lines.append(f"{prefix}_zero_point={int(zero_point)}")
 
-    tflite_model_path = "models/model.tflite"
-    onnx_output_path = "models/model.onnx"
+    with open(output_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def convert_model(tflite_model_path=None, onnx_output_path=None, quantization_output_path=None, **options):
+
+    tflite_model_path = tflite_model_path or "models/model.tflite"
+    onnx_output_path = onnx_output_path or "models/model.onnx"
 
     os.makedirs("models", exist_ok=True)
 
     print(f"Converting model: {tflite_model_path} -> {onnx_output_path}")
 
     try:
-        tf2onnx.convert.from_tflite(tflite_model_path, output_path=onnx_output_path)
+        tf2onnx.convert.from_tflite(tflite_model_path, output_path=onnx_output_path, **options)
+        if quantization_output_path:
+            write_quantization(tflite_model_path, quantization_output_path)
         print("Model successfully converted!")
     except FileNotFoundError:
         error_message = f"TFLite model file not found: {tflite_model_path}"
@@ -20,4 +41,4 @@ def convert_model(tflite_model_path=None, onnx_output_path=None):
     except Exception as e:
         error_message = f"Model conversion failed: {str(e)}"
         print(error_message)
-        raise Exception(error_message)
\ No newline at end of file
+        raise Exception(error_message)
@@ -1,85 +1,158 @@
 import requests
+import json
 import os
+import time
+from urllib.parse import urlsplit
+from python_scripts import artifact_store, metrics
 
-def download_model():
+PROJECT_ID = os.getenv("EDGE_IMPULSE_PROJECT_ID", "530573")
+
+BASE_URL = os.getenv("EDGE_IMPULSE_URL", "https://studio.edgeimpulse.com")
+
+MODELS_DIR = "models"
+
+# Edge Impulse download types, by model precision.
+MODEL_TYPES = {
+    "float32": "TensorFlow Lite (float32)",
+    "int8": "TensorFlow Lite (int8 quantized)",
+}
+PRECISIONS = tuple(MODEL_TYPES)
+
+# One session for all Edge Impulse calls so the index, metrics and model
+# downloads reuse the same connection.
+session = requests.Session()
+
+REQUEST_SECONDS = metrics.histogram(
+    "edge_impulse_request_duration_seconds",
+    "Time to response headers for Edge Impulse API requests, by endpoint.",
+    ["endpoint"],
+)
+RESPONSE_BYTES = metrics.counter(
+    "edge_impulse_response_bytes_total",
+    "Edge Impulse API response bytes, not counting streamed model downloads.",
+    ["endpoint"],
+)
+
+
+def _record_response(response, stream=False, **kwargs):
+    # Name requests by their last path segment: downloads, metrics, or the
+    # model file itself.
+    endpoint = urlsplit(response.url).path.rstrip("/").rsplit("/", 1)[-1]
+    seconds = response.elapsed.total_seconds()
+    REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+    if not stream:
+        RESPONSE_BYTES.inc(len(response.content), endpoint=endpoint)
+    metrics.add_span(f"edge_impulse.{endpoint}", time.time() - seconds, seconds, status=response.status_code)
+
+
+session.hooks["response"].append(_record_response)
+
+
+def read_api_key():
     # Read API key from a file
     with open("api_key.txt", "r") as key_file:
-        api_key = key_file.read().strip() 
+        return key_file.read().strip()
+
+
+def tflite_model_path(precision="float32"):
+    # The float32 model keeps its original name.
+    name = "model.tflite" if precision == "float32" else f"model_{precision}.tflite"
+    return os.path.join(MODELS_DIR, name)
+
+
+def download_model(precision="float32"):
+    if precision not in MODEL_TYPES:
+        raise Exception(f"Unknown model precision '{precision}', expected one of {', '.join(PRECISIONS)}")
+    model_type = MODEL_TYPES[precision]
+
+    api_key = read_api_key()
+    headers = {"x-api-key": api_key}
 
-    projectId = "530573"
+    downloads_url = f"{BASE_URL}/v1/api/{PROJECT_ID}/downloads"
+    # The index validators are kept per precision, since each one decides
+    # whether that precision's stored model can be reused.
+    index_key = "downloads" if precision == "float32" else f"downloads_{precision}"
+    model_key = "model" if precision == "float32" else f"model_{precision}"
+    index_entry = artifact_store.get_entry(PROJECT_ID, index_key)
+    model_entry = artifact_store.get_entry(PROJECT_ID, model_key)
+    model_path = tflite_model_path(precision)
 
-    base_url = "https://studio.edgeimpulse.com"
+    model_cached = model_entry and artifact_store.is_intact(model_entry["path"], model_entry["sha256"])
 
-    # Make a request for impulse blocks data
-    response = requests.get(
-        f"{base_url}/v1/api/{projectId}/downloads",
-        headers={
-            "x-api-key": api_key
-        },
+    # Make a request for impulse blocks data. If neither the index nor the
+    # stored model changed, this is the only request made.
+    response = session.get(
+        downloads_url,
+        headers={**headers, **(artifact_store.validator_headers(index_entry) if model_cached else {})},
     )
 
-    if response.status_code == 200:
-        data = response.json()
+    if response.status_code == 304:
+        metrics.record_cache("model_download", True)
+        artifact_store.install(model_entry["path"], model_path)
+        print(f"{model_type} model unchanged ({model_entry['sha256'][:12]}), using stored copy")
+        return model_path
 
-         # Find the link for the TensorFlow Lite (float32) model
-        tflite_float32 = next(
-            (item for item in data['downloads'] if item['type'] == 'TensorFlow Lite (float32)'),
-            None
-        )
+    if response.status_code != 200:
+        raise Exception(f"Error fetching download links: {response.status_code}, {response.text}")
 
-        if tflite_float32:
-            download_url = base_url + tflite_float32['link']
+    data = response.json()
 
-            # Download the file
-            model_response = requests.get(
-                download_url,
-                headers={
-                    "x-api-key": api_key
-                },
-                stream=True
-            )
+    # Find the link for the TensorFlow Lite model of this precision
+    tflite_model = next(
+        (item for item in data['downloads'] if item['type'] == model_type),
+        None
+    )
 
-            if model_response.status_code == 200:
-                # Ensure the "models" directory exists
-                models_dir = "models"
-                os.makedirs(models_dir, exist_ok=True)
+    if not tflite_model:
+        raise Exception(f"{model_type} model not found.")
 
-                # Save the file to the "models" directory
-                model_path = os.path.join(models_dir, "model.tflite")
-                with open(model_path, "wb") as f:
-                    for chunk in model_response.iter_content(chunk_size=1024):
-                        f.write(chunk)
+    download_url = BASE_URL + tflite_model['link']
 
-                print("TensorFlow Lite (float32) model downloaded and saved as 'model.tflite'")
-            else:
-                raise Exception(f"Error downloading model: {model_response.status_code}, {model_response.text}")
-        else:
-            raise Exception("TensorFlow Lite (float32) model not found.")
+    # A changed link means a different model version; don't send validators
+    # that belong to the old one.
+    previous = model_entry if model_entry and model_entry.get("url") == download_url else None
+
+    entry, changed = artifact_store.download(session, download_url, headers, PROJECT_ID, ".tflite", previous)
+    artifact_store.put_entry(PROJECT_ID, model_key, entry)
+    artifact_store.put_entry(PROJECT_ID, index_key, {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    })
+
+    artifact_store.install(entry["path"], model_path)
+    metrics.record_cache("model_download", not changed)
+
+    if changed:
+        print(f"{model_type} model downloaded ({entry['sha256'][:12]}) and saved as '{os.path.basename(model_path)}'")
     else:
-        raise Exception(f"Error fetching download links: {response.status_code}, {response.text}")
+        print(f"{model_type} model unchanged ({entry['sha256'][:12]}), using stored copy")
+    return model_path
 
-def get_class_names():
-    # Read the API key from a file
-    with open("api_key.txt", "r") as key_file:
-        api_key = key_file.read().strip()
 
-    # Project ID and base URL
-    projectId = "530573"
-    base_url = "https://studio.edgeimpulse.com"
+def get_class_names():
+    api_key = read_api_key()
 
     # Metrics file URL
-    metrics_url = f"{base_url}/v1/api/{projectId}/learn-data/11/model/metrics"
+    metrics_url = f"{BASE_URL}/v1/api/{PROJECT_ID}/learn-data/11/model/metrics"
+
+    class_file_path = os.path.join(MODELS_DIR, "classes.txt")
+    metrics_entry = artifact_store.get_entry(PROJECT_ID, "metrics")
+
+    request_headers = {"x-api-key": api_key}
+    if os.path.exists(class_file_path):
+        request_headers.update(artifact_store.validator_headers(metrics_entry))
 
     # Fetch the metrics file
-    metrics_response = requests.get(
-        metrics_url,
-        headers={
-            "x-api-key": api_key
-        }
-    )
+    metrics_response = session.get(metrics_url, headers=request_headers)
+
+    if metrics_response.status_code == 304:
+        metrics.record_cache("class_names", True)
+        print(f"Class names unchanged, keeping '{class_file_path}'.")
+        return
 
     # Check the response and save class names to a file
     if metrics_response.status_code == 200:
+        metrics.record_cache("class_names", False)
         metrics_data = metrics_response.json()
 
         # Extract class names from the metrics file
@@ -88,21 +161,173 @@ def get_class_names():
         if class_names:
             print("Class names:", class_names)
 
-            # Ensure the "models" directory exists
-            models_dir = "models"
-            os.makedirs(models_dir, exist_ok=True)
+            content = "".join(f"{class_name}\n" for class_name in class_names)
+
+            # Only rewrite the file when the names change; the classifier
+            # module embeds it at compile time.
+            previous = None
+            if os.path.exists(class_file_path):
+                with open(class_file_path, "r") as class_file:
+                    previous = class_file.read()
 
-            # Save class names to the "models" directory
-            class_file_path = os.path.join(models_dir, "classes.txt")
-            with open(class_file_path, "w") as class_file:
-                for class_name in class_names:
-                    class_file.write(f"{class_name}\n")
+            if previous != content:
+                artifact_store.atomic_write(class_file_path, content.encode())
+                print(f"Class names saved to '{class_file_path}'.")
 
-            print(f"Class names saved to '{class_file_path}'.")
+            artifact_store.put_entry(PROJECT_ID, "metrics", {
+                "etag": metrics_response.headers.get("ETag"),
+                "last_modified": metrics_response.headers.get("Last-Modified"),
+                "class_names": class_names,
+            })
         else:
             print("No class names found in the metrics file.")
     else:
         raise Exception(f"Error fetching the metrics file: {metrics_response.status_code}, {metrics_response.text}")
 
+# Generated from the project's spectral analysis block; the spectral and
+# classifier modules compile against it.
+DSP_CONFIG_PATH = os.path.join(MODELS_DIR, "dsp_config.rs")
+
+# Parameter values of the spectral analysis block that the spectral module
+# implements. Anything else would make its features silently differ from the
+# ones the model was trained on.
+SUPPORTED_DSP_PARAMETERS = {
+    "scale-axes": "1",
+    "input-decimation-ratio": "1",
+    "filter-type": "none",
+    "analysis-type": "FFT",
+    "extra-low-freq": "false",
+}
+
+
+def dsp_feature_count(dsp_config):
+    """Features per window, as feature_count in the spectral module counts
+    them: RMS, skewness, kurtosis, the spectrum's skewness and kurtosis and
+    fft_length / 2 spectral powers per axis."""
+    return len(dsp_config["axes"]) * (5 + dsp_config["fft_length"] // 2)
+
+
+def dsp_constants(dsp_config):
+    axes = ", ".join(json.dumps(axis) for axis in dsp_config["axes"])
+    return (
+        f"// Generated from block {dsp_config['block_id']} of Edge Impulse project {PROJECT_ID}; do not edit.\n"
+        f"pub const AXES: [&str; {len(dsp_config['axes'])}] = [{axes}];\n"
+        f"pub const FFT_LENGTH: usize = {dsp_config['fft_length']};\n"
+        f"pub const DO_LOG: bool = {str(dsp_config['do_log']).lower()};\n"
+        f"pub const DO_FFT_OVERLAP: bool = {str(dsp_config['do_fft_overlap']).lower()};\n"
+        f"pub const FEATURE_COUNT: usize = {dsp_feature_count(dsp_config)};\n"
+    )
+
+
+def parse_dsp_config(impulse, block_config):
+    """The spectral analysis parameters the modules are built with, from the
+    impulse and its spectral analysis block's config."""
+    block = next((block for block in impulse.get("dspBlocks", []) if block.get("type") == "spectral-analysis"), None)
+    if block is None:
+        raise Exception("The impulse has no spectral analysis block.")
+
+    values = {
+        item["param"]: str(item.get("value", item.get("defaultValue", ""))).strip()
+        for group in block_config.get("config", [])
+        for item in group.get("items", [])
+        if "param" in item
+    }
+    for param, supported in SUPPORTED_DSP_PARAMETERS.items():
+        if param in values and values[param].lower() != supported.lower():
+            raise Exception(
+                f"Spectral analysis parameter '{param}' is '{values[param]}', "
+                f"but the spectral module only implements '{supported}'."
+            )
+
+    fft_length = int(values.get("fft-length", 16))
+    if fft_length < 2 or fft_length & (fft_length - 1):
+        raise Exception(f"FFT length {fft_length} is not a power of two.")
+
+    return {
+        "block_id": block["id"],
+        "axes": list(block.get("axes") or ["accX", "accY", "accZ"]),
+        "fft_length": fft_length,
+        "do_log": values.get("do-log", "true").lower() == "true",
+        "do_fft_overlap": values.get("do-fft-overlap", "true").lower() == "true",
+    }
+
+
+def _get_json_conditionally(url, headers, store_key, reuse, description):
+    """The JSON body at `url`, and the artifact store entry to keep under
+    `store_key` for it if it changed (None if not). With `reuse`, the body
+    stored there is revalidated with its own validators, so an unchanged
+    one costs a 304."""
+    entry = artifact_store.get_entry(PROJECT_ID, store_key)
+    request_headers = dict(headers)
+    if reuse and entry and entry.get("url") == url and "body" in entry:
+        request_headers.update(artifact_store.validator_headers(entry))
+
+    response = session.get(url, headers=request_headers)
+    if response.status_code == 304:
+        return entry["body"], None
+    if response.status_code != 200:
+        raise Exception(f"Error fetching {description}: {response.status_code}, {response.text}")
+
+    body = response.json()
+    return body, {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "body": body,
+    }
+
+
+def get_dsp_config():
+    """Fetch the impulse and its spectral analysis block's config, write
+    them to DSP_CONFIG_PATH as Rust constants and return them.
+
+    The block's parameters can change without the impulse changing, so both
+    are always requested, each conditionally with its own validators."""
+    headers = {"x-api-key": read_api_key()}
+    # Without the generated file, the stored responses are no use.
+    reuse = os.path.exists(DSP_CONFIG_PATH)
+
+    body, impulse_entry = _get_json_conditionally(
+        f"{BASE_URL}/v1/api/{PROJECT_ID}/impulse", headers, "impulse", reuse, "the impulse"
+    )
+    impulse = body.get("impulse", {})
+
+    block_ids = [block["id"] for block in impulse.get("dspBlocks", []) if block.get("type") == "spectral-analysis"]
+    block_config, block_entry = {}, None
+    if block_ids:
+        block_config, block_entry = _get_json_conditionally(
+            f"{BASE_URL}/v1/api/{PROJECT_ID}/dsp/{block_ids[0]}/config",
+            headers, "dsp_block", reuse, "the spectral analysis config",
+        )
+
+    changed = impulse_entry is not None or block_entry is not None
+    metrics.record_cache("dsp_config", not changed)
+    stored = artifact_store.get_entry(PROJECT_ID, "dsp_config")
+    if not changed and stored:
+        print(f"Impulse and spectral analysis config unchanged, keeping '{DSP_CONFIG_PATH}'.")
+        return stored
+
+    dsp_config = parse_dsp_config(impulse, block_config)
+    print("Spectral analysis config:", dsp_config)
+
+    # Only rewrite the file when the constants change; rewriting it would
+    # rebuild both modules that include it.
+    content = dsp_constants(dsp_config)
+    previous = None
+    if os.path.exists(DSP_CONFIG_PATH):
+        with open(DSP_CONFIG_PATH, "r") as config_file:
+            previous = config_file.read()
+    if previous != content:
+        artifact_store.atomic_write(DSP_CONFIG_PATH, content.encode())
+        print(f"Spectral analysis constants saved to '{DSP_CONFIG_PATH}'.")
+
+    # Stored only now, so a config that failed to parse is fetched again.
+    artifact_store.put_entry(PROJECT_ID, "dsp_config", dsp_config)
+    for store_key, entry in (("impulse", impulse_entry), ("dsp_block", block_entry)):
+        if entry is not None:
+            artifact_store.put_entry(PROJECT_ID, store_key, entry)
+    return dsp_config
+
+
 if __name__ == "__main__":
-    download_model()
\ No newline at end of file
+    download_model()
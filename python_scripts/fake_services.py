@@ -0,0 +1,279 @@
+"""Local stand-ins for the wasmiot orchestrator and the Edge Impulse API.
+
+Used by the benchmark and load-test tools to run the pipeline and
+inference paths offline. Only the endpoints this project calls are
+implemented, with just enough state to chain them (uploaded modules,
+manifests, result files). Every response can be delayed to mimic a real
+network, and requests are counted per endpoint.
+"""
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import os
+import threading
+import time
+from collections import Counter
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+from python_scripts import mount_format
+
+# The deployment's chain: save_sensor_data, spectral features, classifier.
+STAGES = ("save", "spectral", "model")
+# Samples in one window of interleaved x, y, z accelerometer values.
+WINDOW_LENGTH = 312
+
+
+class FakeServices:
+    def __init__(
+        self, latency=0.0, latencies=None, model_bytes=None, class_names=("idle", "walking", "running"),
+        stage_delays=None, stage_workers=1,
+    ):
+        # `latency` applies to every endpoint unless `latencies` has an
+        # entry for its name (e.g. {"upload_module": 0.2}).
+        self.latency = latency
+        self.latencies = dict(latencies or {})
+        # With `stage_delays` ({"save": seconds, ...}) an execution passes
+        # through the three stages in turn, each on a device that runs
+        # `stage_workers` executions at a time, so executions queue up like
+        # on real devices. Input windows must then hold WINDOW_LENGTH values.
+        self.stage_delays = dict(stage_delays or {})
+        self._stage_slots = {stage: threading.BoundedSemaphore(stage_workers) for stage in STAGES}
+        self.stage_waiting = Counter()
+        self.stage_max_waiting = Counter()
+        self.model_bytes = model_bytes if model_bytes is not None else os.urandom(64 * 1024)
+        self.class_names = list(class_names)
+        # Parameters of the spectral analysis block, as Edge Impulse lists them.
+        self.dsp_config = {
+            "scale-axes": "1", "filter-type": "none", "analysis-type": "FFT",
+            "fft-length": "16", "do-log": "true", "do-fft-overlap": "true", "extra-low-freq": "false",
+        }
+
+        self.requests = Counter()
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.modules = []
+        self.devices = [{"_id": f"device-{i}", "name": f"device{i}"} for i in (1, 2, 3)]
+        self.manifests = []
+        self.results = {
+            ("model", "probabilities.csv"): self._probabilities_csv(),
+            ("model", "probabilities.bin"): self._probabilities_bin(),
+        }
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+        self.app = self._make_app()
+
+    def _probabilities_csv(self):
+        share = 1.0 / len(self.class_names)
+        rows = "".join(f"{name},{share}\n" for name in self.class_names)
+        return "class,probability\n" + rows
+
+    def _probabilities_bin(self):
+        share = 1.0 / len(self.class_names)
+        return mount_format.encode(mount_format.PROBABILITIES, [share] * len(self.class_names), self.class_names)
+
+    def _next_id(self, prefix):
+        return f"{prefix}-{next(self._ids)}"
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests.clear()
+            self.bytes_received = 0
+            self.bytes_sent = 0
+            self.stage_max_waiting.clear()
+
+    def _run_stage(self, stage):
+        slot = self._stage_slots[stage]
+        if not slot.acquire(blocking=False):
+            # Busy: count the executions queued for this stage.
+            with self._lock:
+                self.stage_waiting[stage] += 1
+                self.stage_max_waiting[stage] = max(self.stage_max_waiting[stage], self.stage_waiting[stage])
+            slot.acquire()
+            with self._lock:
+                self.stage_waiting[stage] -= 1
+        try:
+            time.sleep(self.stage_delays.get(stage, 0.0))
+        finally:
+            slot.release()
+
+    @staticmethod
+    def _window_length(data):
+        if mount_format.is_binary(data):
+            return len(mount_format.decode(data)[1])
+        return len([value for value in data.decode().replace("\n", ",").split(",") if value.strip()])
+
+    def _make_app(self):
+        app = Flask(__name__)
+        services = self
+
+        @app.before_request
+        def count_and_delay():
+            endpoint = request.endpoint or "unknown"
+            with services._lock:
+                services.requests[endpoint] += 1
+                services.bytes_received += request.environ.get("fake_services.wire_length", request.content_length or 0)
+            delay = services.latencies.get(endpoint, services.latency)
+            if delay:
+                time.sleep(delay)
+
+        @app.after_request
+        def count_sent(response):
+            if not response.is_streamed:
+                with services._lock:
+                    services.bytes_sent += response.calculate_content_length() or 0
+            return response
+
+        def conditional(payload, etag):
+            response = payload if not isinstance(payload, (dict, list)) else jsonify(payload)
+            response.set_etag(etag)
+            return response.make_conditional(request)
+
+        # Edge Impulse
+
+        @app.route("/v1/api/<project_id>/downloads")
+        def downloads(project_id):
+            # Both precisions serve the same bytes; only the pipeline's
+            # handling of the option is exercised.
+            payload = {"downloads": [
+                {"type": "TensorFlow Lite (float32)", "link": f"/v1/api/{project_id}/model.tflite"},
+                {"type": "TensorFlow Lite (int8 quantized)", "link": f"/v1/api/{project_id}/model.tflite?precision=int8"},
+            ]}
+            return conditional(payload, hashlib.sha256(services.model_bytes).hexdigest()[:16] + "-index")
+
+        @app.route("/v1/api/<project_id>/model.tflite")
+        def model_file(project_id):
+            response = app.response_class(services.model_bytes, mimetype="application/octet-stream")
+            response.set_etag(hashlib.md5(services.model_bytes).hexdigest())
+            return response.make_conditional(request, accept_ranges=True, complete_length=len(services.model_bytes))
+
+        @app.route("/v1/api/<project_id>/impulse")
+        def impulse(project_id):
+            payload = {"impulse": {
+                "inputBlocks": [{"id": 1, "type": "time-series", "frequencyHz": 52}],
+                "dspBlocks": [{"id": 3, "type": "spectral-analysis", "axes": ["accX", "accY", "accZ"]}],
+                "learnBlocks": [{"id": 11, "dsp": [3]}],
+            }}
+            return conditional(payload, hashlib.sha256(json.dumps(payload).encode()).hexdigest()[:16])
+
+        @app.route("/v1/api/<project_id>/dsp/<int:block_id>/config")
+        def dsp_config(project_id, block_id):
+            # Changes to the block's parameters leave the impulse's ETag alone.
+            items = [{"param": param, "value": value} for param, value in services.dsp_config.items()]
+            payload = {"config": [{"group": "Spectral power", "items": items}]}
+            return conditional(payload, hashlib.sha256(json.dumps(payload).encode()).hexdigest()[:16])
+
+        @app.route("/v1/api/<project_id>/learn-data/<int:block_id>/model/metrics")
+        def metrics(project_id, block_id):
+            payload = {"validation": {"float32": {"class_names": services.class_names}}}
+            return conditional(payload, hashlib.sha256(json.dumps(services.class_names).encode()).hexdigest()[:16])
+
+        # Orchestrator
+
+        @app.route("/file/device")
+        def list_devices():
+            return conditional(services.devices, hashlib.sha256(json.dumps(services.devices).encode()).hexdigest()[:16])
+
+        @app.route("/file/module", methods=["GET"])
+        def list_modules():
+            return conditional(services.modules, hashlib.sha256(json.dumps(services.modules).encode()).hexdigest()[:16])
+
+        @app.route("/file/module", methods=["POST"])
+        def upload_module():
+            upload = request.files.get("file")
+            module = {
+                "_id": services._next_id("module"),
+                "name": request.form.get("name"),
+                "wasm": {
+                    "originalFilename": upload.filename if upload else None,
+                    "size": len(upload.read()) if upload else 0,
+                },
+            }
+            with services._lock:
+                services.modules.append(module)
+            return jsonify({"id": module["_id"]}), 201
+
+        @app.route("/file/module/<module_id>/upload", methods=["POST"])
+        def describe_module(module_id):
+            module = next((m for m in services.modules if m["_id"] == module_id), None)
+            if module is None:
+                return "No such module", 404
+            module["description"] = dict(request.form)
+            module["mounts"] = sorted(request.files)
+            return jsonify({"description": module["description"]})
+
+        @app.route("/file/manifest", methods=["GET"])
+        def list_manifests():
+            return conditional(services.manifests, hashlib.sha256(json.dumps(services.manifests).encode()).hexdigest()[:16])
+
+        @app.route("/file/manifest", methods=["POST"])
+        def create_manifest():
+            manifest = dict(request.get_json(silent=True) or {})
+            manifest["_id"] = services._next_id("deployment")
+            with services._lock:
+                services.manifests.append(manifest)
+            return json.dumps(manifest["_id"]), 201
+
+        @app.route("/file/manifest/<deployment_id>", methods=["POST", "PUT"])
+        def deploy(deployment_id):
+            manifest = next((m for m in services.manifests if m["_id"] == deployment_id), None)
+            if manifest is None:
+                return "No such deployment", 404
+            if request.method == "PUT":
+                manifest.update(request.get_json(silent=True) or {})
+            manifest["deployed"] = time.time()
+            return jsonify({"deployment": deployment_id})
+
+        @app.route("/execute/<deployment_id>", methods=["POST"])
+        def execute(deployment_id):
+            if not any(m["_id"] == deployment_id for m in services.manifests):
+                return "No such deployment", 404
+            if services.stage_delays:
+                for upload in request.files.values():
+                    length = services._window_length(upload.read())
+                    if length != WINDOW_LENGTH:
+                        return f"Expected {WINDOW_LENGTH} samples, got {length}", 400
+                for stage in STAGES:
+                    services._run_stage(stage)
+            # Answer in the format the input window was sent in.
+            extension = "bin" if any(name.endswith(".bin") for name in request.files) else "csv"
+            return jsonify({"resultUrl": f"{request.host_url}module_results/model/probabilities.{extension}"})
+
+        @app.route("/module_results/<module>/<filename>")
+        def module_results(module, filename):
+            content = services.results.get((module, filename))
+            if content is None:
+                return "No such result", 404
+            mimetype = "application/octet-stream" if filename.endswith(".bin") else "text/csv"
+            return app.response_class(content, mimetype=mimetype)
+
+        app.wsgi_app = self._decompress(app.wsgi_app)
+        return app
+
+    @staticmethod
+    def _decompress(wsgi_app):
+        # Accept gzip-compressed request bodies, like an orchestrator behind
+        # a proxy that decodes Content-Encoding.
+        def app(environ, start_response):
+            if environ.get("HTTP_CONTENT_ENCODING") == "gzip":
+                compressed = environ["wsgi.input"].read()
+                body = gzip.decompress(compressed)
+                environ["wsgi.input"] = io.BytesIO(body)
+                environ["CONTENT_LENGTH"] = str(len(body))
+                environ["fake_services.wire_length"] = len(compressed)
+                environ.pop("HTTP_CONTENT_ENCODING")
+                environ.pop("HTTP_TRANSFER_ENCODING", None)
+                environ.pop("wsgi.input_terminated", None)
+            return wsgi_app(environ, start_response)
+        return app
+
+    def serve(self, host="127.0.0.1", port=0):
+        """Serve from a background thread; returns the base URL."""
+        self._server = make_server(host, port, self.app, threaded=True)
+        threading.Thread(target=self._server.serve_forever, name="fake-services", daemon=True).start()
+        return f"http://{host}:{self._server.server_port}"
+
+    def shutdown(self):
+        self._server.shutdown()
@@ -0,0 +1,335 @@
+"""Open-loop load test of deployment executions.
+
+Sends synthetic 3-axis accelerometer windows (312 interleaved x, y, z
+samples, like the ones save_sensor_data reads) to the orchestrator's
+/execute/<deployment> at a fixed rate, or triggers the app's /do_run. Requests
+go out on schedule whether or not earlier ones have finished, so a
+deployment that can't keep up shows as growing latency and errors instead
+of a slower request rate. Latency is measured from when a request was due.
+Reports throughput, p50/p95/p99 latency and errors for each rate.
+
+With --stand-in everything runs offline against python_scripts.fake_services,
+which passes each execution through the save, spectral and model stages
+with the delays given by --stage-delay. Each stage handles one execution at
+a time, like a device. For --target do_run the app runs in-process with
+prebuilt stand-in artifacts, as in the pipeline benchmark.
+
+    python -m python_scripts.load_test --stand-in --rate 10,20,40 --duration 10 \\
+        --stage-delay save=0.005 --stage-delay spectral=0.02 --stage-delay model=0.03
+    python -m python_scripts.load_test --url http://172.17.0.1:3000 --deployment <id> --rate 5
+    python -m python_scripts.load_test --target do_run --url http://localhost:5000 --rate 2
+"""
+import argparse
+import contextlib
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from python_scripts import mount_format
+from python_scripts.fake_services import STAGES, WINDOW_LENGTH
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+AXES = 3
+SAMPLING_FREQ = 52
+
+# Synthetic activities: (frequency in Hz, amplitude per axis, noise).
+ACTIVITIES = {
+    "idle": (0.0, (0.0, 0.0, 0.0), 0.05),
+    "walking": (1.8, (2.5, 1.0, 3.0), 0.4),
+    "running": (2.8, (6.0, 2.5, 8.0), 0.8),
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=["execute", "do_run"], default="execute")
+    parser.add_argument("--url", help="orchestrator (execute) or app (do_run) base URL")
+    parser.add_argument("--deployment", help="deployment id for --target execute")
+    parser.add_argument("--stand-in", action="store_true", help="run against local fake services")
+    parser.add_argument("--rate", default="5", help="requests per second; a comma-separated list runs each in turn")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load per rate")
+    parser.add_argument("--poisson", action="store_true", help="exponential gaps between requests instead of even ones")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="requests in flight before new ones are dropped")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds before a request counts as failed")
+    parser.add_argument("--mount-format", choices=["csv", "binary"], default="csv", help="format of the uploaded windows")
+    parser.add_argument("--no-fetch", action="store_true", help="don't fetch the resultUrl after each execution")
+    parser.add_argument(
+        "--stage-delay", action="append", default=[], metavar="STAGE=SECONDS",
+        help=f"stand-in delay of one of {', '.join(STAGES)}; can be repeated",
+    )
+    parser.add_argument("--stage-workers", type=int, default=1, help="stand-in executions per stage at a time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+
+    if not args.stand_in and not args.url:
+        parser.error("--url is required without --stand-in")
+    if args.target == "execute" and not args.stand_in and not args.deployment:
+        parser.error("--deployment is required for --target execute")
+    return args
+
+
+def stage_delays(values):
+    delays = {}
+    for value in values:
+        stage, _, seconds = value.partition("=")
+        if stage not in STAGES:
+            raise SystemExit(f"Unknown stage '{stage}', expected one of {', '.join(STAGES)}")
+        delays[stage] = float(seconds)
+    return delays
+
+
+def synthetic_windows(count, seed=0):
+    """`count` windows of WINDOW_LENGTH interleaved x, y, z samples at
+    SAMPLING_FREQ Hz: gravity on z plus a periodic motion and noise of a
+    random activity, rounded to 2 decimals like accelerometer_data.csv.
+    Returns the windows and their activity names."""
+    rng = np.random.default_rng(seed)
+    samples = WINDOW_LENGTH // AXES
+    t = np.arange(samples) / SAMPLING_FREQ
+
+    names = list(ACTIVITIES)
+    labels = [names[index] for index in rng.integers(len(names), size=count)]
+    windows = np.empty((count, samples, AXES))
+    for i, label in enumerate(labels):
+        frequency, amplitudes, noise = ACTIVITIES[label]
+        phase = rng.uniform(0, 2 * math.pi)
+        motion = np.sin(2 * math.pi * frequency * t + phase)
+        windows[i] = np.outer(motion, amplitudes) + rng.normal(0.0, noise, size=(samples, AXES))
+        windows[i, :, 2] += 9.81
+
+    return np.round(windows.reshape(count, WINDOW_LENGTH), 2), labels
+
+
+def window_files(window, mount_format_name):
+    # What the app's batch inference uploads for one window.
+    if mount_format_name == "binary":
+        data = mount_format.encode(mount_format.SAMPLES, window)
+        return {"accelerometer_data.bin": ("accelerometer_data.bin", data, "application/octet-stream")}
+    data = ", ".join(f"{value:.2f}" for value in window)
+    return {"accelerometer_data.csv": ("accelerometer_data.csv", data, "text/csv")}
+
+
+def make_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def execute_sender(session, base_url, deployment_id, mount_format_name, fetch, timeout):
+    def send(window):
+        response = session.post(
+            f"{base_url.rstrip('/')}/execute/{deployment_id}",
+            data={"id": deployment_id}, files=window_files(window, mount_format_name), timeout=timeout,
+        )
+        response.raise_for_status()
+        if fetch:
+            session.get(response.json()["resultUrl"], timeout=timeout).raise_for_status()
+    return send
+
+
+def do_run_sender(session, base_url, timeout):
+    # /do_run runs the deployment on the device's own sensor data; the
+    # window isn't sent.
+    def send(window):
+        session.post(f"{base_url.rstrip('/')}/do_run", timeout=timeout).raise_for_status()
+    return send
+
+
+def error_kind(error):
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return f"http_{error.response.status_code}"
+    if isinstance(error, requests.Timeout):
+        return "timeout"
+    if isinstance(error, requests.ConnectionError):
+        return "connection"
+    return type(error).__name__
+
+
+def run_open_loop(send, windows, rate, duration, poisson=False, max_in_flight=256, seed=0):
+    """Call `send(window)` at `rate` per second for `duration` seconds
+    without waiting for earlier calls. Calls that would exceed
+    `max_in_flight` are dropped rather than delayed."""
+    rng = random.Random(seed)
+    count = max(1, int(rate * duration))
+    results = []
+    results_lock = threading.Lock()
+    slots = threading.BoundedSemaphore(max_in_flight)
+
+    def one(index, due):
+        started = time.perf_counter()
+        try:
+            send(windows[index % len(windows)])
+            error = None
+        except Exception as e:
+            error = error_kind(e)
+        finished = time.perf_counter()
+        slots.release()
+        with results_lock:
+            results.append({"due": due, "latency": finished - due, "service": finished - started, "error": error, "finished": finished})
+
+    dropped = 0
+    start = time.perf_counter()
+    due = start
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="load") as pool:
+        for index in range(count):
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if slots.acquire(blocking=False):
+                pool.submit(one, index, due)
+            else:
+                dropped += 1
+            due += rng.expovariate(rate) if poisson else 1.0 / rate
+
+    return summarize(results, rate, count, dropped, start)
+
+
+def percentiles(values):
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(max(values))}
+
+
+def summarize(results, rate, count, dropped, start):
+    succeeded = [result for result in results if result["error"] is None]
+    errors = {}
+    for result in results:
+        if result["error"]:
+            errors[result["error"]] = errors.get(result["error"], 0) + 1
+
+    elapsed = max((result["finished"] for result in results), default=start) - start
+    return {
+        "offered_rate": rate,
+        "requests": count,
+        "succeeded": len(succeeded),
+        "failed": len(results) - len(succeeded),
+        "dropped": dropped,
+        "error_rate": (count - len(succeeded)) / count,
+        "errors": errors,
+        "elapsed_seconds": elapsed,
+        "throughput": len(succeeded) / elapsed if elapsed else None,
+        "latency_seconds": percentiles([result["latency"] for result in succeeded]),
+        "service_seconds": percentiles([result["service"] for result in succeeded]),
+    }
+
+
+def print_result(result):
+    line = (
+        f"{result['offered_rate']:8.1f}/s offered  {result['throughput'] or 0:8.1f}/s done  "
+        f"errors {result['error_rate'] * 100:5.1f}%"
+    )
+    latency = result["latency_seconds"]
+    if latency:
+        line += "  latency p50 {:.1f} p95 {:.1f} p99 {:.1f} ms".format(
+            latency["p50"] * 1000, latency["p95"] * 1000, latency["p99"] * 1000,
+        )
+    if result.get("stage_max_queue"):
+        line += f"  max queue {result['stage_max_queue']}"
+    print(line)
+    if result["errors"] or result["dropped"]:
+        print(f"          errors {result['errors']}, dropped {result['dropped']}")
+
+
+@contextlib.contextmanager
+def stand_in(args):
+    """Start the fake services (and the app for --target do_run). Yields the
+    URL to load, the deployment id and the services."""
+    from werkzeug.serving import make_server
+    from python_scripts.fake_services import FakeServices
+
+    services = FakeServices(stage_delays=stage_delays(args.stage_delay), stage_workers=args.stage_workers)
+    base_url = services.serve()
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+    if args.target == "execute":
+        response = requests.post(f"{base_url}/file/manifest", json={"name": "load-test"}, timeout=args.timeout)
+        response.raise_for_status()
+        try:
+            yield base_url, response.json(), services
+        finally:
+            services.shutdown()
+        return
+
+    from python_scripts.benchmark_pipeline import prepare_workdir, use_prebuilt_artifacts
+
+    # The app reads these at import time.
+    sys.path[:0] = [REPO_ROOT, os.path.join(REPO_ROOT, "flask")]
+    os.environ["WASMIOT_ORCHESTRATOR_URL"] = base_url
+    os.environ["EDGE_IMPULSE_URL"] = base_url
+    os.environ["MOUNT_FORMAT"] = args.mount_format
+    extension = "bin" if args.mount_format == "binary" else "csv"
+    os.environ["MODEL_RESULTS_URL"] = f"{base_url}/module_results/model/probabilities.{extension}"
+
+    workdir = prepare_workdir()
+    os.chdir(workdir)
+    server = None
+    try:
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            import app.app as pipeline
+            from app.jobs import Job
+
+            use_prebuilt_artifacts(pipeline, workdir)
+            pipeline.run_pipeline(Job(pipeline.pipeline_key()))
+
+        server = make_server("127.0.0.1", 0, pipeline.app, threaded=True)
+        threading.Thread(target=server.serve_forever, name="load-test-app", daemon=True).start()
+        yield f"http://127.0.0.1:{server.server_port}", None, services
+    finally:
+        if server:
+            server.shutdown()
+        services.shutdown()
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    args = parse_args()
+    rates = [float(rate) for rate in args.rate.split(",")]
+    windows, _ = synthetic_windows(max(1, min(1000, int(max(rates) * args.duration))), args.seed)
+    session = make_session(args.max_in_flight)
+
+    with contextlib.ExitStack() as stack:
+        services = None
+        url, deployment_id = args.url, args.deployment
+        if args.stand_in:
+            url, deployment_id, services = stack.enter_context(stand_in(args))
+
+        if args.target == "execute":
+            send = execute_sender(session, url, deployment_id, args.mount_format, not args.no_fetch, args.timeout)
+        else:
+            send = do_run_sender(session, url, args.timeout)
+
+        results = []
+        for rate in rates:
+            if services:
+                services.reset_counters()
+            result = run_open_loop(send, windows, rate, args.duration, args.poisson, args.max_in_flight, args.seed)
+            if services:
+                result["stage_max_queue"] = dict(services.stage_max_waiting)
+            print_result(result)
+            results.append(result)
+
+    if args.output:
+        config = {key: value for key, value in vars(args).items() if key != "output"}
+        with open(args.output, "w") as results_file:
+            json.dump({"created": time.time(), "config": config, "results": results}, results_file, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
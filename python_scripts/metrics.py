@@ -0,0 +1,210 @@
+"""Counters, latency histograms and per-run traces.
+
+Metrics are process-wide and rendered in the Prometheus text format by
+`render()`. Spans time a block of code: they feed a histogram and, when a
+trace is active in the current context, are also recorded in it, so one
+pipeline run can be reported as a list of timed spans.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds. Spans range from quick orchestrator listings to cargo builds and
+# model conversions that take minutes.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _label_key(label_names, labels):
+    if set(labels) != set(label_names):
+        raise ValueError(f"Expected labels {list(label_names)}, got {sorted(labels)}")
+    return tuple(str(labels[name]) for name in label_names)
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(self.label_names, labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, list(zip(self.label_names, key)), value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            pairs = list(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield self.name + "_bucket", pairs + [("le", _format_value(bound))], cumulative
+            yield self.name + "_sum", pairs, total
+            yield self.name + "_count", pairs, cumulative
+
+
+def _register(metric_class, name, documentation, label_names, **kwargs):
+    # Modules may be imported more than once (e.g. as a script and as part of
+    # the app); hand back the metric that already exists.
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = metric_class(name, documentation, label_names, **kwargs)
+        return metric
+
+
+def counter(name, documentation, label_names=()):
+    return _register(Counter, name, documentation, label_names)
+
+
+def histogram(name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, documentation, label_names, buckets=buckets)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda metric: metric.name)
+
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, pairs, value in metric.samples():
+            lines.append(f"{name}{_format_labels(pairs)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+CACHE_REQUESTS = counter(
+    "cache_requests_total",
+    "Lookups in the build, conversion and download caches, by result (hit or miss).",
+    ["cache", "result"],
+)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+class Trace:
+    """Spans recorded during one run, in the order they finished."""
+
+    def __init__(self):
+        self.started = time.time()
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, start, duration, error=None, **attributes):
+        span = {"name": name, "start": start, "duration": duration}
+        if attributes:
+            span["attributes"] = attributes
+        if error is not None:
+            span["error"] = error
+        with self._lock:
+            self._spans.append(span)
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self._spans, key=lambda span: span["start"])
+        return {"started": self.started, "duration": time.time() - self.started, "spans": spans}
+
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+@contextmanager
+def tracing(trace):
+    """Record spans started in this context (and contexts copied from it)
+    into `trace`."""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def add_span(name, start, duration, error=None, **attributes):
+    """Record an already measured span in the current trace, if any."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, start, duration, error, **attributes)
+
+
+@contextmanager
+def span(name, histogram=None, **labels):
+    """Time the block into `histogram` (observed with `labels`) and the
+    current trace."""
+    start = time.time()
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        if histogram is not None:
+            histogram.observe(duration, **labels)
+        add_span(name, start, duration, error, **labels)
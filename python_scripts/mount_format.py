@@ -0,0 +1,49 @@
+"""Binary mount files exchanged with the modules.
+
+A 16-byte little-endian header (magic, version, kind, value count, label
+bytes), the values as little-endian f32 and optional newline-separated
+UTF-8 labels. Keep in sync with modules/mount_format.
+"""
+import struct
+import numpy as np
+
+MAGIC = b"WMF1"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHII")
+
+SAMPLES = 1
+FEATURES = 2
+PROBABILITIES = 3
+
+VALUE_DTYPE = np.dtype("<f4")
+
+
+def is_binary(data):
+    return len(data) >= HEADER.size and bytes(data[:4]) == MAGIC
+
+
+def encode(kind, values, labels=None):
+    values = np.ascontiguousarray(values, dtype=VALUE_DTYPE)
+    label_bytes = "\n".join(labels).encode() if labels else b""
+    header = HEADER.pack(MAGIC, VERSION, kind, 0, values.size, len(label_bytes))
+    return header + values.tobytes() + label_bytes
+
+
+def decode(data):
+    """Returns `(kind, values, labels)`. `values` is a read-only NumPy view
+    into `data`, not a copy."""
+    view = memoryview(data)
+    if not is_binary(view):
+        raise ValueError("Not a binary mount file")
+
+    _, version, kind, _, count, label_length = HEADER.unpack_from(view)
+    if version != VERSION:
+        raise ValueError(f"Unsupported mount file version {version}")
+
+    values_end = HEADER.size + count * VALUE_DTYPE.itemsize
+    if len(view) < values_end + label_length:
+        raise ValueError(f"Truncated mount file: {len(view)} bytes, expected {values_end + label_length}")
+
+    values = np.frombuffer(view, dtype=VALUE_DTYPE, count=count, offset=HEADER.size)
+    labels = bytes(view[values_end:values_end + label_length]).decode().split("\n") if label_length else []
+    return kind, values, labels
@@ -0,0 +1,316 @@
+"""NumPy version of the spectral features computed by
+modules/rust_spectral_analysis.
+
+Produces the same values as the module's `generate_features` for each
+window of interleaved axis samples: per axis the RMS, skewness and kurtosis
+of the centered signal, the skewness and kurtosis of the Welch max-hold
+spectrum and its (log10) powers without the DC bin. The parameters are the
+ones the module is built with, read from the same constants file. Many
+windows are processed at once with a batched rFFT, for computing features
+of whole datasets server-side, checking the module's features.csv before a
+deploy and comparing throughput with the WASM module.
+
+    python -m python_scripts.spectral_features benchmark --windows 10000
+    python -m python_scripts.spectral_features validate accelerometer_data.csv features.csv
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import numpy as np
+from python_scripts import mount_format
+
+# The spectral analysis constants the modules are built with: generated
+# when the model is downloaded, or the checked-in defaults before that (see
+# modules/dsp_config_build.rs).
+DSP_CONFIG_PATH = "models/dsp_config.rs"
+DEFAULT_DSP_CONFIG_PATH = "modules/dsp_config_default.rs"
+
+# Windows per batch; bounds the memory used by the frame spectra.
+CHUNK_SIZE = 4096
+
+# features.csv holds values rounded to 4 decimals.
+DEFAULT_TOLERANCE = 1e-3
+
+
+def load_dsp_config(path=None):
+    """The parameters in the Rust constants file at `path`, by default the
+    one the modules' build script would pick, as a dict with `axes` (the
+    number of axes), `fft_length`, `do_log` and `do_fft_overlap`."""
+    if path is None:
+        path = DSP_CONFIG_PATH if os.path.exists(DSP_CONFIG_PATH) else DEFAULT_DSP_CONFIG_PATH
+    with open(path, "r") as f:
+        # Values are Rust literals that read as JSON: numbers, booleans and
+        # arrays of strings.
+        constants = {
+            name: json.loads(value)
+            for name, value in re.findall(r"^pub const (\w+):[^=]+=\s*(.+);$", f.read(), re.MULTILINE)
+        }
+    return {
+        "axes": len(constants["AXES"]),
+        "fft_length": constants["FFT_LENGTH"],
+        "do_log": constants["DO_LOG"],
+        "do_fft_overlap": constants["DO_FFT_OVERLAP"],
+    }
+
+
+def feature_count(dsp_config):
+    """Features per window: 5 statistics and fft_length / 2 powers per axis."""
+    return dsp_config["axes"] * (5 + dsp_config["fft_length"] // 2)
+
+
+def _skew_kurtosis(x):
+    """Population skewness and excess kurtosis over the last axis.
+
+    Like the module, skewness is 0 for constant or too short inputs, while
+    kurtosis isn't guarded against a zero variance: constant inputs give NaN.
+    """
+    n = x.shape[-1]
+    deviations = x - x.mean(axis=-1, keepdims=True)
+    # Repeated products instead of ** 3 / ** 4, which numpy computes with
+    # the much slower pow().
+    squares = deviations * deviations
+    variance = squares.mean(axis=-1)
+    third = (squares * deviations).mean(axis=-1)
+    fourth = (squares * squares).mean(axis=-1)
+
+    std = np.sqrt(variance)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        skew = np.where(std == 0, 0.0, third / (std * std * std))
+        kurtosis = fourth / (variance * variance) - 3.0
+    if n < 2:
+        skew = np.zeros_like(skew)
+    return skew, kurtosis
+
+
+def welch_max_hold(fx, fft_length, do_fft_overlap):
+    """Per-bin maximum of |rFFT|^2 / fft_length over the frames of each
+    signal in `fx` (last axis). Frames start every fft_length (or half of it
+    with overlap) samples while inside the signal and are zero-padded at the
+    end; no window function is applied."""
+    length = fx.shape[-1]
+    hop = fft_length - (fft_length // 2 if do_fft_overlap else 0)
+    frame_count = max(1, -(-length // hop))
+
+    padded_length = (frame_count - 1) * hop + fft_length
+    padded = np.zeros(fx.shape[:-1] + (padded_length,))
+    padded[..., :length] = fx
+
+    frames = np.lib.stride_tricks.sliding_window_view(padded, fft_length, axis=-1)[..., ::hop, :]
+    spectrum = np.fft.rfft(frames, axis=-1)
+    powers = (spectrum.real ** 2 + spectrum.imag ** 2) / fft_length
+    return powers.max(axis=-2)
+
+
+def _features_chunk(windows, axes, fft_length, do_log, do_fft_overlap):
+    count, samples = windows.shape
+    # (windows, samples) interleaved by axis -> (windows, axes, samples per axis)
+    fx = windows.reshape(count, samples // axes, axes).transpose(0, 2, 1)
+    fx = fx - fx.mean(axis=-1, keepdims=True)
+
+    rms = np.sqrt((fx * fx).mean(axis=-1))
+    skew, kurtosis = _skew_kurtosis(fx)
+    powers = welch_max_hold(fx, fft_length, do_fft_overlap)
+    spec_skew, spec_kurtosis = _skew_kurtosis(powers)
+
+    spectral = powers
+    if do_log:
+        spectral = np.log10(np.where(powers == 0.0, 1e-10, powers))
+
+    per_axis = np.concatenate(
+        [
+            np.stack([rms, skew, kurtosis, spec_skew, spec_kurtosis], axis=-1),
+            spectral[..., 1:],
+        ],
+        axis=-1,
+    )
+    return per_axis.reshape(count, -1)
+
+
+def generate_features(raw_data, dsp_config=None, chunk_size=CHUNK_SIZE):
+    """Features of one window (1-D input) or of many (2-D, one window per row),
+    with the parameters of `dsp_config` (by default `load_dsp_config()`).
+
+    Windows hold interleaved samples of each axis, as in accelerometer_data.csv.
+    """
+    dsp_config = dsp_config or load_dsp_config()
+    axes = dsp_config["axes"]
+    raw_data = np.asarray(raw_data, dtype=np.float64)
+    single = raw_data.ndim == 1
+    windows = raw_data[np.newaxis] if single else raw_data
+
+    if windows.ndim != 2 or windows.shape[1] % axes:
+        raise ValueError(f"Expected windows of {axes} interleaved axes, got an array of shape {raw_data.shape}")
+
+    features = np.empty((windows.shape[0], feature_count(dsp_config)))
+    for start in range(0, windows.shape[0], chunk_size):
+        chunk = windows[start:start + chunk_size]
+        features[start:start + len(chunk)] = _features_chunk(
+            chunk, axes, dsp_config["fft_length"], dsp_config["do_log"], dsp_config["do_fft_overlap"]
+        )
+
+    return features[0] if single else features
+
+
+def read_values(path):
+    """All comma-separated numbers in a CSV file, as the module reads them,
+    or the values of a binary mount file."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if mount_format.is_binary(data):
+        return mount_format.decode(data)[1].astype(np.float64)
+
+    values = []
+    for line in data.decode().splitlines():
+        for value in line.split(","):
+            try:
+                values.append(float(value.strip()))
+            except ValueError:
+                continue
+    return np.array(values)
+
+
+def format_features(features):
+    # Same layout as the module's features.csv.
+    return ", ".join(f"{value:.4f}" for value in features)
+
+
+def compare(expected, actual, tolerance=DEFAULT_TOLERANCE):
+    """Compare features from the module (`actual`) with the reference ones.
+    Returns a dict with `ok`, the largest absolute error and the mismatching
+    indexes."""
+    expected = np.asarray(expected, dtype=np.float64)
+    actual = np.asarray(actual, dtype=np.float64)
+    if expected.shape != actual.shape:
+        return {"ok": False, "error": f"Expected {expected.size} features, got {actual.size}", "mismatches": []}
+
+    errors = np.abs(expected - actual)
+    # NaN only matches NaN (kurtosis of a constant signal).
+    both_nan = np.isnan(expected) & np.isnan(actual)
+    bad = ~both_nan & ~(errors <= tolerance)
+    return {
+        "ok": not bad.any(),
+        "max_abs_error": float(np.nanmax(np.where(both_nan, 0.0, errors))) if errors.size else 0.0,
+        "mismatches": [
+            {"index": int(i), "expected": float(expected[i]), "actual": float(actual[i])}
+            for i in np.flatnonzero(bad)
+        ],
+    }
+
+
+def validate(raw_data_path, features_path, tolerance=DEFAULT_TOLERANCE, dsp_config=None):
+    """Check a features.csv written by the module against its input."""
+    expected = generate_features(read_values(raw_data_path), dsp_config)
+    return compare(expected, read_values(features_path), tolerance)
+
+
+def run_wasm(wasm_path, window, runtime="wasmtime"):
+    """Run the module's testailu() on one window with a WASI runtime and
+    return the features it wrote."""
+    with tempfile.TemporaryDirectory() as workdir:
+        with open(os.path.join(workdir, "accelerometer_data.csv"), "w") as f:
+            f.write(", ".join(f"{value:.2f}" for value in window))
+        result = subprocess.run(
+            [runtime, "run", "--dir", ".", "--invoke", "testailu", os.path.abspath(wasm_path)],
+            cwd=workdir, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            raise Exception(f"{runtime} failed: {result.stderr}")
+        return read_values(os.path.join(workdir, "features.csv"))
+
+
+def random_windows(count, window_length=312, axes=3, seed=0):
+    # Roughly accelerometer-like: gravity on the last axis plus noise, values
+    # rounded to 2 decimals like accelerometer_data.csv.
+    rng = np.random.default_rng(seed)
+    windows = rng.normal(0.0, 2.0, size=(count, window_length // axes, axes))
+    windows[..., -1] += 9.81
+    return np.round(windows.reshape(count, -1), 2)
+
+
+def benchmark(count, window_length=312, wasm_path=None, wasm_windows=20, runtime="wasmtime", dsp_config=None):
+    dsp_config = dsp_config or load_dsp_config()
+    windows = random_windows(count, window_length, dsp_config["axes"])
+
+    start = time.perf_counter()
+    features = generate_features(windows, dsp_config)
+    elapsed = time.perf_counter() - start
+    results = {
+        "windows": count,
+        "numpy_seconds": elapsed,
+        "numpy_windows_per_second": count / elapsed,
+    }
+
+    if wasm_path:
+        if not shutil.which(runtime):
+            raise Exception(f"WASI runtime '{runtime}' not found on PATH")
+        worst = 0.0
+        start = time.perf_counter()
+        for i in range(min(wasm_windows, count)):
+            # The module reads 2-decimal input and writes 4-decimal output.
+            check = compare(features[i], run_wasm(wasm_path, windows[i], runtime))
+            if not check["ok"]:
+                raise Exception(f"Window {i} differs from the module output: {check}")
+            worst = max(worst, check["max_abs_error"])
+        elapsed = time.perf_counter() - start
+        results.update(
+            wasm_windows=min(wasm_windows, count),
+            wasm_seconds=elapsed,
+            wasm_windows_per_second=min(wasm_windows, count) / elapsed,
+            max_abs_error=worst,
+        )
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsp-config", help=f"Rust constants file to read the parameters from "
+                        f"(default {DSP_CONFIG_PATH}, or {DEFAULT_DSP_CONFIG_PATH} without one)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    features_parser = commands.add_parser("features", help="print the features of one window")
+    features_parser.add_argument("raw_data", help="accelerometer_data.csv")
+
+    validate_parser = commands.add_parser("validate", help="check a features.csv written by the module")
+    validate_parser.add_argument("raw_data", help="accelerometer_data.csv given to the module")
+    validate_parser.add_argument("features", help="features.csv written by the module")
+    validate_parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+
+    benchmark_parser = commands.add_parser("benchmark", help="measure feature extraction throughput")
+    benchmark_parser.add_argument("--windows", type=int, default=10000)
+    benchmark_parser.add_argument("--window-length", type=int, default=312)
+    benchmark_parser.add_argument("--wasm", help="spectral_analysis.wasm to compare against")
+    benchmark_parser.add_argument("--wasm-windows", type=int, default=20, help="windows run through the module")
+    benchmark_parser.add_argument("--runtime", default="wasmtime", help="WASI runtime used to run the module")
+
+    args = parser.parse_args()
+    dsp_config = load_dsp_config(args.dsp_config)
+
+    if args.command == "features":
+        print(format_features(generate_features(read_values(args.raw_data), dsp_config)))
+
+    elif args.command == "validate":
+        result = validate(args.raw_data, args.features, args.tolerance, dsp_config)
+        if result["ok"]:
+            print(f"Features match (max abs error {result['max_abs_error']:.2e}).")
+        else:
+            print(f"Features differ: {result.get('error') or result['mismatches']}")
+            raise SystemExit(1)
+
+    else:
+        results = benchmark(args.windows, args.window_length, args.wasm, args.wasm_windows, args.runtime, dsp_config)
+        print(f"NumPy: {results['windows']} windows in {results['numpy_seconds']:.3f} s "
+              f"({results['numpy_windows_per_second']:.0f} windows/s)")
+        if "wasm_seconds" in results:
+            print(f"WASM:  {results['wasm_windows']} windows in {results['wasm_seconds']:.3f} s "
+                  f"({results['wasm_windows_per_second']:.1f} windows/s), "
+                  f"max abs error {results['max_abs_error']:.2e}")
+
+
+if __name__ == "__main__":
+    main()